@@ -1,21 +1,53 @@
+from __future__ import annotations
+
 import os
+import re
+import sys
 import gzip
 import shlex
 import time
-import requests
-import pandas as pd
-from io import BytesIO
+import threading
+import uuid
+import json
+import argparse
+import copy
+import logging
+import functools
+import multiprocessing
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone
-import pytz
-from urllib.parse import urlparse
-from user_agents import parse as ua_parse
-from dotenv import load_dotenv
+from urllib.parse import urlparse, uses_params
 
 from logger import get_logger
+from lazy import lazy_import
+from geo_local import load_ip_range_db
+from geo_cache import GeoCache, GEO_FIELDS
+from lru import LRUCache
+import sketches
+from instrumentation import RunReport, LogLevelCounter, parse_profile_option
+from string_dictionary import StringDictionary, concat_categoricals
+from spill import ShardSpiller, shard_of, concat_parquet_files
 logger = get_logger(__name__)
 
-# AWS S3 Configuration
-load_dotenv()
+# Heavy dependencies are imported on first use, so e.g. parse_log_entry-only consumers and
+# `--help` do not pay for pandas/pyarrow/boto3/requests at startup
+np       = lazy_import("numpy")
+pd       = lazy_import("pandas")
+pa       = lazy_import("pyarrow")
+pc       = lazy_import("pyarrow.compute")
+ds       = lazy_import("pyarrow.dataset")
+pq       = lazy_import("pyarrow.parquet")
+requests = lazy_import("requests")
+asyncio  = lazy_import("asyncio")
+pytz     = lazy_import("pytz")
+
+# AWS S3 Configuration. The .env file is only loaded when this file runs as a script;
+# importers configure the process environment themselves.
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
 AWS_ACCESS_KEY_ID     = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 AWS_BUCKET_NAME       = os.getenv("AWS_BUCKET_NAME")
@@ -25,19 +57,82 @@ AWS_REGION            = os.getenv("AWS_REGION", "us-west-2")
 OUTPUT_CLEANED        = "output/cleaned_logs"
 OUTPUT_AGG            = "output/aggregated_stats"
 OUTPUT_REPORTS        = "output/reports"
-GEO_CACHE_PATH        = os.path.join("output", "ip_geolocation_cache.parquet")
-EASTERN               = pytz.timezone("America/New_York")
-
-for folder in [OUTPUT_CLEANED, OUTPUT_AGG, OUTPUT_REPORTS, "output"]:
-    os.makedirs(folder, exist_ok=True)
-
-import boto3
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+GEO_CACHE_PATH        = os.path.join("output", "ip_geolocation_cache.parquet")  # legacy whole-file cache, imported once
+GEO_CACHE_DB_PATH     = os.path.join("output", "ip_geolocation_cache.sqlite")
+GEO_CACHE_TTL_DAYS    = float(os.getenv("GEO_CACHE_TTL_DAYS", "30"))
+GEO_CACHE_FAIL_TTL_HOURS = float(os.getenv("GEO_CACHE_FAIL_TTL_HOURS", "24"))      # failed lookups are retried sooner
+GEO_CACHE_MAX_ENTRIES = int(os.getenv("GEO_CACHE_MAX_ENTRIES", "2000000"))
+GEO_CACHE_MEMORY_ENTRIES = int(os.getenv("GEO_CACHE_MEMORY_ENTRIES", "50000"))
+SESSION_STATE_DIR     = os.path.join("output", "session_state")
+MANIFEST_PATH         = os.path.join("output", "processed_keys_manifest.parquet")
+LOG_BATCH_LINES       = int(os.getenv("LOG_BATCH_LINES", "50000"))
+ETL_PARSE_WORKERS     = int(os.getenv("ETL_PARSE_WORKERS", str(os.cpu_count() or 1)))  # processes streaming and parsing S3 objects
+ETL_LIST_WORKERS      = int(os.getenv("ETL_LIST_WORKERS", "8"))            # threads listing day prefixes
+ETL_START             = os.getenv("ETL_START", "")                          # log time range to process: ISO time/date
+ETL_END               = os.getenv("ETL_END", "")                            # or relative to now, e.g. ETL_START=-1d
+ELB_LOG_INTERVAL_MINUTES = int(os.getenv("ELB_LOG_INTERVAL_MINUTES", "5"))  # ELB delivery interval (file name = its end)
+ETL_SHARDS            = int(os.getenv("ETL_SHARDS", "0"))                  # out-of-core: client_ip hash shards (0 = in memory)
+ETL_SHARD_WORKERS     = int(os.getenv("ETL_SHARD_WORKERS", "1"))           # processes working on shards
+ETL_SPILL_DIR         = os.getenv("ETL_SPILL_DIR", os.path.join("output", "spill"))
+ETL_SPILL_BUFFER_ROWS = int(os.getenv("ETL_SPILL_BUFFER_ROWS", "100000"))  # parsed rows held before spilling to shards
+GEO_BACKEND           = os.getenv("GEO_BACKEND", "api")                     # "api" (ip-api.com + cache) or "local"
+GEO_DB_PATH           = os.getenv("GEO_DB_PATH", "")                        # IP-range CSV/.mmdb for GEO_BACKEND=local
+GEO_API_URL           = os.getenv("GEO_API_URL", "http://ip-api.com")
+GEO_API_FIELDS        = "status,message,country,countryCode,region,regionName,city,lat,lon,isp,query"
+GEO_BATCH_SIZE        = 100                                                  # ip-api batch endpoint limit
+GEO_RATE_PER_MINUTE   = float(os.getenv("GEO_RATE_PER_MINUTE", "15"))       # free tier: 15 batch requests/min
+GEO_CONCURRENCY       = int(os.getenv("GEO_CONCURRENCY", "4"))
+GEO_MAX_RETRIES       = int(os.getenv("GEO_MAX_RETRIES", "5"))
+GEO_BACKOFF_SECONDS   = float(os.getenv("GEO_BACKOFF_SECONDS", "1"))
+GEO_FLUSH_EVERY       = int(os.getenv("GEO_FLUSH_EVERY", "1"))              # batches between cache flushes
+# Geolocation fields attached to every log row; the per-IP bookkeeping (status, message, query,
+# api_fetch_timestamp) stays in the cache unless listed here
+GEO_ENRICH_FIELDS     = [f.strip() for f in os.getenv(
+    "GEO_ENRICH_FIELDS", "country,countryCode,region,regionName,city,lat,lon,isp").split(",") if f.strip()]
+GEO_COLUMN_NAMES      = {"country": "countryName"}                          # cache field -> log column
+CLEANED_COMPRESSION   = os.getenv("CLEANED_COMPRESSION", "zstd")
+CLEANED_ROW_GROUP_ROWS = int(os.getenv("CLEANED_ROW_GROUP_ROWS", "131072"))
+CLEANED_MAX_ROWS_PER_FILE = int(os.getenv("CLEANED_MAX_ROWS_PER_FILE", "2000000"))
+CLEANED_COMPACT_MIN_FILES = int(os.getenv("CLEANED_COMPACT_MIN_FILES", "8"))   # 0 disables compaction
+CLEANED_COMPACT_MAX_BYTES = int(os.getenv("CLEANED_COMPACT_MAX_BYTES", str(64 * 1024 * 1024)))
+HOURLY_PERCENTILES    = [float(q) for q in os.getenv("HOURLY_PERCENTILES", "").split(",") if q.strip()]  # e.g. "95,99"
+RUN_REPORT_DIR        = os.path.join("output", "run_reports")
+ETL_PROFILE           = os.getenv("ETL_PROFILE", "")                        # per-stage profilers: "cprofile,tracemalloc" or "all"
+UA_CACHE_PATH         = os.path.join("output", "user_agent_cache.parquet")
+UA_CACHE_SIZE         = int(os.getenv("UA_CACHE_SIZE", "100000"))
+BOT_KEYWORDS          = os.getenv("BOT_KEYWORDS", "bot,spider,crawler,python-urllib,googlebot").split(",")
+EASTERN_TZ            = "America/New_York"
+
+def ensure_output_dirs():
+    for folder in [OUTPUT_CLEANED, OUTPUT_AGG, OUTPUT_REPORTS, "output"]:
+        os.makedirs(folder, exist_ok=True)
+
+def new_s3_client():
+    import boto3
+    return boto3.client(
+        "s3",
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION
+    )
+
+# Shared client of the main thread, built on first use (tests and benchmarks may assign their own)
+s3 = None
+
+def get_s3_client():
+    global s3
+    if s3 is None:
+        s3 = new_s3_client()
+    return s3
+
+# boto3 clients are not shared between ingestion threads; each worker thread builds its own
+_worker_local = threading.local()
+
+def get_worker_s3_client():
+    client = getattr(_worker_local, "s3", None)
+    if client is None:
+        client = _worker_local.s3 = new_s3_client()
+    return client
 
 # COLUMN DEFINITIONS 
 ELB_LOG_COLUMNS = [
@@ -48,6 +143,35 @@ ELB_LOG_COLUMNS = [
     "target_port_list", "target_status_code_list", "classification", "classification_reason"
 ]
 
+# Low-cardinality fields kept as categoricals against the run's shared string dictionary
+CATEGORICAL_LOG_COLUMNS = [
+    "type", "elb", "target_ip_port", "ssl_cipher", "ssl_protocol", "target_group_arn", "domain_name",
+    "chosen_cert_arn", "matched_rule_priority", "actions_executed", "redirect_url", "error_reason",
+    "target_port_list", "target_status_code_list", "classification", "classification_reason", "user_agent",
+    "http_method", "http_version", "protocol", "hostname", "ua_browser_family", "ua_os_family", "log_source_file",
+]
+# Numeric fields, typed at parse time ("-" becomes missing)
+INT_LOG_COLUMNS   = {"elb_status_code": "Int16", "target_status_code": "Int16", "received_bytes": "Int64", "sent_bytes": "Int64"}
+FLOAT_LOG_COLUMNS = ["request_processing_time", "target_processing_time", "response_processing_time"]
+
+_string_dictionary = None
+
+def get_string_dictionary():
+    # One shared dictionary per run (per process for parse workers)
+    global _string_dictionary
+    if _string_dictionary is None:
+        _string_dictionary = StringDictionary()
+    return _string_dictionary
+
+# Precompiled tokenizer for batch parsing: a field is either "quoted" (may contain spaces) or a bare token
+ELB_TOKEN_RE   = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+ELB_ESCAPE_RE  = re.compile(r'\\([\\"$`])')
+ELB_REQUEST_RE = re.compile(r'^([^ ]*) ([^ ]*) (.*)$', re.DOTALL)
+ELB_URL_RE     = (
+    r'^([A-Za-z][A-Za-z0-9+.\-]*)://(?:[^@/?#]*@)?(\[[^\]/?#]*\]|[^:/?#]*)'
+    r'(?::([0-9]*))?([^?#]*)(?:\?([^#]*))?'
+)
+
 # Uitility / helper function
 def to_int(val):
     if val == '-' or val == "" or val is None:
@@ -61,19 +185,286 @@ def to_float(val):
     try: return float(val)
     except: return None
 
+@functools.cache
+def eastern():
+    # The EASTERN_TZ tzinfo, built on first use (pytz is imported lazily)
+    return pytz.timezone(EASTERN_TZ)
+
+def to_eastern_time(val):
+    # ELB writes UTC timestamps with or without fractional seconds
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
+        try:
+            dt_naive = datetime.strptime(val, fmt)
+            return dt_naive.replace(tzinfo=timezone.utc).astimezone(eastern())
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def parse_elb_timestamps(values):
+    # Vectorized to_eastern_time: fractional-second format first, whole-second format for the rest.
+    # Returns (tz-aware America/New_York datetime64 Series, count of unparseable values)
+    raw = pd.Series(values)
+    parsed = pd.to_datetime(raw, format="%Y-%m-%dT%H:%M:%S.%fZ", errors="coerce", utc=True)
+    retry = parsed.isna() & raw.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(raw[retry], format="%Y-%m-%dT%H:%M:%SZ", errors="coerce", utc=True)
+    return parsed.dt.tz_convert(eastern()), int(parsed.isna().sum())
+
+def compile_bot_matcher(keywords):
+    # One case-insensitive alternation instead of a substring scan per keyword
+    keywords = [k.strip() for k in keywords if k.strip()]
+    return re.compile("|".join(re.escape(k) for k in keywords), re.IGNORECASE) if keywords else None
+
+BOT_MATCHER = compile_bot_matcher(BOT_KEYWORDS)
+
+def is_bot_user_agent(ua_str, matcher=None):
+    matcher = matcher or BOT_MATCHER
+    return bool(matcher is not None and matcher.search(ua_str))
+
+# USER-AGENT CACHE: parsed (browser, os) families per UA string, bounded and persisted between runs
+_ua_cache = None
+_ua_cache_new = {}     # entries classified since the last take_new_ua_entries() (parse workers report them)
+
+def get_ua_cache():
+    global _ua_cache
+    if _ua_cache is None:
+        _ua_cache = LRUCache(UA_CACHE_SIZE)
+        try:
+            if os.path.exists(UA_CACHE_PATH):
+                df = pd.read_parquet(UA_CACHE_PATH)
+                for ua_str, browser, os_family in df[["user_agent", "ua_browser_family", "ua_os_family"]].itertuples(index=False):
+                    _ua_cache.put(ua_str, (browser, os_family))
+        except Exception as e:
+            logger.error(f"Error loading user-agent cache: {e}")
+    return _ua_cache
+
+def save_ua_cache():
+    try:
+        if _ua_cache is None or not len(_ua_cache):
+            return
+        rows = [(ua_str, browser, os_family) for ua_str, (browser, os_family) in _ua_cache.items()]
+        pd.DataFrame(rows, columns=["user_agent", "ua_browser_family", "ua_os_family"]).to_parquet(UA_CACHE_PATH, index=False)
+    except Exception as e:
+        logger.error(f"Error saving user-agent cache: {e}")
+
+def take_new_ua_entries():
+    # {ua: (browser, os)} classified in this process since the last call
+    global _ua_cache_new
+    entries, _ua_cache_new = _ua_cache_new, {}
+    return entries
+
+def merge_ua_entries(entries):
+    # Entries classified by parse workers, so the parent's cache (the one saved) learns them too
+    cache = get_ua_cache()
+    for ua_str, families in entries.items():
+        cache.put(ua_str, families)
+
+def ua_parse(ua_str):
+    from user_agents import parse
+    return parse(ua_str)
+
+def parse_user_agent_families(ua_str):
+    cache = get_ua_cache()
+    families = cache.get(ua_str)
+    if families is None:
+        ua = ua_parse(ua_str)
+        families = (ua.browser.family or "Unknown", ua.os.family or "Unknown")
+        cache.put(ua_str, families)
+        _ua_cache_new[ua_str] = families
+    return families
+
+def classify_user_agent(ua_str):
+    ua_str = ua_str.strip('"')
+    if ua_str and ua_str != "-":
+        browser_family, os_family = parse_user_agent_families(ua_str)
+        return browser_family, os_family, is_bot_user_agent(ua_str)
+    return "Unknown", "Unknown", False
+
+def add_user_agent_features(user_agents: pd.Series):
+    # Classify each distinct UA string once and map the results back by code:
+    # categorical ua_browser_family / ua_os_family and a boolean is_bot
+    codes, uniques = pd.factorize(user_agents, use_na_sentinel=False)
+    classified = [classify_user_agent(ua) if isinstance(ua, str) else ("Unknown", "Unknown", False) for ua in uniques]
+    if not classified:
+        classified = [("Unknown", "Unknown", False)]
+    browsers, os_families, bots = zip(*classified)
+    features = {}
+    for name, values in (("ua_browser_family", browsers), ("ua_os_family", os_families)):
+        value_codes, categories = pd.factorize(pd.Series(values, dtype=object))
+        features[name] = pd.Categorical.from_codes(value_codes[codes], categories=categories)
+    features["is_bot"] = np.asarray(bots, dtype=bool)[codes]
+    return pd.DataFrame(features, index=user_agents.index)
+
 # EXTRACT: get .gz keys from S3
-def extract_log_keys(bucket, prefix=''):
+def _log_object(obj):
+    return {
+        "key": obj['Key'],
+        "etag": obj.get('ETag', '').strip('"'),
+        "size": int(obj.get('Size', 0)),
+        "last_modified": pd.Timestamp(obj['LastModified']) if obj.get('LastModified') else pd.NaT,
+    }
+
+def extract_log_objects(bucket, prefix=''):
+    # Like extract_log_keys, but keeps the metadata the processed-key manifest compares against
     try:
-        paginator = s3.get_paginator('list_objects_v2')
-        keys = []
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+        objects = []
         for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-            keys += [obj['Key'] for obj in page.get('Contents', []) if obj['Key'].endswith('.gz')]
-        logger.info(f"Extracted {len(keys)} log keys from S3 bucket {bucket}.")
-        return keys
+            objects += [_log_object(obj) for obj in page.get('Contents', []) if obj['Key'].endswith('.gz')]
+        logger.info(f"Extracted {len(objects)} log keys from S3 bucket {bucket}.")
+        return objects
     except Exception as e:
         logger.error(f"Error extracting log keys: {e}")
         return []
 
+def extract_log_keys(bucket, prefix=''):
+    return [obj["key"] for obj in extract_log_objects(bucket, prefix)]
+
+# Time-range listing over the ELB layout <prefix>/AWSLogs/<account>/elasticloadbalancing/<region>/YYYY/MM/DD/,
+# where each file name carries the end of its delivery interval: ..._<region>_<lb>_YYYYMMDDTHHMMZ_<ip>_<rand>.log.gz
+ELB_REGION_PREFIX_RE = re.compile(r"AWSLogs/\d+/elasticloadbalancing/[^/]+/$")
+ELB_KEY_TIME_RE      = re.compile(r"_(\d{8}T\d{4})Z_[^/]*$")
+
+def parse_time_bound(value):
+    # Timestamp or ISO date/time (naive = UTC), or relative to now: "-1d", "-6h". None/empty -> None
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("-"):
+            return pd.Timestamp.now(tz="UTC") - pd.Timedelta(re.sub(r"d$", "D", value[1:]))
+    if value is None or value == "":
+        return None
+    ts = pd.Timestamp(value)
+    return ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+
+def log_key_time(key):
+    # UTC end of the delivery interval encoded in an ELB log file name, or None
+    match = ELB_KEY_TIME_RE.search(key)
+    return pd.Timestamp(match.group(1), tz="UTC") if match else None
+
+def _child_prefixes(client, bucket, prefix):
+    children = []
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+        children += [p["Prefix"] for p in page.get("CommonPrefixes", [])]
+    return children
+
+def elb_region_prefixes(bucket, prefix=''):
+    # The AWSLogs/<account>/elasticloadbalancing/<region>/ prefixes at or below `prefix`, or None if
+    # `prefix` points inside a region (e.g. at a year) or holds no such layout and cannot be pruned by day
+    if ELB_REGION_PREFIX_RE.search(prefix):
+        return [prefix]
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    if "AWSLogs/" not in prefix:
+        prefix += "AWSLogs/"
+    parts = [p for p in prefix.split("AWSLogs/", 1)[1].split("/") if p]
+    if len(parts) > 3 or (len(parts) >= 2 and parts[1] != "elasticloadbalancing"):
+        return None
+    prefixes = [prefix]
+    if len(parts) == 0:
+        prefixes = [p for root in prefixes for p in _child_prefixes(get_s3_client(), bucket, root)]  # accounts
+    if len(parts) <= 1:
+        prefixes = [p + "elasticloadbalancing/" for p in prefixes]
+    regions = [p for root in prefixes for p in _child_prefixes(get_s3_client(), bucket, root)]          # regions
+    # Nothing in the AWSLogs layout (e.g. logs copied to a flat prefix): list the prefix itself
+    return regions or None
+
+def elb_day_prefixes(region_prefixes, start, end):
+    # One <region>/YYYY/MM/DD/ prefix per UTC day that can hold files of [start, end)
+    # (a file is named after the end of its interval, so the last day extends by one interval)
+    last = end + pd.Timedelta(minutes=ELB_LOG_INTERVAL_MINUTES)
+    days = pd.date_range(start.floor("D"), last.floor("D"), freq="D")
+    return [f"{root}{day:%Y/%m/%d}/" for root in region_prefixes for day in days]
+
+def list_log_objects(bucket, prefix, start=None, end=None):
+    # Runs on a listing thread: the .gz objects under one prefix whose file-name time falls in the range.
+    # Keys without a parseable time are kept.
+    interval = pd.Timedelta(minutes=ELB_LOG_INTERVAL_MINUTES)
+    try:
+        objects = []
+        for page in get_worker_s3_client().get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if not obj['Key'].endswith('.gz'):
+                    continue
+                ts = log_key_time(obj['Key'])
+                if ts is not None and ((start is not None and ts < start) or (end is not None and ts >= end + interval)):
+                    continue
+                objects.append(_log_object(obj))
+        return objects
+    except Exception as e:
+        logger.error(f"Error listing s3://{bucket}/{prefix}: {e}")
+        return []
+
+def iter_log_objects(bucket, prefix='', start=None, end=None, workers=ETL_LIST_WORKERS):
+    # Lazily yields the log objects of [start, end): only the matching day prefixes are listed,
+    # `workers` at a time, and each prefix's objects are yielded (in prefix order) as soon as it is listed
+    start, end = parse_time_bound(start), parse_time_bound(end)
+    try:
+        regions = elb_region_prefixes(bucket, prefix)
+    except Exception as e:
+        logger.error(f"Error discovering ELB log prefixes under s3://{bucket}/{prefix}: {e}")
+        return
+    if regions is None:
+        prefixes = [prefix]
+    elif start is None:
+        prefixes = regions
+    else:
+        prefixes = elb_day_prefixes(regions, start, end if end is not None else pd.Timestamp.now(tz="UTC"))
+    logger.info(f"Listing {len(prefixes)} prefix(es) of s3://{bucket}/{prefix} for {start} .. {end}")
+    queued = iter(prefixes)
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        pending = deque(pool.submit(list_log_objects, bucket, p, start, end) for p in islice(queued, 2 * max(workers, 1)))
+        while pending:
+            objects = pending.popleft().result()
+            nxt = next(queued, None)
+            if nxt is not None:
+                pending.append(pool.submit(list_log_objects, bucket, nxt, start, end))
+            yield from objects
+
+# INCREMENTAL RUNS: manifest of already processed S3 objects
+def load_manifest():
+    columns = ["key", "etag", "size", "last_modified", "processed_at"]
+    try:
+        if os.path.exists(MANIFEST_PATH):
+            df = pd.read_parquet(MANIFEST_PATH)
+            if "key" in df.columns:
+                return df.set_index("key")
+        return pd.DataFrame(columns=columns).set_index("key")
+    except Exception as e:
+        logger.error(f"Error loading processed-key manifest: {e}")
+        return pd.DataFrame(columns=columns).set_index("key")
+
+def is_new_log_object(obj, manifest):
+    # A key not processed yet. ELB never rewrites a delivered log object, so a key whose ETag, size or
+    # last-modified changed is skipped with a warning: its earlier rows are already in the outputs and
+    # ingesting it again would count them twice.
+    if obj["key"] not in manifest.index:
+        return True
+    seen = manifest.loc[obj["key"]]
+    if (seen["etag"] != obj["etag"] or int(seen["size"]) != obj["size"]
+            or pd.Timestamp(seen["last_modified"]) != pd.Timestamp(obj["last_modified"])):
+        logger.warning(f"{obj['key']} changed since it was processed at {seen['processed_at']}; skipping it")
+    return False
+
+def select_new_log_objects(objects, manifest):
+    return [obj for obj in objects if is_new_log_object(obj, manifest)]
+
+def update_manifest(manifest, objects):
+    try:
+        if not objects:
+            return manifest
+        df_new = pd.DataFrame(objects).set_index("key")
+        df_new["processed_at"] = pd.Timestamp.now(tz='UTC')
+        manifest = pd.concat([manifest[~manifest.index.isin(df_new.index)], df_new])
+        manifest.reset_index().to_parquet(MANIFEST_PATH, index=False)
+        logger.info(f"Recorded {len(df_new)} processed key(s) in {MANIFEST_PATH}")
+        return manifest
+    except Exception as e:
+        logger.error(f"Error updating processed-key manifest: {e}")
+        return manifest
+
+def new_run_id():
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+
 def parse_log_entry(line: str, source_file: str):
     try:
         parts = shlex.split(line)
@@ -83,15 +474,7 @@ def parse_log_entry(line: str, source_file: str):
         
         # PARSE AND ENRICH LOG ENTRY        
         # Timestamp - convert to Eastern Time
-        est_time = None
-        for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
-            try:
-                dt_naive = datetime.strptime(entry["time"], fmt)
-                dt_utc   = dt_naive.replace(tzinfo=timezone.utc)
-                est_time = dt_utc.astimezone(EASTERN)
-                break
-            except ValueError:
-                continue
+        est_time = to_eastern_time(entry["time"])
         if est_time is None: 
             logger.warning(f"Invalid timestamp in {source_file}: {entry['time']}")
             return None
@@ -120,15 +503,7 @@ def parse_log_entry(line: str, source_file: str):
             method, full_url, version = "Unknown", "", ""
             protocol = hostname = port_ = path_ = query_params = None
         # USER-AGEN -  get full then families
-        ua_str = entry["user_agent"].strip('"')
-        if ua_str and ua_str != "-":
-            ua = ua_parse(ua_str)
-            browser_family = ua.browser.family or "Unknown"
-            os_family      = ua.os.family or "Unknown"
-            is_bot_flag = any(t in ua_str.lower() for t in ["bot", "spider", "crawler", "python-urllib", "googlebot"])
-        else:
-            browser_family = os_family = "Unknown"
-            is_bot_flag = False
+        browser_family, os_family, is_bot_flag = classify_user_agent(entry["user_agent"])
         # --- Compose row ---
         row = dict(entry)
         row.update({
@@ -151,115 +526,484 @@ def parse_log_entry(line: str, source_file: str):
     except Exception as e:
         logger.error(f"Error parsing log entry: {e}")
         return None
+
+def _split_request_urls(full_url: pd.Series):
+    # Regex split of "scheme://host:port/path?query" with urlparse's results; anything else (ports out
+    # of range included) goes through urlparse. Returns (parts, mask of the URLs urlparse rejects).
+    parts = full_url.str.extract(ELB_URL_RE)
+    parts.columns = ["protocol", "hostname", "port", "path", "query_params"]
+    parts["protocol"] = parts["protocol"].str.lower()
+    parts["hostname"] = parts["hostname"].str.strip("[]").str.lower().replace("", None)
+    parts["port"] = pd.to_numeric(parts["port"].replace("", None), errors="coerce")
+    parts["query_params"] = parts["query_params"].fillna("")
+    # urlparse drops ";params" from the last path segment for the schemes that have them
+    has_params = parts["protocol"].isin(uses_params) & parts["path"].str.contains(";", regex=False, na=False)
+    parts.loc[has_params, "path"] = parts.loc[has_params, "path"].str.replace(r";[^/]*$", "", regex=True)
+    parts.loc[parts["port"] > 65535, "protocol"] = None
+    rejected = np.zeros(len(parts), dtype=bool)
+    for pos in np.flatnonzero(parts["protocol"].isna().to_numpy()):
+        try:
+            up = urlparse(full_url.iloc[pos])
+            parts.iloc[pos] = [up.scheme, up.hostname, up.port, up.path, up.query]
+        except Exception:
+            parts.iloc[pos] = [None, None, None, None, None]
+            rejected[pos] = True
+    return parts, rejected
+
+def parse_log_batch(lines, source_file: str):
+    # Batch equivalent of parse_log_entry: tokenize every line once, then derive fields column-wise.
+    # Returns (DataFrame, rejected_line_count)
+    n_cols   = len(ELB_LOG_COLUMNS)
+    findall  = ELB_TOKEN_RE.findall
+    unescape = ELB_ESCAPE_RE.sub
+    rows     = []
+    rejected = 0
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        tokens = findall(line)
+        if len(tokens) < n_cols:
+            if line.strip():
+                rejected += 1
+            continue
+        rows.append([bare or (quoted if "\\" not in quoted else unescape(r"\1", quoted))
+                     for quoted, bare in tokens[:n_cols]])
+    if not rows:
+        return pd.DataFrame(), rejected
+
+    strings = get_string_dictionary()
+    columns = {}
+    for name, values in zip(ELB_LOG_COLUMNS, zip(*rows)):
+        values = np.array(values, dtype=object)
+        if name in CATEGORICAL_LOG_COLUMNS:
+            values = strings.encode(name, values)
+        columns[name] = values
+    del rows
+
+    # Timestamps - parsed for the whole batch at once; rows with an unparseable time are rejected
+    df = pd.DataFrame(columns)
+    del columns
+    df["time"], invalid_times = parse_elb_timestamps(df["time"])
+    if invalid_times:
+        rejected += invalid_times
+        df = df[df["time"].notna()].reset_index(drop=True)
+        if df.empty:
+            return pd.DataFrame(), rejected
+    df["request_creation_time"], _ = parse_elb_timestamps(df["request_creation_time"])
+
+    # Client IP
+    df["client_ip"] = df["client_ip_port"].str.split(":", n=1).str[0].astype("str")
+
+    # Typed numeric fields; the total processing time is only set when all three are numeric
+    for name, dtype in INT_LOG_COLUMNS.items():
+        df[name] = to_int_column(df[name]).astype(dtype)
+    for name in FLOAT_LOG_COLUMNS:
+        df[name] = pd.to_numeric(df[name], errors="coerce")
+    total_s = df["request_processing_time"] + df["target_processing_time"] + df["response_processing_time"]
+    df["total_processing_time_ms"] = (total_s * 1000).round(3)
+
+    # Request parse
+    request = df["request"].str.extract(ELB_REQUEST_RE)
+    request.columns = ["http_method", "full_url", "http_version"]
+    unknown = request["http_method"].isna()
+    request.loc[unknown, ["http_method", "full_url", "http_version"]] = ["Unknown", "", ""]
+    url_parts, rejected_urls = _split_request_urls(request["full_url"])
+    # parse_log_entry treats a URL urlparse rejects (e.g. a port out of range) as an unknown request
+    unknown = unknown | rejected_urls
+    request.loc[unknown, ["http_method", "full_url", "http_version"]] = ["Unknown", "", ""]
+    url_parts.loc[unknown] = None
+
+    # User agent - one classification per distinct string in the batch
+    ua_features = add_user_agent_features(df["user_agent"])
+
+    derived = pd.DataFrame({
+        "client_ip": df.pop("client_ip"),
+        "http_method": strings.encode("http_method", request["http_method"]),
+        "full_url": request["full_url"],
+        "http_version": strings.encode("http_version", request["http_version"]),
+        "protocol": strings.encode("protocol", url_parts["protocol"]),
+        "hostname": strings.encode("hostname", url_parts["hostname"]),
+        "port": url_parts["port"].astype("Int32"),
+        "path": url_parts["path"],
+        "query_params": url_parts["query_params"],
+        "total_processing_time_ms": df.pop("total_processing_time_ms"),
+        "ua_browser_family": strings.encode("ua_browser_family", ua_features["ua_browser_family"]),
+        "ua_os_family": strings.encode("ua_os_family", ua_features["ua_os_family"]),
+        "is_bot": ua_features["is_bot"],
+        "log_source_file": strings.encode("log_source_file", np.full(len(df), source_file, dtype=object)),
+    }, index=df.index)
+    return pd.concat([df, derived], axis=1), rejected
     
-def transform_elb_logs(bucket: str, keys: list):
+def new_ingest_stats():
+    return {"bytes_read": 0, "lines_read": 0, "rejected_lines": 0}
+
+def iter_log_batches(fileobj, source_file: str, batch_size: int = LOG_BATCH_LINES, stats=None):
+    # Decompress a gzip stream incrementally and parse it batch_size lines at a time;
+    # line counts are added to `stats` (see new_ingest_stats) when given
+    rejected = 0
+    with gzip.GzipFile(fileobj=fileobj) as gz:
+        while True:
+            lines = list(islice(gz, batch_size))
+            if not lines:
+                break
+            df_batch, batch_rejected = parse_log_batch(lines, source_file)
+            rejected += batch_rejected
+            if stats is not None:
+                stats["lines_read"] += len(lines)
+                stats["rejected_lines"] += batch_rejected
+            if not df_batch.empty:
+                yield df_batch
+    if rejected:
+        logger.warning(f"Rejected {rejected} malformed line(s) in {source_file}")
+
+def stream_elb_logs(bucket: str, keys: list, batch_size: int = LOG_BATCH_LINES, stats=None):
+    # Generator of parsed DataFrame batches; the S3 body is read as a stream, never buffered whole
+    for key in keys:
+        logger.info(f"Parsing: s3://{bucket}/{key}")
+        obj = get_s3_client().get_object(Bucket=bucket, Key=key)
+        if stats is not None:
+            stats["bytes_read"] += obj.get("ContentLength", 0)
+        yield from iter_log_batches(obj["Body"], key, batch_size, stats)
+
+def concat_log_batches(batches):
+    # Like pd.concat, but categorical columns stay categorical (pd.concat falls back to object
+    # whenever the categories differ, e.g. between parse processes)
+    frames = [df for df in batches if not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    categorical = [
+        col for col in frames[0].columns
+        if all(col in df and isinstance(df[col].dtype, pd.CategoricalDtype) for df in frames)
+    ]
+    df = pd.concat([df.drop(columns=categorical) for df in frames], ignore_index=True)
+    for col in categorical:
+        df[col] = concat_categoricals([f[col] for f in frames])
+    return df[frames[0].columns]
+
+def memory_report(df):
+    # In-memory size per column (string payloads included), largest first
+    usage = df.memory_usage(deep=True, index=False)
+    return pd.DataFrame({
+        "dtype": df.dtypes.astype(str),
+        "bytes": usage,
+        "bytes_per_row": usage / max(len(df), 1),
+    }).sort_values("bytes", ascending=False)
+
+def parse_log_object(bucket: str, key: str, batch_size: int = LOG_BATCH_LINES, client=None):
+    # Streams one object into a frame, decompressing and parsing batch_size lines at a time (the body is
+    # never read whole), with the thread's own client unless one is given. Its ingest stats and the user
+    # agents it classified travel back with the frame in df.attrs["ingest_stats"] / ["ua_cache_entries"].
+    obj = (client or get_worker_s3_client()).get_object(Bucket=bucket, Key=key)
+    stats = new_ingest_stats()
+    stats["bytes_read"] = obj.get("ContentLength", 0)
     try:
-        records = []
+        df = concat_log_batches(iter_log_batches(obj["Body"], key, batch_size, stats))
+    finally:
+        obj["Body"].close()
+    df.attrs["ingest_stats"] = stats
+    df.attrs["ua_cache_entries"] = take_new_ua_entries()
+    return df
+
+def _init_parse_worker(client_factory):
+    # Parse processes are spawned, so they start from a fresh import: give them the parent's S3 client
+    # factory (a picklable callable) for the clients they stream their objects with
+    global new_s3_client
+    new_s3_client = client_factory
+
+def ingest_log_keys(bucket: str, keys, parse_workers: int = ETL_PARSE_WORKERS):
+    # Parses keys in a pool of parse processes, each streaming its objects with its own client, so the
+    # downloads of some objects overlap the parsing of others; with one worker they are streamed here.
+    # Yields (key, DataFrame, error) in the order of `keys` (any iterable, consumed lazily, so a lister
+    # can still be running); a failed key yields (key, None, error) and does not affect the others.
+    if parse_workers <= 1:
         for key in keys:
-            obj = s3.get_object(Bucket=bucket, Key=key)
-            body = obj["Body"].read()
-            with gzip.GzipFile(fileobj=BytesIO(body)) as gz:
-                for raw_line in gz:
-                    line = raw_line.decode("utf-8").strip()
-                    parsed = parse_log_entry(line, key)
-                    if parsed:
-                        records.append(parsed)
-        df = pd.DataFrame(records)
-        return df
+            try:
+                yield key, parse_log_object(bucket, key, LOG_BATCH_LINES, get_s3_client()), None
+            except Exception as e:
+                logger.error(f"Failed to ingest s3://{bucket}/{key}: {e}")
+                yield key, None, e
+        return
+
+    # Spawned, not forked: the listing, report and sampler threads are already running here
+    pool = ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_parse_worker, initargs=(new_s3_client,))
+    # Bound the parsed frames waiting to be released in order
+    max_in_flight = 2 * parse_workers
+    results  = {}
+    next_out = 0
+    pending  = {}
+    queued   = iter(enumerate(keys))
+    try:
+        def submit_parses():
+            while len(pending) < max_in_flight:
+                nxt = next(queued, None)
+                if nxt is None:
+                    return
+                i, key = nxt
+                pending[pool.submit(parse_log_object, bucket, key, LOG_BATCH_LINES)] = (i, key)
+
+        submit_parses()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                i, key = pending.pop(fut)
+                try:
+                    results[i] = (key, fut.result(), None)
+                except Exception as e:
+                    logger.error(f"Failed to ingest s3://{bucket}/{key}: {e}")
+                    results[i] = (key, None, e)
+            submit_parses()
+            # Release finished keys in input order
+            while next_out in results:
+                yield results.pop(next_out)
+                next_out += 1
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+def transform_elb_logs(bucket: str, keys: list):
+    try:
+        return concat_log_batches(stream_elb_logs(bucket, keys))
     except Exception as e:
         logger.error(f"Error transforming ELB logs: {e}")
         return pd.DataFrame()
         
 # GEOLOCATION ENRICHMENT WITH CACHE 
-def fetch_geolocation(ip):
+def _geo_record(data, ip):
+    # Normalize one API answer to the cache row layout
+    if data.get('status') == 'success':
+        data = dict(data)
+        data['api_fetch_timestamp'] = pd.Timestamp.now(tz='UTC')
+        return data
+    # On error, store minimal info for cache
+    return {
+        'status': 'fail',
+        'message': data.get('message', 'API Error'),
+        'query': ip,
+        'country': None, 'countryCode': None, 'region': None, 'regionName': None,
+        'city': None, 'lat': None, 'lon': None, 'isp': None, 'api_fetch_timestamp': pd.Timestamp.now(tz='UTC')
+    }
+
+# Geolocation API calls made by this process (read as deltas by the run report)
+GEO_API_STATS = {"api_requests": 0, "api_retries": 0, "api_failed_batches": 0}
+
+def fetch_geolocation(ip, max_retries=GEO_MAX_RETRIES):
     try:
-        url = f"http://ip-api.com/json/{ip}?fields=status,message,country,countryCode,region,regionName,city,lat,lon,isp,query"
-        resp = requests.get(url, timeout=5)
-        if resp.status_code == 429:   # Rate limit
-            time.sleep(1)
-            return fetch_geolocation(ip)
-        data = resp.json()
-        if data.get('status') == 'success':
-            data['api_fetch_timestamp'] = pd.Timestamp.now(tz='UTC')
-            return data
-        else:
-            # On error, store minimal info for cache
-            return {
-                'status': 'fail',
-                'message': data.get('message', 'API Error'),
-                'query': ip,
-                'country': None, 'countryCode': None, 'region': None, 'regionName': None,
-                'city': None, 'lat': None, 'lon': None, 'isp': None, 'api_fetch_timestamp': pd.Timestamp.now(tz='UTC')
-            }
+        url = f"{GEO_API_URL}/json/{ip}?fields={GEO_API_FIELDS}"
+        for attempt in range(max_retries + 1):
+            GEO_API_STATS["api_requests"] += 1
+            GEO_API_STATS["api_retries"] += attempt > 0
+            resp = requests.get(url, timeout=5)
+            if resp.status_code != 429:   # Rate limit
+                break
+            time.sleep(min(GEO_BACKOFF_SECONDS * 2 ** attempt, 60))
+        resp.raise_for_status()
+        return _geo_record(resp.json(), ip)
     except Exception as e:
         logger.error(f"Error fetching geolocation for {ip}: {e}")
-        return {
-            'status': 'fail', 'message': str(e), 'query': ip, 'country': None, 'countryCode': None, 'region': None,
-            'regionName': None, 'city': None, 'lat': None, 'lon': None, 'isp': None, 'api_fetch_timestamp': pd.Timestamp.now(tz='UTC')
-        }
+        return _geo_record({'status': 'fail', 'message': str(e)}, ip)
 
-def load_geo_cache():
-    # Ensure 'query' is in columns so set_index('query') never fails
-    columns = [
-        "status", "message", "country", "countryCode", "region", "regionName", "city",
-        "lat", "lon", "isp", "query", "api_fetch_timestamp"
-    ]
-    try:
-        if os.path.exists(GEO_CACHE_PATH):
-            df = pd.read_parquet(GEO_CACHE_PATH)
-            if not df.empty:
-                # If 'query' already the index, just return it
-                if df.index.name == "query":
-                    return df
-                elif "query" in df.columns:
-                    return df.set_index("query")
+class TokenBucket:
+    # Async token bucket; the provider's X-Rl/X-Ttl headers override the local estimate
+    def __init__(self, rate_per_second, capacity=1):
+        self.rate = rate_per_second
+        self.capacity = max(capacity, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
                 else:
-                    # Defensive: create missing column if needed
-                    df["query"] = None
-                    return df.set_index("query")
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def update_from_headers(self, headers):
+        try:
+            remaining = int(headers.get("X-Rl", ""))
+            reset_s   = float(headers.get("X-Ttl", "0"))
+        except ValueError:
+            return
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, remaining)
+        if remaining <= 0:
+            self.blocked_until = max(self.blocked_until, now + reset_s)
+
+async def _fetch_geo_batch(session, bucket, url, ips, max_retries, backoff):
+    error = None
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        GEO_API_STATS["api_requests"] += 1
+        GEO_API_STATS["api_retries"] += attempt > 0
+        try:
+            resp = await asyncio.to_thread(
+                session.post, url, params={"fields": GEO_API_FIELDS}, json=list(ips), timeout=10
+            )
+            bucket.update_from_headers(resp.headers)
+            if resp.status_code == 429 or resp.status_code >= 500:
+                error = f"HTTP {resp.status_code}"
             else:
-                # empty file
-                df = pd.DataFrame(columns=columns)
-                return df.set_index("query")
-        else:
-            df = pd.DataFrame(columns=columns)
-            return df.set_index("query")
+                resp.raise_for_status()
+                return [_geo_record(item, ip) for item, ip in zip(resp.json(), ips)]
+        except Exception as e:
+            error = str(e)
+        if attempt < max_retries:
+            await asyncio.sleep(min(backoff * 2 ** attempt, 60))
+    GEO_API_STATS["api_failed_batches"] += 1
+    logger.error(f"Geolocation batch of {len(ips)} IPs failed after {max_retries + 1} attempt(s): {error}")
+    return [_geo_record({'status': 'fail', 'message': error}, ip) for ip in ips]
+
+async def fetch_geolocations_async(ips, api_url=None, on_batch=None, rate_per_minute=None,
+                                   concurrency=None, max_retries=None, backoff=None):
+    api_url         = api_url or GEO_API_URL
+    rate_per_minute = rate_per_minute or GEO_RATE_PER_MINUTE
+    concurrency     = concurrency or GEO_CONCURRENCY
+    max_retries     = GEO_MAX_RETRIES if max_retries is None else max_retries
+    backoff         = GEO_BACKOFF_SECONDS if backoff is None else backoff
+
+    batches = [ips[i:i + GEO_BATCH_SIZE] for i in range(0, len(ips), GEO_BATCH_SIZE)]
+    bucket  = TokenBucket(rate_per_minute / 60.0, capacity=concurrency)
+    gate    = asyncio.Semaphore(concurrency)
+    results = []
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        async def run(batch):
+            async with gate:
+                return await _fetch_geo_batch(session, bucket, f"{api_url}/batch", batch, max_retries, backoff)
+
+        for done in asyncio.as_completed([run(batch) for batch in batches]):
+            records = await done
+            results.extend(records)
+            if on_batch is not None:
+                on_batch(records)
+    return results
+
+def fetch_geolocations(ips, **kwargs):
+    # Batched (GEO_BATCH_SIZE IPs per request), rate-limited lookup of many IPs
+    ips = list(ips)
+    if not ips:
+        return []
+    return asyncio.run(fetch_geolocations_async(ips, **kwargs))
+
+_geo_cache_store = None
+
+def get_geo_cache():
+    # Keyed SQLite geolocation cache, opened once per process
+    global _geo_cache_store
+    if _geo_cache_store is None:
+        store = GeoCache(
+            GEO_CACHE_DB_PATH,
+            ttl_seconds=GEO_CACHE_TTL_DAYS * 86400,
+            fail_ttl_seconds=GEO_CACHE_FAIL_TTL_HOURS * 3600,
+            max_entries=GEO_CACHE_MAX_ENTRIES,
+            memory_entries=GEO_CACHE_MEMORY_ENTRIES,
+        )
+        if len(store) == 0 and os.path.exists(GEO_CACHE_PATH):
+            store.import_parquet(GEO_CACHE_PATH)
+        expired = store.purge_expired()
+        if expired:
+            logger.info(f"Expired {expired} stale geolocation cache entries")
+        _geo_cache_store = store
+    return _geo_cache_store
+
+def load_geo_cache(ips):
+    # Cached rows (indexed by "query") for the given IPs only
+    try:
+        return get_geo_cache().get_many(list(ips))
     except Exception as e:
         logger.error(f"Error loading geolocation cache: {e}")
-        return pd.DataFrame(columns=columns).set_index("query")
+        return pd.DataFrame(columns=GEO_FIELDS).set_index("query")
+
+def save_geo_cache(geo_cache, records):
+    get_geo_cache().put_many(records)
+    df_new = pd.DataFrame(records).set_index("query")
+    geo_cache = pd.concat([geo_cache, df_new]) if not geo_cache.empty else df_new
+    return geo_cache[~geo_cache.index.duplicated(keep='last')]
+
+_local_geo_db = None
+
+def get_local_geo_db():
+    # Offline IP-range database (GEO_BACKEND=local), loaded once per process
+    global _local_geo_db
+    if _local_geo_db is None:
+        if not GEO_DB_PATH:
+            raise ValueError("GEO_BACKEND=local requires GEO_DB_PATH (CSV or .mmdb IP-range database)")
+        _local_geo_db = load_ip_range_db(GEO_DB_PATH)
+    return _local_geo_db
+
+def lookup_geolocations(ips):
+    # Geolocation rows indexed by IP for the distinct IPs in `ips`, from the configured backend
+    if GEO_BACKEND == "local":
+        return get_local_geo_db().lookup(ips)
 
-def enrich_with_geolocation(df_logs):
-    # Load existing cache
+    # Load the cached entries of this batch's IPs
+    all_ips = pd.unique(pd.Series(ips).dropna().astype(object))
+    geo_cache = load_geo_cache(all_ips)
+    new_ips = [ip for ip in all_ips if ip not in geo_cache.index]
+    # Fetch new IPs in batches; the cache file is flushed as results arrive
+    unflushed = []
+    def flush():
+        nonlocal geo_cache
+        if unflushed:
+            geo_cache = save_geo_cache(geo_cache, unflushed)
+            unflushed.clear()
+    def on_batch(records):
+        unflushed.extend(records)
+        if len(unflushed) >= GEO_FLUSH_EVERY * GEO_BATCH_SIZE:
+            flush()
+    if new_ips:
+        logger.info(f"Fetching geolocation for {len(new_ips)} new IP(s) ...")
+        fetch_geolocations(new_ips, on_batch=on_batch)
+        flush()
+    stats = get_geo_cache().stats
+    logger.info(
+        f"Geolocation cache: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+        f"{stats['expired']} expired, {stats['evictions']} evicted"
+    )
+    return geo_cache
+
+def geo_column(field, values, codes):
+    # Log column of one geolocation field: `values` holds one entry per distinct IP and `codes`
+    # (from pd.factorize, -1 for a missing IP) picks each row's entry
+    if field in ("lat", "lon"):
+        values = pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64")
+        return pd.api.extensions.take(values, codes, allow_fill=True)
+    if field == "api_fetch_timestamp":
+        return pd.api.extensions.take(pd.to_datetime(values, utc=True).array, codes, allow_fill=True)
+    # Strings become categoricals against the run's shared dictionary, so a row costs one code
+    category = get_string_dictionary().encode(GEO_COLUMN_NAMES.get(field, field), values)
+    category_codes = pd.api.extensions.take(category.codes, codes, allow_fill=True, fill_value=-1)
+    return pd.Categorical.from_codes(category_codes, categories=category.categories)
+
+def enrich_with_geolocation(df_logs, fields=None):
+    # Looks up each distinct client_ip once and attaches only the GEO_ENRICH_FIELDS columns by
+    # position, instead of merging the whole geolocation row into a copy of the frame
+    fields = GEO_ENRICH_FIELDS if fields is None else fields
     try:
-        geo_cache = load_geo_cache()
-        all_ips = df_logs["client_ip"].dropna().unique()
-        new_ips = [ip for ip in all_ips if ip not in geo_cache.index]
-        # Fetch new IPs
-        new_geo_data = []
-        for ip in new_ips:
-            geo = fetch_geolocation(ip)
-            new_geo_data.append(geo)
-            time.sleep(0.7)
-        if new_geo_data:
-            df_new = pd.DataFrame(new_geo_data).set_index("query")
-            geo_cache = pd.concat([geo_cache, df_new])
-            geo_cache = geo_cache[~geo_cache.index.duplicated(keep='last')]
-            geo_cache.reset_index().to_parquet(GEO_CACHE_PATH, index=False)
-        # Merge
-        geo_cache = geo_cache.reset_index()
-        df_merged = pd.merge(df_logs, geo_cache, left_on="client_ip", right_on="query", how="left", suffixes=("", "_geo"))
-        # Standardize columns for ease
-        df_merged.rename(columns={
-            'country': 'countryName',
-            'countryCode': 'countryCode',
-            'region': 'region',
-            'regionName': 'regionName',
-            'city': 'city',
-            'lat': 'lat',
-            'lon': 'lon',
-            'isp': 'isp'
-        }, inplace=True)
-        return df_merged
+        codes, uniques = pd.factorize(df_logs["client_ip"])
+        uniques = np.asarray(uniques, dtype=object)
+        geo = lookup_geolocations(uniques)
+        geo = geo[~geo.index.duplicated(keep="last")].reindex(index=uniques, columns=fields)
+        return df_logs.assign(**{
+            GEO_COLUMN_NAMES.get(field, field): geo_column(field, geo[field], codes) for field in fields
+        })
     except Exception as e:
         logger.error(f"Error enriching logs with geolocation: {e}")
         return df_logs
@@ -276,20 +1020,240 @@ def status_code_type(code):
     except: pass
     return 'Unknown'
 
-def add_advanced_features(df):
+STATUS_CODE_TYPES = [
+    'Unknown', '1xx_Informational', '2xx_Success', '3xx_Redirection', '4xx_ClientError', '5xx_ServerError'
+]
+SESSION_GAP_MIN     = 30
+ROLLING_COUNT_NS    = 5 * 60 * 10**9     # rolling_5min_req_count window
+ROLLING_MEAN_NS     = 60 * 60 * 10**9    # rolling_1h_avg_proc_time window
+
+def to_int_column(values: pd.Series):
+    # Vectorized .apply(to_int): integer strings become numbers, anything else (incl. '-', '') NaN.
+    # Parsed in Arrow; like the row-wise version the result is int64, or float64 when values are missing.
+    if pd.api.types.is_numeric_dtype(values):
+        return pd.to_numeric(values)
+    arr = pa.array(values.astype("str"), type=pa.string(), from_pandas=True)
+    valid = pc.match_substring_regex(arr, r"^\s*-?\d{1,18}\s*$")
+    ints = pc.cast(pc.utf8_trim_whitespace(pc.if_else(valid, arr, None)), pa.int64())
+    return pd.Series(ints.to_numpy(zero_copy_only=False), index=values.index)
+
+def status_code_types(codes: pd.Series):
+    # Vectorized status_code_type via integer division
+    codes = pd.to_numeric(codes, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+    with np.errstate(invalid="ignore"):
+        classes = np.where((codes >= 100) & (codes < 600), codes // 100, 0)
+    return pd.Series(np.array(STATUS_CODE_TYPES, dtype=object)[classes.astype(np.int64)]).astype('category')
+
+def epoch_ns(times: pd.Series):
+    return np.asarray(times.dt.as_unit("ns").array.asi8, dtype=np.int64)
+
+def window_starts(group_codes, times_ns, *windows_ns):
+    # For rows sorted by (group, time): index of the first row of the same group with time > t - window,
+    # one array per window. Times are replaced by their (stable) global rank so (group, rank) packs into
+    # one sorted int64 key; a row is inside the window iff its rank >= the count of times <= t - window.
+    n = len(times_ns)
+    order = np.argsort(times_ns, kind="stable")
+    sorted_times = times_ns[order]
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n, dtype=np.int64)
+    stride = np.int64(n + 1)
+    group_key = group_codes.astype(np.int64) * stride
+    keys = group_key + rank
+    starts = []
+    for window_ns in windows_ns:
+        lower = np.empty(n, dtype=np.int64)
+        lower[order] = np.searchsorted(sorted_times, sorted_times - window_ns, side="right")
+        starts.append(np.searchsorted(keys, group_key + lower, side="left"))
+    return starts
+
+def path_main_segments(path: pd.Series):
+    # First segment after the first '/', or missing when there is no '/' (regex in Arrow)
+    arr = pa.array(path.astype("str"), type=pa.string(), from_pandas=True)
+    segment = pc.struct_field(pc.extract_regex(arr, r"^[^/]*/(?P<segment>[^/]*)"), "segment")
+    return pd.Series(segment.to_pandas(), index=path.index, dtype=path.astype("str").dtype)
+
+def rolling_window_count(values: pd.Series, starts):
+    # Count of non-null values in rows [start, i] (pandas rolling(...).count())
+    present = np.concatenate([[0], np.cumsum(values.notna().to_numpy(), dtype=np.int64)])
+    idx = np.arange(len(starts))
+    return (present[idx + 1] - present[starts]).astype("float64")
+
+def rolling_window_mean(values: pd.Series, starts):
+    # Mean of non-null values in rows [start, i]; NaN when the window holds none (pandas rolling(...).mean())
+    arr = values.to_numpy(dtype="float64", na_value=np.nan)
+    present = ~np.isnan(arr)
+    sums   = np.concatenate([[0.0], np.cumsum(np.where(present, arr, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(present, dtype=np.int64)])
+    idx = np.arange(len(starts))
+    n = counts[idx + 1] - counts[starts]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n > 0, (sums[idx + 1] - sums[starts]) / n, np.nan)
+
+SESSION_COLUMNS = [
+    "prev_time", "time_diff_min", "new_session", "session_id", "rolling_5min_req_count", "rolling_1h_avg_proc_time"
+]
+
+def add_session_features(df, session_base=None, counted=None):
+    # Sessionization and rolling windows on a frame sorted by (client_ip, time).
+    # session_base: sessions each row's client already had before this frame;
+    # counted: rows that open sessions (rows carried over from earlier batches only give context)
+    group_codes, _ = pd.factorize(df['client_ip'])
+    same_client = np.concatenate([[False], group_codes[1:] == group_codes[:-1]])
+    df['prev_time'] = df['time'].shift(1).where(same_client)
+    df['time_diff_min'] = (df['time'] - df['prev_time']).dt.total_seconds().div(60)
+    df['new_session'] = (df['time_diff_min'] > SESSION_GAP_MIN) | df['time_diff_min'].isna()
+    # Per-client running session number
+    opened = df['new_session'].to_numpy()
+    if counted is not None:
+        opened = opened & counted
+    session_cumsum = np.cumsum(opened, dtype=np.int64)
+    group_first = np.flatnonzero(~same_client)
+    session_no = session_cumsum - (session_cumsum - opened)[group_first][group_codes]
+    if session_base is not None:
+        session_no = session_no + session_base
+    df['session_id'] = pd.Series(session_no.astype('int32'), index=df.index).astype(str) + '-' + df['client_ip']
+    # Rolling aggregations over (t - window, t] per client, from cumulative sums
+    count_starts, mean_starts = window_starts(group_codes, epoch_ns(df['time']), ROLLING_COUNT_NS, ROLLING_MEAN_NS)
+    df['rolling_5min_req_count'] = rolling_window_count(df['request'], count_starts)
+    df['rolling_1h_avg_proc_time'] = rolling_window_mean(df['total_processing_time_ms'], mean_starts)
+    return df
+
+class StreamingSessionizer:
+    # Sessions and rolling windows over time-ordered batches. Per client it keeps the rows inside the
+    # longest window plus the last row, and the number of sessions opened so far. Clients idle longer
+    # than the session gap plus the window are evicted (only their session count is kept, so session
+    # ids stay unique). State can be checkpointed to disk so sessions carry over between files and runs.
+    def __init__(self, gap_min=SESSION_GAP_MIN, window_ns=ROLLING_MEAN_NS):
+        self.window_ns = window_ns
+        self.idle_ns = int(gap_min * 60 * 10**9) + window_ns
+        self.history = pd.DataFrame({
+            "client_ip": pd.Series(dtype="str"),
+            "time": pd.Series(dtype=f"datetime64[ns, {EASTERN_TZ}]"),
+            "request_present": pd.Series(dtype="bool"),
+            "total_processing_time_ms": pd.Series(dtype="float32"),
+        })
+        self.session_counts = pd.Series(dtype="int64", name="sessions")
+        self.watermark = None
+
+    def process(self, df):
+        df = df.sort_values(['client_ip', 'time'])
+        if self.watermark is not None:
+            late = int((df['time'] < self.watermark - pd.Timedelta(self.window_ns, unit="ns")).sum())
+            if late:
+                logger.warning(f"{late} row(s) arrived more than one window behind the session state watermark")
+
+        hist = self.history[self.history['client_ip'].isin(df['client_ip'].unique())]
+        context = pd.DataFrame({
+            "client_ip": hist['client_ip'].to_numpy(dtype=object),
+            "time": hist['time'].array,
+            "request": np.where(hist['request_present'].to_numpy(), "", None),
+            "total_processing_time_ms": hist['total_processing_time_ms'].to_numpy(),
+        })
+        batch = df[["client_ip", "time", "request", "total_processing_time_ms"]].reset_index(drop=True)
+        batch["time"] = batch["time"].dt.tz_convert(eastern()).dt.as_unit("ns")
+        combined = pd.concat([context, batch], ignore_index=True)
+        counted = np.concatenate([np.zeros(len(context), dtype=bool), np.ones(len(batch), dtype=bool)])
+        # Stable sort: carried-over rows stay ahead of batch rows with the same timestamp
+        order = combined.sort_values(['client_ip', 'time'], kind="stable").index.to_numpy()
+        combined = combined.iloc[order].reset_index(drop=True)
+        counted = counted[order]
+        base = self.session_counts.reindex(combined['client_ip'].to_numpy()).fillna(0).to_numpy(dtype=np.int64)
+        add_session_features(combined, session_base=base, counted=counted)
+
+        out = combined[counted]
+        for col in SESSION_COLUMNS:
+            df[col] = out[col].to_numpy()
+        self._update_state(df)
+        return df
+
+    def _update_state(self, df):
+        opened = df.groupby('client_ip', observed=True)['new_session'].sum().astype("int64")
+        self.session_counts = self.session_counts.add(opened, fill_value=0).astype("int64").rename("sessions")
+        self.session_counts.index.name = "client_ip"
+        new_rows = pd.DataFrame({
+            "client_ip": df['client_ip'].to_numpy(dtype=object),
+            "time": df['time'].dt.tz_convert(eastern()).dt.as_unit("ns").array,
+            "request_present": df['request'].notna().to_numpy(),
+            "total_processing_time_ms": df['total_processing_time_ms'].to_numpy(dtype="float32"),
+        })
+        history = pd.concat([self.history, new_rows], ignore_index=True) if len(self.history) else new_rows
+        batch_max = df['time'].max()
+        self.watermark = batch_max if self.watermark is None else max(self.watermark, batch_max)
+        self.history = history
+        self.evict()
+
+    def evict(self):
+        if self.watermark is None or self.history.empty:
+            return 0
+        last_time = self.history.groupby('client_ip')['time'].transform('max')
+        keep = (self.history['time'] > self.watermark - pd.Timedelta(self.window_ns, unit="ns")) | (self.history['time'] == last_time)
+        idle = last_time <= self.watermark - pd.Timedelta(self.idle_ns, unit="ns")
+        evicted = self.history.loc[idle, 'client_ip'].nunique()
+        self.history = self.history[keep & ~idle].reset_index(drop=True)
+        return evicted
+
+    def save(self, state_dir):
+        os.makedirs(state_dir, exist_ok=True)
+        for name, frame in (("history", self.history), ("sessions", self.session_counts.reset_index())):
+            tmp_path = os.path.join(state_dir, f".{name}.parquet.tmp")
+            frame.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, os.path.join(state_dir, f"{name}.parquet"))
+        with open(os.path.join(state_dir, "state.json"), "w") as f:
+            json.dump({"watermark": self.watermark.isoformat() if self.watermark is not None else None}, f)
+
+    @classmethod
+    def load(cls, state_dir, **kwargs):
+        sessionizer = cls(**kwargs)
+        try:
+            if os.path.exists(os.path.join(state_dir, "state.json")):
+                with open(os.path.join(state_dir, "state.json")) as f:
+                    watermark = json.load(f).get("watermark")
+                sessionizer.watermark = pd.Timestamp(watermark).tz_convert(eastern()) if watermark else None
+                history = pd.read_parquet(os.path.join(state_dir, "history.parquet"))
+                history["time"] = history["time"].dt.tz_convert(eastern())
+                sessionizer.history = history
+                sessions = pd.read_parquet(os.path.join(state_dir, "sessions.parquet"))
+                sessionizer.session_counts = sessions.set_index("client_ip")["sessions"].astype("int64")
+                logger.info(f"Loaded session state: {len(sessions)} client(s), watermark {sessionizer.watermark}")
+        except Exception as e:
+            logger.error(f"Error loading session state from {state_dir}: {e}")
+            sessionizer = cls(**kwargs)
+        return sessionizer
+
+    def shard(self, shard, shards):
+        # The state of the clients in client_ip hash shard `shard` of `shards` (see spill.shard_of)
+        part = copy.copy(self)
+        part.history = self.history[shard_of(self.history["client_ip"], shards) == shard].reset_index(drop=True)
+        part.session_counts = self.session_counts[shard_of(self.session_counts.index, shards) == shard]
+        return part
+
+    @classmethod
+    def merge(cls, parts):
+        # One state from the states of disjoint client shards
+        merged = copy.copy(parts[0])
+        merged.history = pd.concat([p.history for p in parts], ignore_index=True)
+        merged.session_counts = pd.concat([p.session_counts for p in parts]).rename("sessions")
+        merged.session_counts.index.name = "client_ip"
+        watermarks = [p.watermark for p in parts if p.watermark is not None]
+        merged.watermark = max(watermarks) if watermarks else None
+        merged.evict()
+        return merged
+
+def add_advanced_features(df, sessionizer=None):
     try:
         # Remove rows missing critical fields
         df = df[~df['client_ip'].isna()]
         # Clean types
-        df['elb_status_code'] = df['elb_status_code'].apply(to_int)
-        df['target_status_code'] = df['target_status_code'].apply(to_int)
-        df['received_bytes'] = df['received_bytes'].apply(to_int)
-        df['sent_bytes'] = df['sent_bytes'].apply(to_int)
+        df['elb_status_code'] = to_int_column(df['elb_status_code'])
+        df['target_status_code'] = to_int_column(df['target_status_code'])
+        df['received_bytes'] = to_int_column(df['received_bytes'])
+        df['sent_bytes'] = to_int_column(df['sent_bytes'])
         df['total_processing_time_ms'] = df['total_processing_time_ms'].astype('float32')
         # Status type
-        df['status_code_type'] = df['elb_status_code'].apply(status_code_type).astype('category')
+        df['status_code_type'] = status_code_types(df['elb_status_code']).set_axis(df.index)
         # Time-based features
-        df["time"] = pd.to_datetime(df["time"])
+        if not pd.api.types.is_datetime64_any_dtype(df["time"]):
+            df["time"] = pd.to_datetime(df["time"])
         df['request_year'] = df['time'].dt.year.astype('int16')
         df['request_month'] = df['time'].dt.month.astype('int8')
         df['request_day'] = df['time'].dt.day.astype('int8')
@@ -297,149 +1261,825 @@ def add_advanced_features(df):
         df['request_day_of_week'] = df['time'].dt.day_name()
         df['request_week_of_year'] = df['time'].dt.isocalendar().week.astype('int8')
         # Path features
-        df['path_depth'] = df['path'].astype(str).str.count('/')
-        df['path_main_segment'] = df['path'].astype(str).str.split('/').apply(lambda x: x[1] if len(x)>1 else None)
-        # Sessionization (simplified)
-        df = df.sort_values(['client_ip', 'time'])
-        df['prev_time'] = df.groupby('client_ip')['time'].shift(1)
-        df['time_diff_min'] = (df['time'] - df['prev_time']).dt.total_seconds().div(60)
-        df['new_session'] = (df['time_diff_min'] > 30) | df['time_diff_min'].isna()
-        df['session_id'] = (df.groupby('client_ip')['new_session']
-                            .cumsum().astype('int32').astype(str)) + '-' + df['client_ip']
-        # Rolling aggregations (windowed, advanced use: .transform on groupby)
-        df['rolling_5min_req_count'] = (
-            df.groupby('client_ip')
-            .rolling('5T', on='time')['request'].count()
-            .reset_index(level=0, drop=True)
-        )
-        df['rolling_1h_avg_proc_time'] = (
-            df.groupby('client_ip')
-            .rolling('60T', on='time')['total_processing_time_ms'].mean()
-            .reset_index(level=0, drop=True)
-        )
-        return df
+        path = df['path'].astype(str)
+        df['path_depth'] = path.str.count('/')
+        df['path_main_segment'] = path_main_segments(path)
+        # Sessionization (simplified) and rolling windows, continuing from earlier batches when streaming
+        if sessionizer is not None:
+            return sessionizer.process(df)
+        return add_session_features(df.sort_values(['client_ip', 'time']))
     except Exception as e:
         logger.error(f"Error adding advanced features: {e}")
         return df
     
 # OUTPUT WRITING FUNCTIONS 
-def write_cleaned_logs(df):
+# Stable schema of the cleaned dataset; every part file gets exactly these columns, whatever a batch contains.
+# countryCode is the Hive partition key and lives in the directory names rather than in the files.
+# The geolocation columns are the GEO_ENRICH_FIELDS ones, in that order.
+@functools.cache
+def cleaned_schema():
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    eastern_ts = pa.timestamp("us", tz="America/New_York")
+    geo_types = {"lat": pa.float64(), "lon": pa.float64(), "query": pa.string(),
+                 "api_fetch_timestamp": pa.timestamp("us", tz="UTC")}
+    geo = [(GEO_COLUMN_NAMES.get(field, field), geo_types.get(field, dict_str))
+           for field in GEO_ENRICH_FIELDS if field != "countryCode"]
+    return pa.schema([
+        ("type", dict_str), ("time", eastern_ts), ("elb", dict_str), ("client_ip_port", pa.string()),
+        ("target_ip_port", dict_str), ("request_processing_time", pa.float64()),
+        ("target_processing_time", pa.float64()), ("response_processing_time", pa.float64()),
+        ("elb_status_code", pa.int16()), ("target_status_code", pa.int16()),
+        ("received_bytes", pa.int64()), ("sent_bytes", pa.int64()), ("request", pa.string()),
+        ("user_agent", dict_str), ("ssl_cipher", dict_str), ("ssl_protocol", dict_str), ("target_group_arn", dict_str),
+        ("trace_id", pa.string()), ("domain_name", dict_str), ("chosen_cert_arn", dict_str),
+        ("matched_rule_priority", dict_str), ("request_creation_time", eastern_ts), ("actions_executed", dict_str),
+        ("redirect_url", dict_str), ("error_reason", dict_str), ("target_port_list", dict_str),
+        ("target_status_code_list", dict_str), ("classification", dict_str), ("classification_reason", dict_str),
+        ("client_ip", pa.string()), ("http_method", dict_str), ("full_url", pa.string()), ("http_version", dict_str),
+        ("protocol", dict_str), ("hostname", dict_str), ("port", pa.int32()), ("path", pa.string()),
+        ("query_params", pa.string()), ("total_processing_time_ms", pa.float32()),
+        ("ua_browser_family", dict_str), ("ua_os_family", dict_str), ("is_bot", pa.bool_()), ("log_source_file", dict_str),
+        *geo,
+        ("status_code_type", dict_str), ("request_year", pa.int16()), ("request_month", pa.int8()),
+        ("request_day", pa.int8()), ("request_hour", pa.int8()), ("request_day_of_week", dict_str),
+        ("request_week_of_year", pa.int8()), ("path_depth", pa.int16()), ("path_main_segment", dict_str),
+        ("prev_time", eastern_ts), ("time_diff_min", pa.float64()), ("new_session", pa.bool_()),
+        ("session_id", pa.string()), ("rolling_5min_req_count", pa.float64()),
+        ("rolling_1h_avg_proc_time", pa.float64()),
+    ])
+
+@functools.cache
+def cleaned_partitioning():
+    # Directory layout: year=2025/month=05/day=26/countryCode=US (UNK when the country is unknown)
+    return ds.partitioning(
+        pa.schema([("year", pa.int16()), ("month", pa.string()), ("day", pa.string()), ("countryCode", pa.string())]),
+        flavor="hive"
+    )
+
+@functools.cache
+def _two_digits():
+    return np.array([f"{i:02d}" for i in range(100)], dtype=object)
+
+def __getattr__(name):
+    # Module constants that need pyarrow (or pytz) are built on first access
+    if name == "EASTERN":
+        return eastern()
+    if name == "CLEANED_SCHEMA":
+        return cleaned_schema()
+    if name == "CLEANED_PARTITIONING":
+        return cleaned_partitioning()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def cleaned_partition_keys(df):
+    country = df["countryCode"] if "countryCode" in df else pd.Series(None, index=df.index, dtype=object)
+    return pd.DataFrame({
+        "year": df["request_year"].to_numpy(dtype="int16"),
+        "month": _two_digits()[df["request_month"].to_numpy(dtype="int64")],
+        "day": _two_digits()[df["request_day"].to_numpy(dtype="int64")],
+        "countryCode": country.astype(object).where(country.notna(), "UNK").to_numpy(),
+    })
+
+def cleaned_record_batch(df, keys):
+    # One record batch in the cleaned schema plus the partition columns; absent columns become typed nulls.
+    # Categoricals share the run's whole dictionary, so only the categories in use are kept.
+    arrays = []
+    for field in cleaned_schema():
+        if field.name in df:
+            values = df[field.name]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.cat.remove_unused_categories()
+            arr = pa.array(values, from_pandas=True)
+            if isinstance(arr, pa.ChunkedArray):
+                arr = arr.combine_chunks()
+            arrays.append(arr.cast(field.type, safe=False))
+        else:
+            arrays.append(pa.nulls(len(df), field.type))
+    for field in cleaned_partitioning().schema:
+        arrays.append(pa.array(keys[field.name].to_numpy(), type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=_cleaned_write_schema())
+
+def _cleaned_write_schema():
+    schema = cleaned_schema()
+    for field in cleaned_partitioning().schema:
+        schema = schema.append(field)
+    return schema
+
+def _cleaned_file_options():
+    return ds.ParquetFileFormat().make_write_options(compression=CLEANED_COMPRESSION)
+
+def write_cleaned_logs(df, run_id=None):
+    # Returns {path: size in bytes} of the part files written
+    written = {}
     try:
-        # Partitioned by year, month, day, countryCode (as required)
-        for (yr, mth, day, cc), group in df.groupby(['request_year', 'request_month', 'request_day', 'countryCode']):
-            out_dir = os.path.join(
-                OUTPUT_CLEANED,
-                f"year={int(yr)}",
-                f"month={int(mth):02d}",
-                f"day={int(day):02d}",
-                f"countryCode={cc if pd.notnull(cc) else 'UNK'}"
-            )
-            os.makedirs(out_dir, exist_ok=True)
-            out_path = os.path.join(out_dir, "data.parquet")
-            group = group.copy()
-            group["time"] = group["time"].dt.strftime("%Y-%m-%d %H:%M:%S%z")
-            group.dropna(axis=1, how='all').to_parquet(out_path, index=False)
+        # Single pass into a Hive-partitioned dataset (year/month/day/countryCode).
+        # Rows are sorted by partition and time so each partition gets one file per run and
+        # row-group statistics on `time` stay tight. Each run writes its own part files.
+        run_id = run_id or new_run_id()
+        extra = sorted(set(df.columns) - set(cleaned_schema().names) - {"countryCode"})
+        if extra:
+            logger.warning(f"Columns not in the cleaned schema are not written: {extra}")
+        keys = cleaned_partition_keys(df)
+        order = keys.assign(time=epoch_ns(df["time"])).sort_values(
+            ["year", "month", "day", "countryCode", "time"], kind="stable").index
+        df, keys = df.iloc[order], keys.iloc[order]
+        # Batches never span two partitions, so each file's dictionaries only hold its own values
+        key_values = keys.to_numpy()
+        starts = np.flatnonzero(np.r_[True, (key_values[1:] != key_values[:-1]).any(axis=1)])
+        bounds = [
+            (i, min(i + CLEANED_ROW_GROUP_ROWS, end))
+            for start, end in zip(starts, np.r_[starts[1:], len(df)])
+            for i in range(start, end, CLEANED_ROW_GROUP_ROWS)
+        ]
+        batches = (cleaned_record_batch(df.iloc[lo:hi], keys.iloc[lo:hi]) for lo, hi in bounds)
+        ds.write_dataset(
+            batches, OUTPUT_CLEANED, schema=_cleaned_write_schema(), format="parquet",
+            partitioning=cleaned_partitioning(), basename_template=f"part-{run_id}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore", file_options=_cleaned_file_options(),
+            min_rows_per_group=min(CLEANED_ROW_GROUP_ROWS, 16384), max_rows_per_group=CLEANED_ROW_GROUP_ROWS,
+            max_rows_per_file=CLEANED_MAX_ROWS_PER_FILE, file_visitor=lambda f: written.__setitem__(f.path, f.size),
+        )
     except Exception as e:
         logger.error(f"Error writing cleaned logs: {e}")
-        
-def write_hourly_aggregation(df):
-    try: 
-        agg = df.groupby([
-            "request_year", "request_month", "request_day", "request_hour", "countryName", "city"
-        ]).agg(
-            request_count = ("client_ip", "count"),
-            unique_client_ips_count = ("client_ip", "nunique"),
-            average_total_processing_time = ("total_processing_time_ms", "mean"),
-            median_total_processing_time = ("total_processing_time_ms", "median"),
-            sum_sent_bytes = ("sent_bytes", "sum"),
-            sum_received_bytes = ("received_bytes", "sum"),
-            count_2xx = ("status_code_type", lambda x: (x == "2xx_Success").sum()),
-            count_4xx = ("status_code_type", lambda x: (x == "4xx_ClientError").sum()),
-            count_5xx = ("status_code_type", lambda x: (x == "5xx_ServerError").sum()),
-        ).reset_index()
+    return written
+
+def compact_cleaned_logs(partitions=None, min_files=None, max_bytes=None, streaming=False):
+    # Merge the small per-run part files of a partition into one file once there are `min_files` of them.
+    # partitions: the partition directories to look at, e.g. those a run wrote (default: the whole dataset).
+    # streaming: append the parts one at a time (one part in memory; row groups keep each part's time
+    # order) instead of loading the partition and sorting it by time.
+    # Returns {path: size in bytes} of the compacted files written
+    min_files = CLEANED_COMPACT_MIN_FILES if min_files is None else min_files
+    max_bytes = CLEANED_COMPACT_MAX_BYTES if max_bytes is None else max_bytes
+    compacted = {}
+    if min_files <= 1 or not os.path.isdir(OUTPUT_CLEANED):
+        return compacted
+    if partitions is None:
+        partitions = [dirpath for dirpath, _, _ in os.walk(OUTPUT_CLEANED)]
+    for dirpath in sorted(set(partitions)):
+        parts = sorted(os.path.join(dirpath, f) for f in os.listdir(dirpath) if f.endswith(".parquet"))
+        small = [p for p in parts if os.path.getsize(p) < max_bytes]
+        if len(small) < min_files:
+            continue
+        try:
+            tmp_path = os.path.join(dirpath, f".compact-{uuid.uuid4().hex}.tmp")
+            if streaming:
+                with pq.ParquetWriter(tmp_path, cleaned_schema(), compression=CLEANED_COMPRESSION) as writer:
+                    for p in small:
+                        writer.write_table(pq.read_table(p, schema=cleaned_schema()), row_group_size=CLEANED_ROW_GROUP_ROWS)
+            else:
+                table = pa.concat_tables([pq.read_table(p, schema=cleaned_schema()) for p in small])
+                pq.write_table(table.sort_by("time"), tmp_path, compression=CLEANED_COMPRESSION,
+                               row_group_size=CLEANED_ROW_GROUP_ROWS)
+            compacted_path = os.path.join(dirpath, f"part-compacted-{new_run_id()}.parquet")
+            os.replace(tmp_path, compacted_path)
+            compacted[compacted_path] = os.path.getsize(compacted_path)
+            for p in small:
+                os.remove(p)
+        except Exception as e:
+            logger.error(f"Error compacting {dirpath}: {e}")
+    if compacted:
+        logger.info(f"Compacted {len(compacted)} cleaned log partition(s)")
+    return compacted
+
+HOUR_KEYS = ["request_year", "request_month", "request_day", "request_hour"]
+HOURLY_LABEL_KEYS = ["countryName", "city"]
+HOURLY_GROUP_KEYS = HOUR_KEYS + HOURLY_LABEL_KEYS
+AGG_INPUT_COLUMNS = HOUR_KEYS + [
+    "countryName", "city", "client_ip", "total_processing_time_ms", "sent_bytes", "received_bytes", "status_code_type"
+]
+STATUS_COUNT_COLUMNS = {"count_2xx": "2xx_Success", "count_4xx": "4xx_ClientError", "count_5xx": "5xx_ServerError"}
+HOURLY_COUNTER_COLUMNS = [
+    "request_count", "latency_count", "latency_sum", "sum_sent_bytes", "sum_received_bytes"
+] + list(STATUS_COUNT_COLUMNS)
+# Sketch columns of the partial state: (keys, values) byte strings per group, see sketches.pack
+HOURLY_SKETCH_COLUMNS = {
+    "client_ip_hll": ("client_ip_hll_idx", "client_ip_hll_rank", "uint16", "uint8"),
+    "latency_sketch": ("latency_sketch_keys", "latency_sketch_counts", "int32", "int64"),
+}
+HOURLY_STATE_FILE = "hourly_traffic_state.parquet"
+
+def _sketch_columns(name, groups, keys, values, n_groups):
+    key_col, value_col, _, _ = HOURLY_SKETCH_COLUMNS[name]
+    key_blobs, value_blobs = sketches.pack(groups, keys, values, n_groups)
+    return {key_col: key_blobs, value_col: value_blobs}
+
+def _unpack_sketch(state, name):
+    key_col, value_col, key_dtype, value_dtype = HOURLY_SKETCH_COLUMNS[name]
+    return sketches.unpack(state[key_col].tolist(), state[value_col].tolist(), key_dtype, value_dtype)
+
+def hourly_partial_state(df):
+    # Mergeable per-(hour, country, city) state in one vectorized pass: exact counters and sums,
+    # a HyperLogLog of client IPs and a quantile sketch of total_processing_time_ms
+    grouped = df.groupby(HOURLY_GROUP_KEYS, observed=True, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    valid = codes >= 0
+    latency = pd.to_numeric(df["total_processing_time_ms"], errors="coerce").astype("float64")
+    counters = pd.DataFrame({
+        "request_count": df["client_ip"].notna(),
+        "latency_count": latency.notna(),
+        "latency_sum": latency.fillna(0),
+        "sum_sent_bytes": pd.to_numeric(df["sent_bytes"], errors="coerce").fillna(0),
+        "sum_received_bytes": pd.to_numeric(df["received_bytes"], errors="coerce").fillna(0),
+        **{col: df["status_code_type"] == code for col, code in STATUS_COUNT_COLUMNS.items()},
+    }).iloc[valid].groupby(codes[valid]).sum()
+    state = grouped.size().index.to_frame(index=False)
+    n = len(state)
+    for col in HOURLY_COUNTER_COLUMNS:
+        state[col] = counters[col].to_numpy(dtype="float64" if col == "latency_sum" else "int64")
+    ip_codes = np.where(df["client_ip"].notna().to_numpy(), codes, -1)
+    state = state.assign(
+        **_sketch_columns("client_ip_hll", *sketches.hll_observe(ip_codes, df["client_ip"]), n),
+        **_sketch_columns("latency_sketch", *sketches.quantile_observe(codes, latency.to_numpy()), n),
+    )
+    return state
+
+def merge_hourly_states(states):
+    # Combine partial states (from batches, workers or earlier runs) group by group
+    df = pd.concat(states, ignore_index=True)
+    grouped = df.groupby(HOURLY_GROUP_KEYS, observed=True, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    merged = grouped[HOURLY_COUNTER_COLUMNS].sum().reset_index()
+    n = len(merged)
+    groups, idx, rank = _unpack_sketch(df, "client_ip_hll")
+    hll = sketches.hll_merge(codes[groups], idx, rank)
+    groups, keys, counts = _unpack_sketch(df, "latency_sketch")
+    latency = sketches.quantile_merge(codes[groups], keys, counts)
+    return merged.assign(
+        **_sketch_columns("client_ip_hll", *hll, n),
+        **_sketch_columns("latency_sketch", *latency, n),
+    )
+
+def materialize_hourly(state):
+    # Final hourly table (the published columns) from a partial state
+    n = len(state)
+    unique_ips = sketches.hll_estimate(*_unpack_sketch(state, "client_ip_hll"), n)
+    quantiles = sketches.quantile_values(*_unpack_sketch(state, "latency_sketch"), n,
+                                         [0.5] + [q / 100 for q in HOURLY_PERCENTILES])
+    latency_count = state["latency_count"].to_numpy()
+    agg = state[HOURLY_GROUP_KEYS].reset_index(drop=True)
+    agg["request_count"] = state["request_count"].to_numpy()
+    agg["unique_client_ips_count"] = np.rint(unique_ips).astype("int64")
+    agg["average_total_processing_time"] = np.where(
+        latency_count > 0, state["latency_sum"].to_numpy() / np.maximum(latency_count, 1), np.nan)
+    agg["median_total_processing_time"] = quantiles[:, 0]
+    agg["sum_sent_bytes"] = state["sum_sent_bytes"].to_numpy()
+    agg["sum_received_bytes"] = state["sum_received_bytes"].to_numpy()
+    for col in STATUS_COUNT_COLUMNS:
+        agg[col] = state[col].to_numpy()
+    for j, q in enumerate(HOURLY_PERCENTILES, start=1):
+        agg[f"p{q:g}_total_processing_time"] = quantiles[:, j]
+    return agg
+
+def aggregate_hourly(df):
+    return materialize_hourly(hourly_partial_state(df))
+
+def load_cleaned_logs(columns):
+    if not os.path.isdir(OUTPUT_CLEANED):
+        return pd.DataFrame(columns=columns)
+    dataset = ds.dataset(OUTPUT_CLEANED, schema=_cleaned_write_schema(), format="parquet",
+                         partitioning=cleaned_partitioning())
+    return dataset.to_table(columns=columns).to_pandas()
+
+def _touched_rows(df, hours):
+    return df.merge(hours, on=HOUR_KEYS, how="left", indicator=True)["_merge"].eq("both").to_numpy()
+
+def write_hourly_aggregation(df=None, state=None):
+    # From the run's rows, or from its partial state when that was built elsewhere (e.g. merged from shards)
+    try:
         out_path = os.path.join(OUTPUT_AGG, "hourly_traffic_by_geo.parquet")
+        state_path = os.path.join(OUTPUT_AGG, HOURLY_STATE_FILE)
+        if state is None:
+            state = hourly_partial_state(df)
+        if os.path.exists(state_path):
+            # Incremental: merge this run's partial state into the stored one for the touched hours only;
+            # every other hour keeps its stored state and published row
+            hours = state[HOUR_KEYS].drop_duplicates().astype("int64")
+            existing = pd.read_parquet(state_path)
+            touched = _touched_rows(existing, hours)
+            state = merge_hourly_states([existing[touched], state])
+            published = pd.read_parquet(out_path) if os.path.exists(out_path) else materialize_hourly(existing)
+            agg = pd.concat([published[~_touched_rows(published, hours)], materialize_hourly(state)], ignore_index=True)
+            state = pd.concat([existing[~touched], state], ignore_index=True)
+        else:
+            if os.path.exists(out_path):
+                # Table written before partial states were kept: rebuild them once from the cleaned
+                # dataset, which already holds this run's rows
+                logger.info("No hourly aggregation state found; rebuilding it from the cleaned logs")
+                state = hourly_partial_state(load_cleaned_logs(AGG_INPUT_COLUMNS))
+            agg = materialize_hourly(state)
+        # Label keys arrive as categoricals or strings depending on the path; store them as strings
+        # so the files keep one schema from run to run
+        state = state.astype({col: "str" for col in HOURLY_LABEL_KEYS}).sort_values(HOURLY_GROUP_KEYS, ignore_index=True)
+        agg = agg.astype({col: "str" for col in HOURLY_LABEL_KEYS}).sort_values(HOURLY_GROUP_KEYS, ignore_index=True)
+        state.to_parquet(state_path + ".tmp", index=False)
+        os.replace(state_path + ".tmp", state_path)
         agg.to_parquet(out_path, index=False)
     except Exception as e:
         logger.error(f"Error writing hourly aggregation: {e}")
-        
+
+ERROR_REPORT_COLUMNS = [
+    "time", "client_ip", "city", "countryName", "isp",
+    "http_method", "full_url", "elb_status_code", "target_status_code_list",
+    "user_agent", "ua_browser_family", "ua_os_family", "error_reason"
+]
+ERROR_REPORT_FILE = "error_summary_geo.csv"
+BOT_DETAILS_FILE  = "bot_traffic_details.parquet"
+BOT_SUMMARY_FILE  = "bot_traffic_by_origin_summary.csv"
+BOT_SUMMARY_KEYS  = ["countryName", "isp"]
+
+def error_report_rows(df):
+    err_df = df.loc[df["status_code_type"].isin(["4xx_ClientError", "5xx_ServerError"]), ERROR_REPORT_COLUMNS].copy()
+    err_df["time"] = err_df["time"].dt.strftime("%Y-%m-%d %H:%M:%S%z")
+    return err_df
+
+def bot_traffic_rows(df):
+    bots = df[df["is_bot"] == True].copy()
+    bots["time"] = bots["time"].dt.strftime("%Y-%m-%d %H:%M:%S%z")
+    return bots
+
+def bot_traffic_summary(bots):
+    return bots.groupby(BOT_SUMMARY_KEYS).size().reset_index(name="bot_request_count")
+
 def write_error_report(df):
     try:
-        err_df = df[df["status_code_type"].isin(["4xx_ClientError", "5xx_ServerError"])]
-        cols = [
-            "time", "client_ip", "city", "countryName", "isp",
-            "http_method", "full_url", "elb_status_code", "target_status_code_list",
-            "user_agent", "ua_browser_family", "ua_os_family", "error_reason"
-        ]
-        out_path = os.path.join(OUTPUT_REPORTS, "error_summary_geo.csv")
-        err_df = err_df.copy()
-        err_df["time"] = err_df["time"].dt.strftime("%Y-%m-%d %H:%M:%S%z")
-        err_df[cols].to_csv(out_path, index=False)
+        error_report_rows(df).to_csv(os.path.join(OUTPUT_REPORTS, ERROR_REPORT_FILE), index=False)
     except Exception as e:
         logger.error(f"Error writing error report: {e}")
 
 def write_bot_traffic_reports(df):
     try:
-        bots = df[df["is_bot"] == True]
-        bots = bots.copy()
-        bots["time"] = bots["time"].dt.strftime("%Y-%m-%d %H:%M:%S%z")
+        bots = bot_traffic_rows(df)
         # Details parquet
-        out_path = os.path.join(OUTPUT_REPORTS, "bot_traffic_details.parquet")
-        bots.to_parquet(out_path, index=False)
+        bots.to_parquet(os.path.join(OUTPUT_REPORTS, BOT_DETAILS_FILE), index=False)
         # Aggregated summary
-        bot_agg = bots.groupby(["countryName", "isp"]).size().reset_index(name="bot_request_count")
-        out_path2 = os.path.join(OUTPUT_REPORTS, "bot_traffic_by_origin_summary.csv")
-        bot_agg.to_csv(out_path2, index=False)
+        bot_traffic_summary(bots).to_csv(os.path.join(OUTPUT_REPORTS, BOT_SUMMARY_FILE), index=False)
     except Exception as e:
         logger.error(f"Error writing bot traffic reports: {e}")
 
-def main():
+# The report writers of the out-of-core mode: each shard leaves its error / bot rows in a Parquet part
+# file and the reports are assembled from the parts one at a time
+def merge_error_reports(paths):
     try:
-        # Extract log files from S3
-        logger.info(f"\nListing ELB log files in s3://{AWS_BUCKET_NAME}/{AWS_LOG_PREFIX}")
-        keys = extract_log_keys(AWS_BUCKET_NAME, AWS_LOG_PREFIX)
-        if not keys:
+        out_path = os.path.join(OUTPUT_REPORTS, ERROR_REPORT_FILE)
+        tmp_path = f"{out_path}.tmp"
+        with open(tmp_path, "w", newline="") as f:
+            if not paths:
+                pd.DataFrame(columns=ERROR_REPORT_COLUMNS).to_csv(f, index=False)
+            for i, path in enumerate(paths):
+                pd.read_parquet(path).to_csv(f, index=False, header=i == 0)
+        os.replace(tmp_path, out_path)
+    except Exception as e:
+        logger.error(f"Error writing error report: {e}")
+
+def merge_bot_traffic_reports(paths):
+    try:
+        concat_parquet_files(paths, os.path.join(OUTPUT_REPORTS, BOT_DETAILS_FILE))
+        summaries = [bot_traffic_summary(pd.read_parquet(path, columns=BOT_SUMMARY_KEYS)) for path in paths]
+        bot_agg = pd.concat(summaries, ignore_index=True).groupby(BOT_SUMMARY_KEYS)["bot_request_count"].sum()
+        bot_agg.reset_index().to_csv(os.path.join(OUTPUT_REPORTS, BOT_SUMMARY_FILE), index=False)
+    except Exception as e:
+        logger.error(f"Error writing bot traffic reports: {e}")
+
+def geo_stage_counters():
+    # API calls and geolocation cache lookups so far (the run report keeps per-stage deltas)
+    counters = dict(GEO_API_STATS)
+    if GEO_BACKEND != "local":
+        try:
+            counters.update({f"geo_cache_{k}": v for k, v in get_geo_cache().stats.items()})
+        except Exception as e:
+            logger.error(f"Error reading geolocation cache stats: {e}")
+    return counters
+
+# PIPELINE STAGES: shared by main() (the whole run) and the CLI subcommands; each records its run-report stage(s)
+def extract_stage(report, start=None, end=None):
+    # Log objects to consider: a full-prefix listing, or (with a time range) a lazy day-prefix listing
+    # that keeps running while later stages consume it. Returns (objects, stage metrics).
+    with report.stage("extract_log_keys") as stage:
+        if start is None and end is None:
+            logger.info(f"\nListing ELB log files in s3://{AWS_BUCKET_NAME}/{AWS_LOG_PREFIX}")
+            objects = extract_log_objects(AWS_BUCKET_NAME, AWS_LOG_PREFIX)
+        else:
+            logger.info(f"\nListing ELB log files in s3://{AWS_BUCKET_NAME}/{AWS_LOG_PREFIX} from {start} to {end}")
+            objects = iter_log_objects(AWS_BUCKET_NAME, AWS_LOG_PREFIX, start, end)
+            stage["overlaps_transform"] = True
+    return objects, stage
+
+def transform_stage(report, keys, spiller=None):
+    # Parse processes over `keys` (any iterable). Returns (DataFrame, failed keys).
+    # With a ShardSpiller (out-of-core mode) the parsed frames are spilled to its shards as they arrive
+    # and the returned frame is empty.
+    logger.info(f"Parsing new file(s) with {ETL_PARSE_WORKERS} parse worker(s) ...")
+    failed_keys = []
+    with report.stage("transform_elb_logs") as stage:
+        stage.update(new_ingest_stats(), objects_in=0)
+        def parsed_frames():
+            for key, df_parsed, error in ingest_log_keys(AWS_BUCKET_NAME, keys, ETL_PARSE_WORKERS):
+                stage["objects_in"] += 1
+                if error is not None:
+                    failed_keys.append(key)
+                    continue
+                logger.info(f"Parsed {len(df_parsed)} records from {key}")
+                for name, value in df_parsed.attrs.pop("ingest_stats", {}).items():
+                    stage[name] += value
+                merge_ua_entries(df_parsed.attrs.pop("ua_cache_entries", {}))
+                take_new_ua_entries()   # classified in this process: already in the cache
+                yield df_parsed
+        if spiller is None:
+            df_all = concat_log_batches(parsed_frames())
+            stage["rows_out"] = len(df_all)
+        else:
+            for df_parsed in parsed_frames():
+                spiller.add(df_parsed)
+            spiller.close()
+            df_all = pd.DataFrame()
+            stage.update(rows_out=spiller.total_rows, shards=spiller.shards, max_shard_rows=max(spiller.rows),
+                         spilled_bytes=spiller.bytes_written)
+        stage["failed_keys"] = len(failed_keys)
+        if failed_keys:
+            logger.error(f"{len(failed_keys)} of {stage['objects_in']} file(s) failed to ingest: {failed_keys}")
+    logger.info(f"Total records after parsing: {stage['rows_out']}")
+    if not df_all.empty:
+        logger.info(f"Parsed frame memory: {memory_report(df_all)['bytes'].sum() / len(df_all):.0f} bytes/row")
+    return df_all, failed_keys
+
+def enrich_stage(report, df):
+    logger.info("\nEnriching logs with geolocation data ...")
+    with report.stage("enrich_with_geolocation", rows_in=len(df), counters=geo_stage_counters) as stage:
+        df_enriched = enrich_with_geolocation(df)
+        stage["rows_out"] = len(df_enriched)
+    lookups = stage.get("geo_cache_hits", 0) + stage.get("geo_cache_misses", 0)
+    stage["geo_cache_hit_rate"] = round(stage["geo_cache_hits"] / lookups, 4) if lookups else None
+    return df_enriched
+
+def features_stage(report, df):
+    # Returns (DataFrame, sessionizer); the caller saves the sessionizer once the output is persisted
+    logger.info("Adding advanced features ...")
+    with report.stage("add_advanced_features", rows_in=len(df)) as stage:
+        sessionizer = StreamingSessionizer.load(SESSION_STATE_DIR)
+        df_final = add_advanced_features(df, sessionizer)
+        stage["rows_out"] = len(df_final)
+    return df_final, sessionizer
+
+def write_stage(report, df, run_id):
+    logger.info("Writing cleaned & enriched logs partitioned by year/month/day/countryCode ...")
+    with report.stage("write_cleaned_logs", rows_in=len(df)) as stage:
+        # Sized from the files written, not by walking the whole cleaned dataset
+        written = write_cleaned_logs(df, run_id)
+        compacted = compact_cleaned_logs({os.path.dirname(path) for path in written})
+        stage["bytes_written"] = sum(written.values()) + sum(compacted.values())
+
+    logger.info("Writing hourly traffic aggregation ...")
+    with report.stage("write_hourly_aggregation", rows_in=len(df), outputs=[OUTPUT_AGG]):
+        write_hourly_aggregation(df)
+
+def report_stage(report, df):
+    logger.info("Writing error summary report ...")
+    with report.stage("write_error_report", rows_in=len(df),
+                      outputs=[os.path.join(OUTPUT_REPORTS, ERROR_REPORT_FILE)]):
+        write_error_report(df)
+
+    logger.info("Writing bot traffic analysis reports ...")
+    with report.stage("write_bot_traffic_reports", rows_in=len(df), outputs=[
+        os.path.join(OUTPUT_REPORTS, BOT_SUMMARY_FILE), os.path.join(OUTPUT_REPORTS, BOT_DETAILS_FILE),
+    ]):
+        write_bot_traffic_reports(df)
+
+# OUT-OF-CORE MODE (ETL_SHARDS > 0): parsed rows are spilled to client_ip hash shards and enrichment,
+# features and the writers run one shard at a time, so peak memory follows the shard size. All rows of
+# a client are in one shard, so sessions and rolling windows match the in-memory run; the writers then
+# merge the shards' outputs (cleaned part files, hourly partial states, error and bot rows).
+def new_shard_spiller(run_id, shards):
+    return ShardSpiller(os.path.join(ETL_SPILL_DIR, run_id), shards, key="client_ip",
+                        buffer_rows=ETL_SPILL_BUFFER_ROWS, concat=concat_log_batches)
+
+def _init_shard_worker():
+    # Forked shard workers open their own connection to the SQLite geolocation cache
+    global _geo_cache_store
+    _geo_cache_store = None
+
+def _write_shard_rows(rows_of, df, path):
+    try:
+        rows_of(df).to_parquet(path, index=False)
+        return path
+    except Exception as e:
+        logger.error(f"Error writing {path}: {e}")
+        return None
+
+def process_shard(shard, files, sessionizer, run_id, out_dir):
+    # Enriches and adds features to one shard (part files `files`) and writes its cleaned part files.
+    # Returns what the merging writers need, the shard's updated session state and the number of
+    # warnings / errors logged (they happen in a worker process when shards run in parallel).
+    counter = LogLevelCounter()
+    logging.getLogger().addHandler(counter)
+    try:
+        df = concat_log_batches(pd.read_parquet(path) for path in files)
+        df = enrich_with_geolocation(df)
+        df = add_advanced_features(df, sessionizer)
+        cleaned_files = write_cleaned_logs(df, f"{run_id}-{shard:04d}")
+        try:
+            hourly_state = hourly_partial_state(df) if len(df) else None
+        except Exception as e:
+            logger.error(f"Error aggregating shard {shard} hourly: {e}")
+            hourly_state = None
+        return {
+            "shard": shard, "rows": len(df), "sessionizer": sessionizer, "hourly_state": hourly_state,
+            "cleaned_files": cleaned_files,
+            "error_rows": _write_shard_rows(error_report_rows, df, os.path.join(out_dir, f"errors-{shard:04d}.parquet")),
+            "bot_rows": _write_shard_rows(bot_traffic_rows, df, os.path.join(out_dir, f"bots-{shard:04d}.parquet")),
+            "log_counts": dict(counter.counts),
+        }
+    finally:
+        logging.getLogger().removeHandler(counter)
+
+def resolve_geolocations_stage(report, spiller, shards):
+    # Every distinct IP is looked up once before the shards run: API rate limits hold across shard
+    # workers and the shards only read the cache
+    logger.info("\nResolving the geolocation of every distinct client IP ...")
+    with report.stage("resolve_geolocations", counters=geo_stage_counters) as stage:
+        ips = set()
+        for shard in shards:
+            ips.update(spiller.read(shard, columns=["client_ip"])["client_ip"].dropna().unique())
+        stage["rows_in"] = len(ips)
+        try:
+            stage["rows_out"] = len(lookup_geolocations(list(ips)))
+        except Exception as e:
+            logger.error(f"Error resolving geolocations: {e}")
+
+def shard_stages(report, spiller, run_id, workers=None):
+    # enrich / features / write / report of a spilled run. Returns the merged session state,
+    # which the caller saves once the outputs are persisted.
+    workers = ETL_SHARD_WORKERS if workers is None else workers
+    shards = [shard for shard in range(spiller.shards) if spiller.rows[shard]]
+    if GEO_BACKEND != "local":
+        resolve_geolocations_stage(report, spiller, shards)
+
+    logger.info(f"Processing {len(shards)} shard(s) with {workers} worker(s) ...")
+    out_dir = os.path.join(spiller.root, "outputs")
+    os.makedirs(out_dir, exist_ok=True)
+    sessionizer = StreamingSessionizer.load(SESSION_STATE_DIR)
+    states = [sessionizer.shard(shard, spiller.shards) for shard in range(spiller.shards)]
+    tasks = [(shard, spiller.files[shard], states[shard], run_id, out_dir) for shard in shards]
+    with report.stage("process_shards", rows_in=spiller.total_rows) as stage:
+        if workers <= 1:
+            results = [process_shard(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_shard_worker) as pool:
+                results = list(pool.map(process_shard, *zip(*tasks)))
+            # Surface the workers' log errors in this process' run report
+            for result in results:
+                counts = result["log_counts"]
+                if counts["errors"]:
+                    logger.error(f"Shard {result['shard']}: {counts['errors']} error(s) logged while processing")
+                elif counts["warnings"]:
+                    logger.warning(f"Shard {result['shard']}: {counts['warnings']} warning(s) logged while processing")
+        rows = sum(result["rows"] for result in results)
+        stage.update(rows_out=rows, shards=len(tasks), workers=workers, max_shard_rows=max(spiller.rows),
+                     bytes_written=sum(sum(result["cleaned_files"].values()) for result in results))
+    for result in results:
+        states[result["shard"]] = result["sessionizer"]
+
+    with report.stage("compact_cleaned_logs") as stage:
+        # Only the partitions this run wrote
+        partitions = {os.path.dirname(path) for result in results for path in result["cleaned_files"]}
+        compacted = compact_cleaned_logs(partitions, streaming=True)
+        stage.update(compacted_partitions=len(compacted), bytes_written=sum(compacted.values()))
+
+    logger.info("Merging the shards' hourly traffic aggregation states ...")
+    with report.stage("write_hourly_aggregation", rows_in=rows, outputs=[OUTPUT_AGG]):
+        hourly = [result["hourly_state"] for result in results if result["hourly_state"] is not None]
+        if hourly:
+            write_hourly_aggregation(state=merge_hourly_states(hourly))
+
+    logger.info("Writing error summary report ...")
+    with report.stage("write_error_report", rows_in=rows, outputs=[os.path.join(OUTPUT_REPORTS, ERROR_REPORT_FILE)]):
+        merge_error_reports([result["error_rows"] for result in results if result["error_rows"]])
+
+    logger.info("Writing bot traffic analysis reports ...")
+    with report.stage("write_bot_traffic_reports", rows_in=rows, outputs=[
+        os.path.join(OUTPUT_REPORTS, BOT_SUMMARY_FILE), os.path.join(OUTPUT_REPORTS, BOT_DETAILS_FILE),
+    ]):
+        merge_bot_traffic_reports([result["bot_rows"] for result in results if result["bot_rows"]])
+    return StreamingSessionizer.merge(states)
+
+def new_run_report(run_id, profile=None):
+    return RunReport(
+        run_id,
+        profile=parse_profile_option(ETL_PROFILE if profile is None else profile),
+        profile_dir=os.path.join(RUN_REPORT_DIR, f"profiles-{run_id}"),
+    )
+
+def finish_run_report(report, report_path=None):
+    try:
+        report.write(report_path or os.path.join(RUN_REPORT_DIR, f"run-{report.run_id}.json"))
+    except Exception as e:
+        logger.error(f"Error writing run report: {e}")
+    return report.status()
+
+def run_pipeline(report, run_id, start=None, end=None, shards=None, shard_workers=None):
+    shards = ETL_SHARDS if shards is None else shards
+    objects, list_stage = extract_stage(report, start, end)
+
+    # Incremental run: skip objects already processed (see is_new_log_object)
+    manifest = load_manifest()
+    listed = 0
+    new_objects = []
+    def new_keys():
+        nonlocal listed
+        for obj in objects:
+            listed += 1
+            if is_new_log_object(obj, manifest):
+                new_objects.append(obj)
+                yield obj["key"]
+
+    spiller = new_shard_spiller(run_id, shards) if shards > 0 else None
+    try:
+        df_all, failed_keys = transform_stage(report, new_keys(), spiller)
+        ingested = len(report.stages)
+        list_stage["rows_out"] = report.run["listed_objects"] = listed
+        report.run["new_objects"] = len(new_objects)
+        if not listed:
             logger.warning("No .gz files found. Exiting.")
             return
-        logger.info(f"Found {len(keys)} ELB log file(s).")
-        
-        # Transform & Parse elb logs
-        df_list = []
-        for key in keys:
-            logger.info(f"Parsing: s3://{AWS_BUCKET_NAME}/{key}")
-            df_parsed = transform_elb_logs(AWS_BUCKET_NAME, [key])
-            logger.info(f"Parsed {len(df_parsed)} records from {key}")
-            df_list.append(df_parsed)
-            logger.info(f"Total records so far: {len(df_list)}")
-        df_all = pd.concat(df_list, ignore_index=True)
-        logger.info(f"Total records after parsing: {len(df_all)}")
-
-        # Show a sample of parsed rows in JSON
-        logger.info(f"\nSample data (JSON, first 5 rows):")
-        logger.info(df_all.head(5).to_json(orient="records", lines=True))
-        
-        # Enrich with geolocation data
-        logger.info("\nEnriching logs with geolocation data ...")
-        df_enriched = enrich_with_geolocation(df_all)
-        
-        # Feature engineering / add advanced features
-        logger.info("Adding advanced features ...")
-        df_final = add_advanced_features(df_enriched)
-        
-        logger.info("Writing cleaned & enriched logs partitioned by year/month/day/countryCode ...")
-        write_cleaned_logs(df_final)
-        
-        logger.info("Writing hourly traffic aggregation ...")
-        write_hourly_aggregation(df_final)
-        
-        logger.info("Writing error summary report ...")
-        write_error_report(df_final)
-        
-        logger.info("Writing bot traffic analysis reports ...")
-        write_bot_traffic_reports(df_final)
-        
-        logger.info("\nAll done!\n")
+        logger.info(f"Found {listed} ELB log file(s).")
+        if not new_objects:
+            logger.info("No new log files since the last run. Exiting.")
+            return
+        logger.info(f"{len(new_objects)} new file(s) processed ({listed - len(new_objects)} already processed).")
+        processed = [obj for obj in new_objects if obj["key"] not in failed_keys]
+        if (spiller.total_rows if spiller is not None else len(df_all)) == 0:
+            logger.warning("No records parsed. Exiting.")
+            update_manifest(manifest, processed)
+            return
+
+        if spiller is None:
+            # Show a sample of parsed rows in JSON
+            logger.info(f"\nSample data (JSON, first 5 rows):")
+            logger.info(df_all.head(5).to_json(orient="records", lines=True, date_format="iso"))
+
+            df_enriched = enrich_stage(report, df_all)
+            df_final, sessionizer = features_stage(report, df_enriched)
+            write_stage(report, df_final, run_id)
+            report_stage(report, df_final)
+        else:
+            sessionizer = shard_stages(report, spiller, run_id, shard_workers)
+    finally:
+        if spiller is not None:
+            spiller.cleanup()
+
+    # Failed keys stay out of the manifest so the next run retries them. The later stages catch their
+    # own exceptions, so any error after ingestion may mean missing output: then nothing is recorded
+    # and the next run ingests the same files again.
+    if report.status(since=ingested) == "ok":
+        update_manifest(manifest, processed)
+        sessionizer.save(SESSION_STATE_DIR)
+    else:
+        logger.error(f"A stage after ingestion failed; {len(processed)} file(s) are left for the next run")
+        processed = []
+    save_ua_cache()
+    report.run["processed_objects"] = len(processed)
+
+    logger.info("\nAll done!\n")
+
+def main(profile=None, report_path=None, start=None, end=None, shards=None, shard_workers=None):
+    # The whole pipeline. profile: "cprofile,tracemalloc" / "all" (default: ETL_PROFILE); report_path:
+    # run report JSON (default: RUN_REPORT_DIR/run-<run_id>.json); start/end: log time range
+    # (default: ETL_START/ETL_END, all logs); shards / shard_workers: out-of-core mode (default:
+    # ETL_SHARDS / ETL_SHARD_WORKERS). Returns the run status ("ok", "degraded" or "failed").
+    run_id = new_run_id()
+    report = new_run_report(run_id, profile)
+    try:
+        ensure_output_dirs()
+        start = parse_time_bound(ETL_START if start is None else start)
+        end = parse_time_bound(ETL_END if end is None else end)
+        run_pipeline(report, run_id, start, end, shards, shard_workers)
     except Exception as e:
+        report.run["status"] = "failed"
         logger.error(f"An error occurred in the main ETL process: {e}")
+    return finish_run_report(report, report_path)
+
+# CLI: `run` (the default) is main(); the other commands run one stage each, passing data through Parquet files
+def read_frame(path):
+    df = pd.read_parquet(path)
+    logger.info(f"Read {len(df)} row(s) from {path}")
+    return df
+
+def write_frame(df, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    df.to_parquet(path, index=False)
+    logger.info(f"Wrote {len(df)} row(s) to {path}")
+
+def cmd_list(args, report, run_id):
+    start = parse_time_bound(ETL_START if args.start is None else args.start)
+    end = parse_time_bound(ETL_END if args.end is None else args.end)
+    objects, stage = extract_stage(report, start, end)
+    objects = list(objects)
+    stage["rows_out"] = len(objects)
+    if not args.all:
+        manifest = load_manifest()
+        objects = [obj for obj in objects if is_new_log_object(obj, manifest)]
+        logger.info(f"{len(objects)} new of {stage['rows_out']} listed file(s)")
+    write_frame(pd.DataFrame(objects, columns=["key", "etag", "size", "last_modified"]), args.output)
+
+def cmd_ingest(args, report, run_id):
+    keys = read_frame(args.input)["key"].tolist()
+    df, _ = transform_stage(report, keys)
+    write_frame(df, args.output)
+    save_ua_cache()
+
+def cmd_enrich(args, report, run_id):
+    write_frame(enrich_stage(report, read_frame(args.input)), args.output)
+
+def cmd_features(args, report, run_id):
+    df, sessionizer = features_stage(report, read_frame(args.input))
+    write_frame(df, args.output)
+    sessionizer.save(SESSION_STATE_DIR)
+
+def cmd_write(args, report, run_id):
+    df = read_frame(args.input)
+    written_from = len(report.stages)
+    write_stage(report, df, args.run_id or run_id)
+    if args.keys and report.status(since=written_from) != "ok":
+        logger.error("Writing failed; the listed files are not recorded as processed")
+    elif args.keys:
+        # Record the listed objects whose rows were written, so later runs skip them
+        objects = read_frame(args.keys)
+        written = objects[objects["key"].isin(df["log_source_file"].astype(str).unique())]
+        update_manifest(load_manifest(), written.to_dict("records"))
+
+def cmd_report(args, report, run_id):
+    report_stage(report, read_frame(args.input))
+
+COMMANDS = {
+    "list": cmd_list, "ingest": cmd_ingest, "enrich": cmd_enrich, "features": cmd_features,
+    "write": cmd_write, "report": cmd_report,
+}
+
+def _common_options(parser, suppress=False):
+    # Options accepted before or after the command name (SUPPRESS keeps a subcommand from resetting them)
+    default = argparse.SUPPRESS if suppress else None
+    parser.add_argument("--profile", default=default,
+                        help='per-stage profilers: "cprofile", "tracemalloc", both comma-separated or "all" (default: $ETL_PROFILE)')
+    parser.add_argument("--run-report", default=default, help="run report JSON path (default: output/run_reports/run-<run_id>.json)")
+
+def _time_range_options(parser, suppress=False):
+    default = argparse.SUPPRESS if suppress else None
+    parser.add_argument("--start", default=default, help='log files from this time: ISO date/time (UTC) or e.g. "-1d" (default: $ETL_START)')
+    parser.add_argument("--end", default=default, help="log files up to this time, exclusive (default: $ETL_END)")
+
+def _shard_options(parser, suppress=False):
+    default = argparse.SUPPRESS if suppress else None
+    parser.add_argument("--shards", type=int, default=default,
+                        help="out-of-core run: spill parsed rows to N client_ip hash shards (default: $ETL_SHARDS, 0 = in memory)")
+    parser.add_argument("--shard-workers", type=int, default=default, help="processes working on shards (default: $ETL_SHARD_WORKERS)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ELB access-log ETL. Without a command the whole pipeline runs.")
+    _common_options(parser)
+    _time_range_options(parser)
+    _shard_options(parser)
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+
+    def command(name, help, input=None, output=None):
+        sub = commands.add_parser(name, help=help)
+        _common_options(sub, suppress=True)
+        if input:
+            sub.add_argument("--input", "-i", required=True, help=input)
+        if output:
+            sub.add_argument("--output", "-o", required=True, help=output)
+        return sub
+
+    sub = command("run", "list, ingest, enrich, add features, write and report (default)")
+    _time_range_options(sub, suppress=True)
+    _shard_options(sub, suppress=True)
+    sub = command("list", "list new log objects", output="objects Parquet (key, etag, size, last_modified)")
+    _time_range_options(sub, suppress=True)
+    sub.add_argument("--all", action="store_true", help="include objects already in the processed-key manifest")
+    command("ingest", "download and parse listed objects", input="objects Parquet from `list`", output="parsed logs Parquet")
+    command("enrich", "add geolocation columns", input="parsed logs Parquet", output="enriched logs Parquet")
+    command("features", "add time, session and rolling-window features (updates the session state)",
+            input="enriched logs Parquet", output="feature Parquet")
+    sub = command("write", "write the cleaned dataset and the hourly aggregation", input="feature Parquet")
+    sub.add_argument("--run-id", help="part-file run id (default: a new one)")
+    sub.add_argument("--keys", help="objects Parquet from `list`; written objects are recorded in the processed-key manifest")
+    command("report", "write the error and bot traffic reports", input="feature Parquet")
+    return parser
+
+def cli(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command in (None, "run"):
+        status = main(profile=args.profile, report_path=args.run_report, start=args.start, end=args.end,
+                      shards=args.shards, shard_workers=args.shard_workers)
+    else:
+        run_id = new_run_id()
+        report = new_run_report(run_id, args.profile)
+        try:
+            ensure_output_dirs()
+            COMMANDS[args.command](args, report, run_id)
+        except Exception as e:
+            report.run["status"] = "failed"
+            logger.error(f"An error occurred in the {args.command} command: {e}")
+        status = finish_run_report(report, args.run_report)
+    return 1 if status == "failed" else 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(cli())
@@ -0,0 +1,69 @@
+# Old exact groupby (lambdas + nunique + median) vs sketch-based hourly aggregation, and merging
+# per-chunk partial states as parallel workers / incremental runs would.
+# Usage: python benchmarks/bench_aggregation.py [rows,rows,...] [--chunks N]
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from advanced_elb_logs_etl import (
+    add_advanced_features, aggregate_hourly, hourly_partial_state, merge_hourly_states, materialize_hourly,
+    HOURLY_GROUP_KEYS
+)
+from bench_features import make_parsed_frame
+
+def legacy_aggregate_hourly(df):
+    # aggregate_hourly before partial states (user-004)
+    return df.groupby(HOURLY_GROUP_KEYS).agg(
+        request_count = ("client_ip", "count"),
+        unique_client_ips_count = ("client_ip", "nunique"),
+        average_total_processing_time = ("total_processing_time_ms", "mean"),
+        median_total_processing_time = ("total_processing_time_ms", "median"),
+        sum_sent_bytes = ("sent_bytes", "sum"),
+        sum_received_bytes = ("received_bytes", "sum"),
+        count_2xx = ("status_code_type", lambda x: (x == "2xx_Success").sum()),
+        count_4xx = ("status_code_type", lambda x: (x == "4xx_ClientError").sum()),
+        count_5xx = ("status_code_type", lambda x: (x == "5xx_ServerError").sum()),
+    ).reset_index()
+
+def make_feature_frame(n_rows):
+    df = add_advanced_features(make_parsed_frame(n_rows))
+    rng = np.random.default_rng(11)
+    cities = np.array([f"City {i}" for i in range(1000)], dtype=object)
+    df["city"] = cities[rng.integers(0, len(cities), len(df))]
+    df["countryName"] = np.where(df["city"].str[-1].isin(["1", "2", "3"]), "Canada", "United States")
+    return df
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", nargs="?", default="1000000,5000000")
+    parser.add_argument("--chunks", type=int, default=8, help="partial states merged in the merge benchmark")
+    args = parser.parse_args()
+
+    for n_rows in [int(n) for n in args.rows.split(",")]:
+        df = make_feature_frame(n_rows)
+        new, new_s = timed(aggregate_hourly, df)
+        old, old_s = timed(legacy_aggregate_hourly, df)
+        chunks = np.array_split(np.arange(len(df)), args.chunks)
+        partials = [hourly_partial_state(df.iloc[c]) for c in chunks]
+        merged, merge_s = timed(lambda: materialize_hourly(merge_hourly_states(partials)))
+        pd.testing.assert_frame_equal(merged, new)
+        for col in ["request_count", "sum_sent_bytes", "sum_received_bytes", "count_2xx", "count_4xx", "count_5xx"]:
+            assert (new[col].to_numpy() == old[col].to_numpy()).all(), col
+        ip_err = np.abs(new["unique_client_ips_count"] / old["unique_client_ips_count"] - 1).max()
+        median_err = np.abs(new["median_total_processing_time"] / old["median_total_processing_time"] - 1).max()
+        print(f"{n_rows:>11,} rows  {len(new):,} groups  sketches {new_s:6.2f}s  legacy {old_s:6.2f}s  "
+              f"speedup {old_s / new_s:5.1f}x  merge of {args.chunks} partials {merge_s:5.2f}s  "
+              f"max rel. error: distinct IPs {ip_err:.2%}, median {median_err:.2%}", flush=True)
+
+if __name__ == "__main__":
+    main()
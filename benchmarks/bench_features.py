@@ -0,0 +1,100 @@
+# Old (row-wise apply + groupby().rolling) vs vectorized add_advanced_features.
+# Usage: python benchmarks/bench_features.py [rows,rows,...] [--legacy-max-rows N]
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from advanced_elb_logs_etl import add_advanced_features, to_int, status_code_type
+
+def legacy_add_advanced_features(df):
+    # add_advanced_features as it was before vectorization. For pandas 3: '5T'/'60T' are spelled '5min'/'60min',
+    # and the rolling results are assigned positionally (pandas 3 indexes them by 'time', so aligning on the
+    # original index no longer works). Rows are already in group order, so positions match pandas 2's alignment.
+    df = df[~df['client_ip'].isna()]
+    df['elb_status_code'] = df['elb_status_code'].apply(to_int)
+    df['target_status_code'] = df['target_status_code'].apply(to_int)
+    df['received_bytes'] = df['received_bytes'].apply(to_int)
+    df['sent_bytes'] = df['sent_bytes'].apply(to_int)
+    df['total_processing_time_ms'] = df['total_processing_time_ms'].astype('float32')
+    df['status_code_type'] = df['elb_status_code'].apply(status_code_type).astype('category')
+    df["time"] = pd.to_datetime(df["time"])
+    df['request_year'] = df['time'].dt.year.astype('int16')
+    df['request_month'] = df['time'].dt.month.astype('int8')
+    df['request_day'] = df['time'].dt.day.astype('int8')
+    df['request_hour'] = df['time'].dt.hour.astype('int8')
+    df['request_day_of_week'] = df['time'].dt.day_name()
+    df['request_week_of_year'] = df['time'].dt.isocalendar().week.astype('int8')
+    df['path_depth'] = df['path'].astype(str).str.count('/')
+    df['path_main_segment'] = df['path'].astype(str).str.split('/').apply(lambda x: x[1] if len(x)>1 else None)
+    df = df.sort_values(['client_ip', 'time'])
+    df['prev_time'] = df.groupby('client_ip')['time'].shift(1)
+    df['time_diff_min'] = (df['time'] - df['prev_time']).dt.total_seconds().div(60)
+    df['new_session'] = (df['time_diff_min'] > 30) | df['time_diff_min'].isna()
+    df['session_id'] = (df.groupby('client_ip')['new_session']
+                        .cumsum().astype('int32').astype(str)) + '-' + df['client_ip']
+    df['rolling_5min_req_count'] = (
+        df.groupby('client_ip')
+        .rolling('5min', on='time')['request'].count()
+        .to_numpy()
+    )
+    df['rolling_1h_avg_proc_time'] = (
+        df.groupby('client_ip')
+        .rolling('60min', on='time')['total_processing_time_ms'].mean()
+        .to_numpy()
+    )
+    return df
+
+def make_parsed_frame(n_rows, n_clients=None, seed=7):
+    # Parsed-log shaped frame: string numeric fields like the parser produces, one day of traffic
+    rng = np.random.default_rng(seed)
+    n_clients = n_clients or max(n_rows // 50, 1)
+    client = rng.integers(0, n_clients, n_rows)
+    ips = np.array([f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n_clients)], dtype=object)
+    micros = np.sort(rng.integers(0, 86400 * 10**6, n_rows)) + 1_748_304_000 * 10**6   # 2025-05-27 UTC
+    status = rng.choice(np.array(["200", "200", "200", "301", "404", "500", "-"], dtype=object), n_rows)
+    paths = rng.choice(np.array(["/api/listings", "/api/keywords/top", "/", "/trends", "/static/app.js"], dtype=object), n_rows)
+    proc = np.round(rng.gamma(2.0, 80.0, n_rows), 3)
+    proc[rng.random(n_rows) < 0.01] = np.nan
+    return pd.DataFrame({
+        "time": pd.to_datetime(micros, unit="us", utc=True).tz_convert("America/New_York"),
+        "client_ip": ips[client],
+        "elb_status_code": status,
+        "target_status_code": status,
+        "received_bytes": rng.integers(0, 5000, n_rows).astype(str).astype(object),
+        "sent_bytes": rng.integers(0, 50000, n_rows).astype(str).astype(object),
+        "request": "GET https://beta.erank.com:443/api HTTP/2.0",
+        "path": paths,
+        "total_processing_time_ms": proc,
+    })
+
+def timed(fn, df):
+    start = time.perf_counter()
+    out = fn(df.copy())
+    return out, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", nargs="?", default="1000000,5000000,20000000")
+    parser.add_argument("--legacy-max-rows", type=int, default=5_000_000,
+                        help="skip the old implementation above this size (it takes minutes)")
+    args = parser.parse_args()
+
+    for n_rows in [int(n) for n in args.rows.split(",")]:
+        df = make_parsed_frame(n_rows)
+        new, new_s = timed(add_advanced_features, df)
+        line = f"{n_rows:>11,} rows  vectorized {new_s:8.2f}s"
+        if n_rows <= args.legacy_max_rows:
+            old, old_s = timed(legacy_add_advanced_features, df)
+            pd.testing.assert_frame_equal(new, old)
+            line += f"  legacy {old_s:8.2f}s  speedup {old_s / new_s:5.1f}x  (outputs equal)"
+        else:
+            line += "  legacy skipped"
+        print(line, flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Geolocation join on a large batch: the previous full-frame pd.merge against the cache rows vs
+# enrich_with_geolocation (factorize client_ip, one lookup per distinct IP, categorical take of the
+# selected fields). Each method runs in a fresh interpreter; reports wall time, peak RSS and how
+# much the frame grew.
+# Usage: python benchmarks/bench_geo_join.py [--rows N] [--ips N] [--method merge|factorize]
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import advanced_elb_logs_etl as etl
+from geo_cache import GEO_FIELDS
+from instrumentation import RSSSampler
+
+def make_ips(n):
+    rng = np.random.default_rng(0)
+    octets = rng.integers(1, 255, size=(n * 2, 4))
+    ips = pd.unique(pd.Series([".".join(map(str, row)) for row in octets]))
+    return ips[:n]
+
+def make_geo(ips):
+    # Cache rows (indexed by "query") with realistic cardinalities and ~2% failed lookups
+    rng = np.random.default_rng(1)
+    n = len(ips)
+    city = rng.integers(0, 20000, n)
+    geo = pd.DataFrame({
+        "status": "success", "message": None,
+        "country": [f"Country {c}" for c in city % 200], "countryCode": [f"C{c:03d}" for c in city % 200],
+        "region": [f"R{c % 50}" for c in city], "regionName": [f"Region {c % 3000}" for c in city],
+        "city": [f"City {c}" for c in city], "lat": rng.uniform(-90, 90, n), "lon": rng.uniform(-180, 180, n),
+        "isp": [f"ISP {i}" for i in rng.integers(0, 5000, n)], "query": ips,
+        "api_fetch_timestamp": pd.Timestamp("2025-05-26", tz="UTC"),
+    }, columns=GEO_FIELDS)
+    failed = rng.random(n) < 0.02
+    geo.loc[failed, ["country", "countryCode", "region", "regionName", "city", "lat", "lon", "isp"]] = None
+    geo.loc[failed, ["status", "message"]] = ["fail", "reserved range"]
+    return geo.set_index("query")
+
+def make_logs(ips, rows):
+    # Zipf-ish IP popularity, plus a few typed log columns so the frame is not just client_ip
+    rng = np.random.default_rng(2)
+    pick = np.minimum(rng.zipf(1.3, rows) - 1, len(ips) - 1)
+    return pd.DataFrame({
+        "client_ip": pd.array(ips[rng.permutation(len(ips))][pick], dtype="str"),
+        "elb_status_code": pd.array(rng.choice([200, 301, 404, 500], rows), dtype="Int16"),
+        "sent_bytes": pd.array(rng.integers(0, 100000, rows), dtype="Int64"),
+        "request_processing_time": rng.random(rows),
+    })
+
+def merge_join(df_logs):
+    # enrich_with_geolocation before the factorized join
+    geo_cache = etl.lookup_geolocations(df_logs["client_ip"]).reset_index()
+    df_merged = pd.merge(df_logs, geo_cache, left_on="client_ip", right_on="query", how="left", suffixes=("", "_geo"))
+    return df_merged.rename(columns={"country": "countryName"})
+
+def run_method(method, rows, n_ips):
+    ips = make_ips(n_ips)
+    geo = make_geo(ips)
+    df = make_logs(ips, rows)
+    etl.lookup_geolocations = lambda ips: geo
+    before = df.memory_usage(deep=True).sum()
+    join = merge_join if method == "merge" else etl.enrich_with_geolocation
+    with RSSSampler() as rss:
+        rss.reset()
+        start_rss = rss.peak()
+        began = time.perf_counter()
+        out = join(df)
+        seconds = time.perf_counter() - began
+        peak = rss.peak() - start_rss
+    added = [col for col in out.columns if col not in df.columns]
+    return {
+        "seconds": seconds, "peak_rss_delta_mb": peak / 2**20, "rows": len(out),
+        "frame_mb_before": before / 2**20, "frame_mb_after": out.memory_usage(deep=True).sum() / 2**20,
+        "columns_added": added, "city_sample": [None if pd.isna(v) else v for v in out["city"].iloc[:1000]],
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--ips", type=int, default=200_000)
+    parser.add_argument("--method", choices=["merge", "factorize"], help="run one method in this process")
+    args = parser.parse_args()
+
+    if args.method:
+        print(json.dumps(run_method(args.method, args.rows, args.ips)))
+        return
+
+    print(f"{args.rows:,} rows, {args.ips:,} distinct IPs")
+    results = {}
+    for method in ("merge", "factorize"):
+        out = subprocess.run([sys.executable, __file__, "--rows", str(args.rows), "--ips", str(args.ips),
+                              "--method", method], capture_output=True, text=True, check=True).stdout
+        r = results[method] = json.loads(out.strip().splitlines()[-1])
+        print(f"  {method:<10} {r['seconds']:7.2f}s  peak RSS +{r['peak_rss_delta_mb']:7.0f} MB  "
+              f"frame {r['frame_mb_before']:6.0f} -> {r['frame_mb_after']:6.0f} MB  "
+              f"+{len(r['columns_added'])} column(s)")
+    assert results["merge"]["city_sample"] == results["factorize"]["city_sample"]
+    merge, fact = results["merge"], results["factorize"]
+    print(f"factorized join: {merge['seconds'] / fact['seconds']:.1f}x faster, "
+          f"{merge['peak_rss_delta_mb'] / max(fact['peak_rss_delta_mb'], 1):.1f}x less peak memory")
+
+if __name__ == "__main__":
+    main()
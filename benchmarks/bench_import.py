@@ -0,0 +1,104 @@
+# Startup cost of the ETL module: import alone, import + first parse_log_entry call, and `--help`,
+# each in fresh interpreters (best of --repeat). Pass --baseline REV to time a git revision's
+# top-level modules the same way (e.g. the commit before lazy initialization).
+# Usage: python benchmarks/bench_import.py [--repeat N] [--baseline REV]
+import io
+import os
+import sys
+import json
+import shutil
+import tarfile
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_logs import log_line, client_ips, BROWSER_AGENTS
+
+HEAVY = ("numpy", "pandas", "pyarrow", "boto3", "requests", "user_agents", "dotenv")
+
+def sample_line():
+    import random
+    from datetime import datetime, timezone
+    return log_line(random.Random(0), datetime(2025, 5, 26, tzinfo=timezone.utc), client_ips(1, 0)[0],
+                    BROWSER_AGENTS[0], 0.05, 0.01)
+
+def scenario_code(scenario):
+    timed = {
+        "import": "import advanced_elb_logs_etl",
+        "import + parse_log_entry": (
+            "from advanced_elb_logs_etl import parse_log_entry; "
+            f"assert parse_log_entry({sample_line()!r}, 'bench.log.gz') is not None"
+        ),
+    }[scenario]
+    return (
+        "import sys, time, json; t = time.perf_counter(); " + timed + "; "
+        "elapsed = time.perf_counter() - t; "
+        f"print(json.dumps({{'s': elapsed, 'heavy': [m for m in {HEAVY!r} if m in sys.modules]}}))"
+    )
+
+def run_scenario(src_dir, scenario, workdir):
+    if scenario == "--help":
+        # The script run as __main__ (so .env loading is included); help goes to stdout, timings to stderr
+        code = (
+            "import sys, time, json, runpy; t = time.perf_counter(); sys.argv = ['etl', '--help']\n"
+            "try:\n    runpy.run_path('advanced_elb_logs_etl.py', run_name='__main__')\nexcept SystemExit:\n    pass\n"
+            f"print(json.dumps({{'s': time.perf_counter() - t, 'heavy': [m for m in {HEAVY!r} if m in sys.modules]}}), file=sys.stderr)"
+        )
+        out = subprocess.run([sys.executable, "-c", code], cwd=src_dir, capture_output=True, text=True, check=True).stderr
+        return json.loads(out.strip().splitlines()[-1])
+    out = subprocess.run([sys.executable, "-c", scenario_code(scenario)], cwd=workdir, capture_output=True, text=True,
+                         check=True, env=dict(os.environ, PYTHONPATH=src_dir)).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def best_of(src_dir, scenario, repeat):
+    workdir = tempfile.mkdtemp(prefix="elb-import-")
+    try:
+        runs = [run_scenario(src_dir, scenario, workdir) for _ in range(repeat)]
+        created = os.listdir(workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    best = min(runs, key=lambda r: r["s"])
+    return best["s"], best["heavy"], created
+
+def export_revision(rev, dest):
+    # Top-level files of `rev` (the modules the ETL imports) into dest
+    archive = subprocess.run(["git", "archive", "--format=tar", rev], cwd=ROOT, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(dest, members=[m for m in tar.getmembers() if "/" not in m.name], filter="data")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", help="git revision to compare against")
+    args = parser.parse_args()
+
+    sources = [("working tree", ROOT)]
+    baseline_dir = None
+    if args.baseline:
+        baseline_dir = tempfile.mkdtemp(prefix="elb-baseline-")
+        export_revision(args.baseline, baseline_dir)
+        sources.append((args.baseline, baseline_dir))
+    try:
+        results = {}
+        for label, src in sources:
+            print(f"{label}:")
+            for scenario in ("import", "import + parse_log_entry", "--help"):
+                if label != "working tree" and scenario == "--help":
+                    continue   # older revisions have no CLI, running them would start the ETL
+                seconds, heavy, created = best_of(src, scenario, args.repeat)
+                results[(label, scenario)] = seconds
+                print(f"  {scenario:<26} {seconds * 1000:8.1f} ms  heavy modules: {', '.join(heavy) or '-'}"
+                      + (f"  created: {', '.join(created)}" if created else ""))
+        if args.baseline:
+            for scenario in ("import", "import + parse_log_entry"):
+                before, after = results[(args.baseline, scenario)], results[("working tree", scenario)]
+                print(f"{scenario}: {before / after:.1f}x faster than {args.baseline}")
+    finally:
+        if baseline_dir:
+            shutil.rmtree(baseline_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
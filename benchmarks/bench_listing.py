@@ -0,0 +1,93 @@
+# Full-prefix listing (extract_log_objects) vs time-range listing (iter_log_objects) of a bucket
+# holding `days` of 5-minute ELB files, with a simulated S3 round trip per list request.
+# Usage: python benchmarks/bench_listing.py [--days N] [--nodes N] [--latency-ms MS] [--range-hours H] [--workers N]
+import os
+import sys
+import time
+import bisect
+import argparse
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import advanced_elb_logs_etl as etl
+from generate_logs import ACCOUNT_ID, REGION, ELB_NAME
+from local_s3 import LocalS3Client
+
+BUCKET = "bench-elb-logs"
+
+class InMemoryS3Client(LocalS3Client):
+    # Keys kept in a sorted list (no files), each list request sleeping `latency` seconds
+    def __init__(self, keys, latency, page_size=1000):
+        super().__init__(root="", page_size=page_size)
+        self.keys = sorted(keys)
+        self.latency = latency
+        self.requests = 0
+
+    def _list(self, bucket, prefix):
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + "￿")
+        return self.keys[lo:hi]
+
+    def _head(self, bucket, key):
+        return {"Key": key, "Size": 1000, "ETag": '"0"', "LastModified": datetime(2025, 1, 1, tzinfo=timezone.utc)}
+
+    def list_objects_v2(self, **kwargs):
+        self.requests += 1
+        time.sleep(self.latency)
+        return super().list_objects_v2(**kwargs)
+
+def make_keys(days, nodes, end):
+    keys = []
+    ts = end - timedelta(days=days)
+    while ts < end:
+        ts += timedelta(minutes=5)
+        for node in range(nodes):
+            keys.append(
+                f"AWSLogs/{ACCOUNT_ID}/elasticloadbalancing/{REGION}/{ts:%Y/%m/%d}/"
+                f"{ACCOUNT_ID}_elasticloadbalancing_{REGION}_{ELB_NAME.replace('/', '.')}_{ts:%Y%m%dT%H%MZ}_"
+                f"10.0.0.{node}_{node:08x}.log.gz"
+            )
+    return keys
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--nodes", type=int, default=3, help="ELB nodes, i.e. files per 5-minute interval")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--range-hours", type=float, default=24, help="time range listed, ending at the newest file")
+    parser.add_argument("--workers", type=int, default=etl.ETL_LIST_WORKERS)
+    args = parser.parse_args()
+
+    end = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    keys = make_keys(args.days, args.nodes, end)
+    start = end - timedelta(hours=args.range_hours)
+    print(f"{len(keys):,} keys over {args.days} day(s), {args.latency_ms:g} ms per list request, "
+          f"range {args.range_hours:g}h, {args.workers} listing worker(s)")
+
+    client = InMemoryS3Client(keys, args.latency_ms / 1000)
+    etl.s3 = client
+    etl.new_s3_client = lambda: client
+
+    began = time.perf_counter()
+    listed = etl.extract_log_objects(BUCKET, "AWSLogs/")
+    full_s = time.perf_counter() - began
+    in_range = [o for o in listed if start <= etl.log_key_time(o["key"]) < end + timedelta(minutes=5)]
+    print(f"  full listing + filter: {full_s:7.2f}s  {client.requests:6,} request(s)  {len(in_range):,} key(s) in range")
+
+    client.requests = 0
+    began = time.perf_counter()
+    first_s = None
+    pruned = []
+    for obj in etl.iter_log_objects(BUCKET, "AWSLogs/", start, end, workers=args.workers):
+        if first_s is None:
+            first_s = time.perf_counter() - began
+        pruned.append(obj)
+    pruned_s = time.perf_counter() - began
+    assert [o["key"] for o in pruned] == [o["key"] for o in in_range]
+    print(f"  time-range listing:    {pruned_s:7.2f}s  {client.requests:6,} request(s)  {len(pruned):,} key(s), "
+          f"first key after {first_s:.3f}s  ({full_s / pruned_s:.0f}x faster)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Bytes per parsed row: per-line dicts (parse_log_entry), the previous all-string frame layout,
+# and the current layout (categoricals against the shared string dictionary + typed numerics).
+# Usage: python benchmarks/bench_memory.py [n_lines] [--batch-lines N] [--columns]
+import os
+import sys
+import argparse
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from advanced_elb_logs_etl import (
+    parse_log_entry, parse_log_batch, concat_log_batches, memory_report, INT_LOG_COLUMNS, FLOAT_LOG_COLUMNS
+)
+from bench_parse import make_lines
+
+def dict_row_bytes(rows):
+    # Deep size of per-line dicts (keys are interned and shared, so they are not counted)
+    return sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values()) for row in rows)
+
+def legacy_layout(df):
+    # The frame as parse_log_batch built it before categoricals / typed numerics
+    old = df.copy()
+    for col in old.columns:
+        if isinstance(old[col].dtype, pd.CategoricalDtype):
+            old[col] = old[col].astype(object).astype("str")
+    for col in list(INT_LOG_COLUMNS) + FLOAT_LOG_COLUMNS:
+        old[col] = old[col].astype(object).where(old[col].notna(), "-").astype(str).astype("str")
+    old["port"] = old["port"].astype("float64")
+    old["client_ip"] = old["client_ip"].astype(object)
+    return old
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("n_lines", nargs="?", type=int, default=500_000)
+    parser.add_argument("--batch-lines", type=int, default=50_000)
+    parser.add_argument("--columns", action="store_true", help="print the per-column report")
+    args = parser.parse_args()
+
+    lines = make_lines(args.n_lines)
+    sample = lines[:20_000]
+    dict_bytes = dict_row_bytes([parse_log_entry(line, "bench.log.gz") for line in sample]) / len(sample)
+    df = concat_log_batches(
+        parse_log_batch(lines[i:i + args.batch_lines], f"bench-{i // args.batch_lines}.log.gz")[0]
+        for i in range(0, len(lines), args.batch_lines)
+    )
+    before = memory_report(legacy_layout(df))
+    after = memory_report(df)
+    on_disk = sum(len(line) + 1 for line in lines) / len(lines)
+    print(f"{len(df):,} rows (raw log line: {on_disk:.0f} bytes/row)")
+    print(f"  dict rows:              {dict_bytes:8.0f} bytes/row")
+    print(f"  string frame (before):  {before['bytes_per_row'].sum():8.0f} bytes/row")
+    print(f"  typed frame (after):    {after['bytes_per_row'].sum():8.0f} bytes/row")
+    if args.columns:
+        report = before[["bytes_per_row"]].join(after[["dtype", "bytes_per_row"]], lsuffix="_before", rsuffix="_after")
+        with pd.option_context("display.width", 200, "display.max_rows", 100):
+            print(report.sort_values("bytes_per_row_before", ascending=False).round(1))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# In-memory run vs out-of-core runs (parsed rows spilled to client_ip hash shards) of main() over
+# generated ELB logs. Each run is a fresh interpreter with its own output directory; reports wall
+# time, the peak RSS of the run (and of its shard workers) and the largest shard.
+# Usage: python benchmarks/bench_out_of_core.py [--files N] [--lines-per-file N] [--clients N]
+#        [--shards N [N ...]] [--shard-workers N]
+import os
+import sys
+import json
+import functools
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BUCKET = "bench-elb-logs"
+
+def peak_rss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    return (peak if sys.platform == "darwin" else peak * 1024) / 2**20
+
+def run_once(workdir, shards, shard_workers, geo_url):
+    # One main() run in this process (the --run mode of this script); prints its results as JSON
+    import advanced_elb_logs_etl as etl
+    from local_s3 import LocalS3Client
+    os.chdir(workdir)
+    s3_root = os.path.join(os.path.dirname(workdir), "s3")
+    etl.s3 = LocalS3Client(s3_root)
+    etl.new_s3_client = functools.partial(LocalS3Client, s3_root)
+    etl.AWS_BUCKET_NAME = BUCKET
+    etl.GEO_BACKEND = "api"
+    etl.GEO_API_URL = geo_url
+    etl.GEO_RATE_PER_MINUTE = 1e9
+    began = time.perf_counter()
+    status = etl.main(report_path="report.json", shards=shards, shard_workers=shard_workers)
+    wall = time.perf_counter() - began
+    report = json.load(open("report.json"))
+    transform = next(s for s in report["stages"] if s["stage"] == "transform_elb_logs")
+    print(json.dumps({
+        "status": status, "wall_s": wall, "rows": transform["rows_out"],
+        "max_shard_rows": transform.get("max_shard_rows"), "spilled_mb": transform.get("spilled_bytes", 0) / 2**20,
+        "peak_rss_mb": peak_rss_mb(resource.RUSAGE_SELF),
+        "children_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=24)
+    parser.add_argument("--lines-per-file", type=int, default=20_000)
+    parser.add_argument("--clients", type=int, default=20_000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[4, 16])
+    parser.add_argument("--shard-workers", type=int, default=1)
+    parser.add_argument("--run", nargs=3, metavar=("WORKDIR", "SHARDS", "GEO_URL"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        workdir, shards, geo_url = args.run
+        run_once(workdir, int(shards), args.shard_workers, geo_url)
+        return
+
+    from generate_logs import generate_log_files
+    from geo_stub import StubGeoServer
+    root = tempfile.mkdtemp(prefix="elb-ooc-")
+    stub = StubGeoServer(varied=True).start()
+    try:
+        files = generate_log_files(os.path.join(root, "s3", BUCKET), files=args.files,
+                                   lines_per_file=args.lines_per_file, clients=args.clients)
+        print(f"{len(files)} file(s), {sum(f['lines'] for f in files):,} lines, "
+              f"{sum(f['uncompressed_bytes'] for f in files) / 1e6:.1f} MB; shard workers: {args.shard_workers}")
+        for shards in [0] + args.shards:
+            workdir = os.path.join(root, f"run-{shards}")
+            os.makedirs(workdir)
+            out = subprocess.run([sys.executable, __file__, "--shard-workers", str(args.shard_workers),
+                                  "--run", workdir, str(shards), stub.url],
+                                 capture_output=True, text=True, check=True).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            label = "in memory" if shards == 0 else f"{shards} shards"
+            detail = (f"  largest shard {r['max_shard_rows']:,} rows, spilled {r['spilled_mb']:.0f} MB"
+                      if shards else "")
+            print(f"  {label:<10} {r['status']:<8} {r['wall_s']:7.2f}s  peak RSS {r['peak_rss_mb']:7.0f} MB "
+                  f"(workers {r['children_peak_rss_mb']:5.0f} MB)  rows {r['rows']:,}{detail}")
+    finally:
+        stub.stop()
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Lines/sec of parse_log_batch against the per-line parse_log_entry.
+# Usage: python benchmarks/bench_parse.py [n_lines]
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from advanced_elb_logs_etl import parse_log_entry, parse_log_batch
+
+SAMPLE_LINE = (
+    'h2 {time} app/erank-app/88dfa9dc536560af {ip}:60827 '
+    '172.31.37.43:80 0.001 {tpt} 0.000 {status} {status} 74 1013 '
+    '"{method} https://beta.erank.com:443/api/{path}?page={page} HTTP/2.0" '
+    '"{ua}" TLS_AES_128_GCM_SHA256 TLSv1.3 '
+    'arn:aws:elasticloadbalancing:us-west-2:848357551741:targetgroup/erank-app-v3-production/902b52047b6f4e28 '
+    '"Root=1-6834ff55-4f9107ec4dcec228218b6176" "beta.erank.com" "session-reused" 1 '
+    '2025-05-26T23:55:01.875000Z "waf,forward" "-" "-" "172.31.37.43:80" "{status}" "-" "-" TID_b087994534c4ac4abc0185b56b077382'
+)
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "python-urllib/3.11",
+]
+
+def make_lines(n, seed=42):
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(n):
+        lines.append(SAMPLE_LINE.format(
+            time=f"2025-05-26T{rnd.randrange(24):02d}:{rnd.randrange(60):02d}:{rnd.randrange(60):02d}.{rnd.randrange(10**6):06d}Z",
+            ip=f"10.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}",
+            tpt=f"{rnd.random():.3f}",
+            status=rnd.choice(["200", "200", "200", "301", "404", "500"]),
+            method=rnd.choice(["GET", "GET", "POST"]),
+            path=rnd.choice(["listings", "keywords", "browser-ext-user", "trends"]),
+            page=rnd.randrange(50),
+            ua=rnd.choice(USER_AGENTS),
+        ))
+    return lines
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    lines = make_lines(n)
+
+    start = time.perf_counter()
+    rows = [parse_log_entry(line, "bench.log.gz") for line in lines]
+    per_line_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df, rejected = parse_log_batch(lines, "bench.log.gz")
+    batch_s = time.perf_counter() - start
+
+    print(f"lines:            {n}")
+    print(f"parse_log_entry:  {n / per_line_s:>12,.0f} lines/sec ({per_line_s:.2f}s, {sum(r is not None for r in rows)} rows)")
+    print(f"parse_log_batch:  {n / batch_s:>12,.0f} lines/sec ({batch_s:.2f}s, {len(df)} rows, {rejected} rejected)")
+    print(f"speedup:          {per_line_s / batch_s:.1f}x")
+
+if __name__ == "__main__":
+    main()
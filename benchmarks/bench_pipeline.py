@@ -0,0 +1,187 @@
+# End-to-end benchmark: generates ELB logs, serves them from a local S3 stand-in, stubs the
+# geolocation API and runs the stages of main() one by one, reporting wall time, lines/sec,
+# MB/sec (uncompressed input) and peak RSS per stage. Results are saved as JSON; pass
+# --compare OLD.json to print the change per stage against an earlier run.
+# Usage: python benchmarks/bench_pipeline.py [--files N] [--lines-per-file N] [--clients N]
+#        [--parse-workers N] [--output PATH] [--compare PATH] [--keep WORKDIR]
+import os
+import sys
+import json
+import functools
+import time
+import shutil
+import importlib
+import resource
+import argparse
+import tempfile
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import advanced_elb_logs_etl as etl
+from generate_logs import generate_log_files
+from local_s3 import LocalS3Client
+from geo_stub import StubGeoServer
+from instrumentation import RSSSampler
+
+BUCKET = "bench-elb-logs"
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_stages(parse_workers):
+    # The stages of main(), in order, as (name, callable returning the rows out)
+    state = {}
+
+    def extract():
+        state["objects"] = etl.extract_log_objects(BUCKET, "")
+        return len(state["objects"])
+
+    def transform():
+        keys = [obj["key"] for obj in state["objects"]]
+        frames = (df for _, df, error in etl.ingest_log_keys(BUCKET, keys, parse_workers) if error is None)
+        state["df"] = etl.concat_log_batches(frames)
+        return len(state["df"])
+
+    def geo_enrich():
+        state["df"] = etl.enrich_with_geolocation(state["df"])
+        return len(state["df"])
+
+    def features():
+        state["sessionizer"] = etl.StreamingSessionizer.load(etl.SESSION_STATE_DIR)
+        state["df"] = etl.add_advanced_features(state["df"], state["sessionizer"])
+        return len(state["df"])
+
+    def write_cleaned():
+        written = etl.write_cleaned_logs(state["df"], etl.new_run_id())
+        etl.compact_cleaned_logs({os.path.dirname(path) for path in written})
+        return len(state["df"])
+
+    def write_hourly():
+        etl.write_hourly_aggregation(state["df"])
+        return len(state["df"])
+
+    def write_error_report():
+        etl.write_error_report(state["df"])
+        return len(state["df"])
+
+    def write_bot_reports():
+        etl.write_bot_traffic_reports(state["df"])
+        return len(state["df"])
+
+    for stage in (extract, transform, geo_enrich, features, write_cleaned, write_hourly,
+                  write_error_report, write_bot_reports):
+        yield stage.__name__, stage
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=24)
+    parser.add_argument("--lines-per-file", type=int, default=20_000)
+    parser.add_argument("--clients", type=int, default=20_000)
+    parser.add_argument("--bot-share", type=float, default=0.1)
+    parser.add_argument("--error-4xx", type=float, default=0.05)
+    parser.add_argument("--error-5xx", type=float, default=0.01)
+    parser.add_argument("--malformed", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--parse-workers", type=int, default=etl.ETL_PARSE_WORKERS)
+    parser.add_argument("--output", help="results JSON (default: benchmarks/results/pipeline-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--keep", help="use this work directory and keep it (default: temporary, removed)")
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.keep) if args.keep else tempfile.mkdtemp(prefix="elb-bench-")
+    cwd = os.getcwd()
+    stub = StubGeoServer(varied=True).start()
+    try:
+        start = time.perf_counter()
+        files = generate_log_files(
+            os.path.join(workdir, "s3", BUCKET), files=args.files, lines_per_file=args.lines_per_file,
+            clients=args.clients, bot_share=args.bot_share, error_4xx=args.error_4xx, error_5xx=args.error_5xx,
+            malformed=args.malformed, seed=args.seed,
+        )
+        input_lines = sum(f["lines"] for f in files)
+        input_bytes = sum(f["uncompressed_bytes"] for f in files)
+        print(f"Generated {len(files)} file(s), {input_lines:,} lines, {input_bytes / 1e6:.1f} MB "
+              f"({sum(f['bytes'] for f in files) / 1e6:.1f} MB gzipped) in {time.perf_counter() - start:.1f}s")
+
+        # Point the ETL at the stand-ins; outputs go to workdir/output (the ETL's paths are relative)
+        os.chdir(workdir)
+        for folder in [etl.OUTPUT_CLEANED, etl.OUTPUT_AGG, etl.OUTPUT_REPORTS]:
+            os.makedirs(folder, exist_ok=True)
+        s3_root = os.path.join(workdir, "s3")
+        etl.s3 = LocalS3Client(s3_root)
+        etl.new_s3_client = functools.partial(LocalS3Client, s3_root)
+        etl.GEO_BACKEND = "api"
+        etl.GEO_API_URL = stub.url
+        etl.GEO_RATE_PER_MINUTE = 1e9
+
+        # The ETL imports its heavy dependencies on first use; load them up front so the first stage
+        # is not charged for them (startup cost is what bench_import.py measures)
+        for module in ("pandas", "pyarrow.dataset", "pyarrow.parquet", "requests", "user_agents", "boto3"):
+            importlib.import_module(module)
+        stages = []
+        with RSSSampler() as rss:
+            for name, stage in run_stages(args.parse_workers):
+                rss.reset()
+                start = time.perf_counter()
+                rows = stage()
+                wall = time.perf_counter() - start
+                stages.append({
+                    "stage": name, "wall_s": round(wall, 4), "rows": rows,
+                    "lines_per_s": round(input_lines / wall, 1) if wall else None,
+                    "mb_per_s": round(input_bytes / 1e6 / wall, 2) if wall else None,
+                    "peak_rss_mb": round(rss.peak() / 2**20, 1),
+                })
+                print(f"  {name:<20} {wall:8.2f}s  {stages[-1]['lines_per_s']:>12,.0f} lines/s  "
+                      f"{stages[-1]['mb_per_s']:>8.2f} MB/s  peak RSS {stages[-1]['peak_rss_mb']:>8.1f} MB  rows {rows:,}")
+        children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        children_peak = children_peak if sys.platform == "darwin" else children_peak * 1024
+        total = sum(s["wall_s"] for s in stages)
+        print(f"  {'total':<20} {total:8.2f}s  {input_lines / total:>12,.0f} lines/s  {input_bytes / 1e6 / total:>8.2f} MB/s  "
+              f"(parse workers peak RSS {children_peak / 2**20:.1f} MB, geo API requests {stub.requests})")
+    finally:
+        os.chdir(cwd)
+        stub.stop()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "keep")},
+        "input": {"files": len(files), "lines": input_lines, "uncompressed_bytes": input_bytes,
+                  "gzipped_bytes": sum(f["bytes"] for f in files)},
+        "stages": stages,
+        "total_wall_s": round(total, 4),
+        "parse_workers_peak_rss_mb": round(children_peak / 2**20, 1),
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"pipeline-{commit or 'nogit'}-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            before = {s["stage"]: s for s in json.load(f)["stages"]}
+        print(f"Change vs {args.compare} (wall time, peak RSS):")
+        for s in stages:
+            old = before.get(s["stage"])
+            if old:
+                print(f"  {s['stage']:<20} {s['wall_s'] / old['wall_s'] - 1:+8.1%}  {s['peak_rss_mb'] - old['peak_rss_mb']:+8.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Deterministic generator of realistic ALB access-log .gz files, laid out like the
+# AWSLogs/<account>/elasticloadbalancing/<region>/YYYY/MM/DD/ prefix ELB writes to S3.
+# Usage: python benchmarks/generate_logs.py OUT_DIR [--files N] [--lines-per-file N] [--clients N]
+#        [--bot-share F] [--error-4xx F] [--error-5xx F] [--malformed F] [--start ISO] [--seed N]
+import os
+import gzip
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+ACCOUNT_ID = "123456789012"
+REGION     = "us-west-2"
+ELB_NAME   = "app/erank-app/88dfa9dc536560af"
+TARGET_GROUP_ARN = f"arn:aws:elasticloadbalancing:{REGION}:{ACCOUNT_ID}:targetgroup/erank-app-production/902b52047b6f4e28"
+CERT_ARN   = f"arn:aws:acm:{REGION}:{ACCOUNT_ID}:certificate/5f1e0c9a-7d53-4c1a-9d0e-3b8f2f1c0d11"
+TARGETS    = ["172.31.37.43", "172.31.12.8", "172.31.44.190"]
+HOSTS      = ["beta.erank.com", "members.erank.com", "erank.com"]
+PATHS      = [
+    "/api/listings", "/api/keywords/top", "/api/keywords/search", "/api/browser-ext-user", "/trends",
+    "/", "/static/app.js", "/static/app.css", "/shop/analyze", "/api/tags/related",
+]
+BROWSER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Safari/605.1.15",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:126.0) Gecko/20100101 Firefox/126.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.5 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36",
+]
+BOT_AGENTS = [
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)",
+    "Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)",
+    "python-urllib/3.11",
+    "Screaming Frog SEO Spider/19.0",
+]
+STATUS_2XX = ["200", "200", "200", "200", "201", "204", "301", "302", "304"]
+STATUS_4XX = ["400", "401", "403", "404", "404", "404", "429"]
+STATUS_5XX = ["500", "502", "503", "504"]
+MALFORMED = [
+    "garbage line",
+    "h2 not-a-time app/erank-app/88dfa9dc536560af 1.2.3.4:5678",
+    "",
+]
+
+def client_ips(n_clients, seed):
+    # Public-looking IPv4 addresses (the geo stub treats 10.x as private)
+    rnd = random.Random(seed)
+    ips = set()
+    while len(ips) < n_clients:
+        first = rnd.choice([3, 18, 24, 34, 52, 66, 73, 98, 104, 142, 172, 185, 203])
+        ips.add(f"{first}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(1, 255)}")
+    return sorted(ips)
+
+def object_key(prefix, ts, node_ip, rnd):
+    return (
+        f"{prefix}AWSLogs/{ACCOUNT_ID}/elasticloadbalancing/{REGION}/{ts:%Y/%m/%d}/"
+        f"{ACCOUNT_ID}_elasticloadbalancing_{REGION}_{ELB_NAME.replace('/', '.')}_{ts:%Y%m%dT%H%MZ}_"
+        f"{node_ip}_{rnd.getrandbits(32):08x}.log.gz"
+    )
+
+def _elb_time(ts):
+    return ts.strftime("%Y-%m-%dT%H:%M:%S.%f") + "Z"
+
+def log_line(rnd, ts, client, user_agent, error_4xx, error_5xx):
+    roll = rnd.random()
+    if roll < error_5xx:
+        status = rnd.choice(STATUS_5XX)
+    elif roll < error_5xx + error_4xx:
+        status = rnd.choice(STATUS_4XX)
+    else:
+        status = rnd.choice(STATUS_2XX)
+    target = rnd.choice(TARGETS)
+    no_target = status in ("502", "503", "504") and rnd.random() < 0.5
+    request_s, response_s = rnd.uniform(0, 0.002), rnd.uniform(0, 0.001)
+    target_s = -1 if no_target else round(rnd.gammavariate(2.0, 0.08), 3)
+    if no_target:
+        request_s = response_s = -1
+    host = rnd.choice(HOSTS)
+    path = rnd.choice(PATHS)
+    query = f"?page={rnd.randrange(50)}&q=item{rnd.randrange(5000)}" if path.startswith("/api") else ""
+    method = "POST" if path == "/api/browser-ext-user" else rnd.choice(["GET", "GET", "GET", "GET", "HEAD"])
+    created = ts - timedelta(microseconds=rnd.randrange(1000, 400000))
+    port = rnd.randrange(1024, 65536)
+    return (
+        f'{rnd.choice(["h2", "h2", "https"])} {_elb_time(ts)} {ELB_NAME} {client}:{port} '
+        f'{"-" if no_target else target + ":80"} {request_s:.3f} {target_s:.3f} {response_s:.3f} '
+        f'{status} {"-" if no_target else status} {rnd.randrange(60, 2000)} {rnd.randrange(200, 60000)} '
+        f'"{method} https://{host}:443{path}{query} HTTP/2.0" "{user_agent}" '
+        f'TLS_AES_128_GCM_SHA256 TLSv1.3 {TARGET_GROUP_ARN} '
+        f'"Root=1-{int(ts.timestamp()):08x}-{rnd.getrandbits(96):024x}" "{host}" "{CERT_ARN}" 1 '
+        f'{_elb_time(created)} "waf,forward" "-" "{"TargetConnectionError" if no_target else "-"}" '
+        f'"{"-" if no_target else target + ":80"}" "{"-" if no_target else status}" "-" "-" '
+        f'TID_{rnd.getrandbits(128):032x}'
+    )
+
+def generate_log_files(out_dir, files=12, lines_per_file=10_000, clients=5_000, bot_share=0.1,
+                       error_4xx=0.05, error_5xx=0.01, malformed=0.001, start="2025-05-26T00:00:00Z",
+                       interval_minutes=5, prefix="", seed=42):
+    # Writes `files` .gz objects under out_dir, one per ELB delivery interval, and returns
+    # [{"key", "path", "lines", "bytes", "uncompressed_bytes"}] in key order. Same arguments -> same bytes.
+    rnd = random.Random(seed)
+    ips = client_ips(clients, seed)
+    # Zipf-like popularity: a few clients send most of the traffic
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(len(ips))]
+    bots = {ip for ip in ips if rnd.random() < bot_share}
+    agents = {ip: rnd.choice(BOT_AGENTS if ip in bots else BROWSER_AGENTS) for ip in ips}
+    t0 = datetime.fromisoformat(start.replace("Z", "+00:00")).astimezone(timezone.utc)
+    written = []
+    for i in range(files):
+        file_rnd = random.Random(f"{seed}-{i}")
+        begin = t0 + timedelta(minutes=interval_minutes * i)
+        offsets = sorted(file_rnd.randrange(interval_minutes * 60 * 10**6) for _ in range(lines_per_file))
+        chosen = file_rnd.choices(ips, weights=weights, k=lines_per_file)
+        lines = []
+        for offset, ip in zip(offsets, chosen):
+            if file_rnd.random() < malformed:
+                lines.append(file_rnd.choice(MALFORMED))
+                continue
+            ts = begin + timedelta(microseconds=offset)
+            lines.append(log_line(file_rnd, ts, ip, agents[ip], error_4xx, error_5xx))
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        key = object_key(prefix, begin + timedelta(minutes=interval_minutes), f"10.0.{i % 4}.{10 + i % 3}", file_rnd)
+        path = os.path.join(out_dir, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f, gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0) as gz:
+            gz.write(data)
+        written.append({"key": key, "path": path, "lines": len(lines), "bytes": os.path.getsize(path),
+                        "uncompressed_bytes": len(data)})
+    return sorted(written, key=lambda f: f["key"])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("out_dir")
+    parser.add_argument("--files", type=int, default=12)
+    parser.add_argument("--lines-per-file", type=int, default=10_000)
+    parser.add_argument("--clients", type=int, default=5_000)
+    parser.add_argument("--bot-share", type=float, default=0.1)
+    parser.add_argument("--error-4xx", type=float, default=0.05)
+    parser.add_argument("--error-5xx", type=float, default=0.01)
+    parser.add_argument("--malformed", type=float, default=0.001)
+    parser.add_argument("--start", default="2025-05-26T00:00:00Z")
+    parser.add_argument("--prefix", default="")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    files = generate_log_files(
+        args.out_dir, files=args.files, lines_per_file=args.lines_per_file, clients=args.clients,
+        bot_share=args.bot_share, error_4xx=args.error_4xx, error_5xx=args.error_5xx,
+        malformed=args.malformed, start=args.start, prefix=args.prefix, seed=args.seed,
+    )
+    total = sum(f["bytes"] for f in files)
+    print(f"Wrote {len(files)} file(s), {sum(f['lines'] for f in files):,} lines, {total / 1e6:.1f} MB to {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
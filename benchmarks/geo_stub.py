@@ -0,0 +1,80 @@
+# Local stand-in for the ip-api.com batch endpoint, used by the tests and the pipeline benchmark
+import json
+import zlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# (country, countryCode, region, regionName, city, lat, lon) answered in varied mode
+STUB_LOCATIONS = [
+    ("United States", "US", "WA", "Washington", "Seattle", 47.6, -122.3),
+    ("United States", "US", "NY", "New York", "New York", 40.7, -74.0),
+    ("United States", "US", "CA", "California", "Los Angeles", 34.1, -118.2),
+    ("Canada", "CA", "ON", "Ontario", "Toronto", 43.7, -79.4),
+    ("Germany", "DE", "BE", "Land Berlin", "Berlin", 52.5, 13.4),
+    ("United Kingdom", "GB", "ENG", "England", "London", 51.5, -0.1),
+    ("India", "IN", "KA", "Karnataka", "Bengaluru", 12.97, 77.59),
+    ("Brazil", "BR", "SP", "Sao Paulo", "Sao Paulo", -23.5, -46.6),
+    ("Japan", "JP", "13", "Tokyo", "Tokyo", 35.7, 139.7),
+    ("Australia", "AU", "NSW", "New South Wales", "Sydney", -33.9, 151.2),
+]
+
+class StubGeoServer:
+    # varied=False answers Seattle for every public IP; varied=True spreads IPs over STUB_LOCATIONS
+    def __init__(self, varied=False):
+        self.varied = varied
+        self.requests = 0
+        self.ips_seen = 0
+        self.rate_limited = 0       # answer this many requests with 429 first
+        self.server_errors = 0      # then this many with 500
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                ips = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub.lock:
+                    stub.requests += 1
+                    if stub.rate_limited > 0:
+                        stub.rate_limited -= 1
+                        return self._reply(429, {"message": "too many requests"}, {"X-Rl": "0", "X-Ttl": "0"})
+                    if stub.server_errors > 0:
+                        stub.server_errors -= 1
+                        return self._reply(500, {"message": "boom"})
+                    stub.ips_seen += len(ips)
+                self._reply(200, [stub.geo(ip) for ip in ips], {"X-Rl": "100", "X-Ttl": "60"})
+
+        return Handler
+
+    def geo(self, ip):
+        if ip.startswith("10."):
+            return {"status": "fail", "message": "private range", "query": ip}
+        location = STUB_LOCATIONS[zlib.crc32(ip.encode()) % len(STUB_LOCATIONS) if self.varied else 0]
+        record = dict(zip(["country", "countryCode", "region", "regionName", "city", "lat", "lon"], location))
+        return dict(record, status="success", isp=f"Stub ISP {zlib.crc32(ip.encode()) % 7}" if self.varied else "Stub ISP",
+                    query=ip)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
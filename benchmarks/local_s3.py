@@ -0,0 +1,74 @@
+# Filesystem stand-in for the parts of the boto3 S3 client the ETL uses
+# (list_objects_v2 paginator and get_object). Bucket "b" is the directory root/b.
+import os
+import hashlib
+from datetime import datetime, timezone
+
+class LocalS3Client:
+    def __init__(self, root, page_size=1000):
+        self.root = root
+        self.page_size = page_size
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def _list(self, bucket, prefix):
+        base = os.path.join(self.root, bucket)
+        keys = []
+        for dirpath, _, filenames in os.walk(base):
+            for name in filenames:
+                key = os.path.relpath(os.path.join(dirpath, name), base).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+    def _head(self, bucket, key):
+        path = self._path(bucket, key)
+        stat = os.stat(path)
+        etag = hashlib.md5(f"{key}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+        return {
+            "Key": key, "Size": stat.st_size, "ETag": f'"{etag}"',
+            "LastModified": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+        }
+
+    def list_objects_v2(self, Bucket, Prefix="", StartAfter="", ContinuationToken=None, Delimiter=None, **kwargs):
+        keys = [k for k in self._list(Bucket, Prefix) if k > (ContinuationToken or StartAfter or "")]
+        page = {"KeyCount": 0, "IsTruncated": False, "Contents": []}
+        if Delimiter:
+            # Group keys below the prefix into CommonPrefixes, like S3 does
+            prefixes = sorted({Prefix + k[len(Prefix):].split(Delimiter, 1)[0] + Delimiter
+                               for k in keys if Delimiter in k[len(Prefix):]})
+            keys = [k for k in keys if Delimiter not in k[len(Prefix):]]
+            page["CommonPrefixes"] = [{"Prefix": p} for p in prefixes]
+        batch = keys[:self.page_size]
+        page["Contents"] = [self._head(Bucket, k) for k in batch]
+        page["KeyCount"] = len(batch)
+        if len(keys) > self.page_size:
+            page["IsTruncated"] = True
+            page["NextContinuationToken"] = batch[-1]
+        return page
+
+    def get_paginator(self, operation):
+        if operation != "list_objects_v2":
+            raise NotImplementedError(operation)
+        return _ListObjectsPaginator(self)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"NoSuchKey: s3://{Bucket}/{Key}")
+        head = self._head(Bucket, Key)
+        return dict(head, ContentLength=head["Size"], Body=open(path, "rb"))
+
+class _ListObjectsPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.client.list_objects_v2(ContinuationToken=token, **kwargs)
+            yield page
+            if not page["IsTruncated"]:
+                return
+            token = page["NextContinuationToken"]
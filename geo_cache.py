@@ -0,0 +1,150 @@
+import os
+import time
+import sqlite3
+from lazy import lazy_import
+pd = lazy_import("pandas")
+
+from lru import LRUCache
+from logger import get_logger
+logger = get_logger(__name__)
+
+GEO_FIELDS = [
+    "status", "message", "country", "countryCode", "region", "regionName", "city",
+    "lat", "lon", "isp", "query", "api_fetch_timestamp"
+]
+_SQLITE_MAX_VARS = 900
+
+class GeoCache:
+    # Keyed on-disk geolocation cache (SQLite) with TTL expiry, an LRU size cap and an in-process LRU in front.
+    # Rows are read only for the IPs asked for and written incrementally.
+    def __init__(self, path, ttl_seconds, fail_ttl_seconds, max_entries, memory_entries=50_000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.fail_ttl_seconds = fail_ttl_seconds
+        self.max_entries = max_entries
+        self.memory = LRUCache(memory_entries)
+        self.stats = {"hits": 0, "memory_hits": 0, "misses": 0, "expired": 0, "evictions": 0, "writes": 0}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS geo (
+                query TEXT PRIMARY KEY, status TEXT, message TEXT, country TEXT, countryCode TEXT,
+                region TEXT, regionName TEXT, city TEXT, lat REAL, lon REAL, isp TEXT,
+                api_fetch_timestamp REAL, last_access REAL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS geo_last_access ON geo (last_access)")
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM geo").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def _expired(self, record, now):
+        ttl = self.fail_ttl_seconds if record["status"] == "fail" else self.ttl_seconds
+        fetched = record["api_fetch_timestamp"]
+        return fetched is None or fetched < now - ttl
+
+    def get_many(self, ips):
+        # Cached, unexpired rows for `ips` as a DataFrame indexed by "query"; everything else is a miss
+        now = time.time()
+        found = {}
+        pending = []
+        for ip in ips:
+            record = self.memory.get(ip)
+            if record is not None and not self._expired(record, now):
+                found[ip] = record
+                self.stats["memory_hits"] += 1
+            else:
+                pending.append(ip)
+        columns = [c for c in GEO_FIELDS if c != "query"]
+        for i in range(0, len(pending), _SQLITE_MAX_VARS):
+            chunk = pending[i:i + _SQLITE_MAX_VARS]
+            rows = self.conn.execute(
+                f"SELECT query, {', '.join(columns)} FROM geo WHERE query IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for row in rows:
+                record = dict(zip(["query"] + columns, row))
+                if self._expired(record, now):
+                    self.stats["expired"] += 1
+                    continue
+                found[record["query"]] = record
+                self.memory.put(record["query"], record)
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(ips) - len(found)
+        if found:
+            self.conn.executemany("UPDATE geo SET last_access = ? WHERE query = ?", [(now, ip) for ip in found])
+            self.conn.commit()
+        return _records_to_frame(found.values())
+
+    def put_many(self, records):
+        now = time.time()
+        rows = []
+        for record in records:
+            fetched = record.get("api_fetch_timestamp")
+            record = {c: _none_if_na(record.get(c)) for c in GEO_FIELDS}
+            record["api_fetch_timestamp"] = pd.Timestamp(fetched).timestamp() if fetched is not None else now
+            self.memory.put(record["query"], record)
+            rows.append([record[c] for c in GEO_FIELDS] + [now])
+        if not rows:
+            return
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO geo ({', '.join(GEO_FIELDS)}, last_access) VALUES ({', '.join('?' * (len(GEO_FIELDS) + 1))})",
+            rows
+        )
+        self.stats["writes"] += len(rows)
+        self.conn.commit()
+        self.enforce_size_cap()
+
+    def enforce_size_cap(self):
+        excess = len(self) - self.max_entries
+        if excess <= 0:
+            return 0
+        victims = [row[0] for row in self.conn.execute(
+            "SELECT query FROM geo ORDER BY last_access LIMIT ?", (excess,)
+        )]
+        for i in range(0, len(victims), _SQLITE_MAX_VARS):
+            chunk = victims[i:i + _SQLITE_MAX_VARS]
+            self.conn.execute(f"DELETE FROM geo WHERE query IN ({', '.join('?' * len(chunk))})", chunk)
+        self.conn.commit()
+        for ip in victims:
+            self.memory.pop(ip)
+        self.stats["evictions"] += len(victims)
+        return len(victims)
+
+    def purge_expired(self):
+        now = time.time()
+        cur = self.conn.execute(
+            "DELETE FROM geo WHERE api_fetch_timestamp < ? OR (status = 'fail' AND api_fetch_timestamp < ?)",
+            (now - self.ttl_seconds, now - self.fail_ttl_seconds)
+        )
+        self.conn.commit()
+        return cur.rowcount
+
+    def import_parquet(self, path):
+        # One-off migration of the old whole-file parquet cache
+        df = pd.read_parquet(path)
+        if df.index.name == "query":
+            df = df.reset_index()
+        if df.empty or "query" not in df.columns:
+            return 0
+        self.put_many(df.to_dict("records"))
+        logger.info(f"Imported {len(df)} cached geolocation(s) from {path}")
+        return len(df)
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else None
+
+def _none_if_na(value):
+    try:
+        return None if pd.isna(value) else value
+    except (TypeError, ValueError):
+        return value
+
+def _records_to_frame(records):
+    df = pd.DataFrame(list(records), columns=GEO_FIELDS)
+    df["api_fetch_timestamp"] = pd.to_datetime(df["api_fetch_timestamp"], unit="s", utc=True)
+    return df.set_index("query")
@@ -0,0 +1,120 @@
+from __future__ import annotations
+import os
+import socket
+import ipaddress
+from lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+from logger import get_logger
+logger = get_logger(__name__)
+
+# Same layout as the API-backed geolocation cache (see load_geo_cache)
+GEO_COLUMNS = [
+    "status", "message", "country", "countryCode", "region", "regionName", "city",
+    "lat", "lon", "isp", "query", "api_fetch_timestamp"
+]
+GEO_ATTRIBUTES = ["country", "countryCode", "region", "regionName", "city", "lat", "lon", "isp"]
+
+# IPv4 addresses are stored IPv4-mapped (::ffff:a.b.c.d) so both families share one sorted key space
+_V4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff\xff"
+
+def ip_key(ip):
+    # 16-byte big-endian key of an address, or None when it is not a valid IP
+    try:
+        if ":" in ip:
+            return socket.inet_pton(socket.AF_INET6, ip)
+        return _V4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, ip)
+    except (OSError, TypeError, ValueError):
+        return None
+
+def _address_key(addr):
+    if addr.version == 4:
+        return _V4_MAPPED_PREFIX + addr.packed
+    return addr.packed
+
+class IPRangeDB:
+    # Sorted, non-overlapping [start, end] ranges as S16 arrays plus the attributes of each range
+    def __init__(self, starts, ends, attributes: pd.DataFrame, fetch_timestamp=None):
+        order = np.argsort(starts, kind="stable")
+        self.starts = np.asarray(starts, dtype="S16")[order]
+        self.ends   = np.asarray(ends, dtype="S16")[order]
+        self.attributes = attributes.iloc[order].reset_index(drop=True).reindex(columns=GEO_ATTRIBUTES)
+        self.fetch_timestamp = fetch_timestamp or pd.Timestamp.now(tz="UTC")
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup_ranges(self, ips):
+        # Range index for each IP (-1 when unmatched), resolved with one vectorized binary search
+        keys = [ip_key(ip) for ip in ips]
+        valid = np.array([k is not None for k in keys], dtype=bool)
+        key_arr = np.array([k if k is not None else b"" for k in keys], dtype="S16")
+        idx = np.searchsorted(self.starts, key_arr, side="right") - 1
+        hit = valid & (idx >= 0)
+        hit[hit] &= key_arr[hit] <= self.ends[idx[hit]]
+        return np.where(hit, idx, -1)
+
+    def lookup(self, ips):
+        # Geolocation rows (GEO_COLUMNS, indexed by "query") for the distinct IPs in `ips`
+        uniques = pd.unique(pd.Series(ips).dropna().astype(object))
+        idx = self.lookup_ranges(uniques)
+        hit = idx >= 0
+        geo = self.attributes.iloc[np.where(hit, idx, 0)].reset_index(drop=True)
+        geo.loc[~hit, GEO_ATTRIBUTES] = None
+        geo["status"]  = np.where(hit, "success", "fail")
+        geo["message"] = np.where(hit, None, "not in local IP range database")
+        geo["query"]   = uniques
+        geo["api_fetch_timestamp"] = self.fetch_timestamp
+        return geo[GEO_COLUMNS].set_index("query")
+
+def _ranges_from_csv(path):
+    # CSV with either a CIDR "network" column or "start_ip"/"end_ip" columns, plus GEO_ATTRIBUTES
+    df = pd.read_csv(path, keep_default_na=False, na_values=[""])
+    if "network" in df.columns:
+        networks = [ipaddress.ip_network(n, strict=False) for n in df["network"]]
+        starts = [_address_key(n.network_address) for n in networks]
+        ends   = [_address_key(n.broadcast_address) for n in networks]
+    else:
+        starts = [_address_key(ipaddress.ip_address(ip)) for ip in df["start_ip"]]
+        ends   = [_address_key(ipaddress.ip_address(ip)) for ip in df["end_ip"]]
+    for col in ("lat", "lon"):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return starts, ends, df.reindex(columns=GEO_ATTRIBUTES)
+
+def _ranges_from_mmdb(path):
+    # MaxMind GeoIP2/GeoLite2 City (and optionally ISP) databases; needs the maxminddb package
+    try:
+        import maxminddb
+    except ImportError as e:
+        raise ImportError("Reading .mmdb files requires the 'maxminddb' package (pip install maxminddb)") from e
+    starts, ends, rows = [], [], []
+    with maxminddb.open_database(path) as reader:
+        for network, record in reader:
+            record = record or {}
+            subdivision = (record.get("subdivisions") or [{}])[0]
+            location = record.get("location", {})
+            starts.append(_address_key(network.network_address))
+            ends.append(_address_key(network.broadcast_address))
+            rows.append({
+                "country": record.get("country", {}).get("names", {}).get("en"),
+                "countryCode": record.get("country", {}).get("iso_code"),
+                "region": subdivision.get("iso_code"),
+                "regionName": subdivision.get("names", {}).get("en"),
+                "city": record.get("city", {}).get("names", {}).get("en"),
+                "lat": location.get("latitude"),
+                "lon": location.get("longitude"),
+                "isp": record.get("isp") or record.get("autonomous_system_organization"),
+            })
+    return starts, ends, pd.DataFrame(rows, columns=GEO_ATTRIBUTES)
+
+def load_ip_range_db(path):
+    if path.lower().endswith(".mmdb"):
+        starts, ends, attributes = _ranges_from_mmdb(path)
+    else:
+        starts, ends, attributes = _ranges_from_csv(path)
+    fetch_timestamp = pd.Timestamp(os.path.getmtime(path), unit="s", tz="UTC")
+    db = IPRangeDB(starts, ends, attributes, fetch_timestamp)
+    logger.info(f"Loaded {len(db)} IP ranges from {path}")
+    return db
@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import logging
+import resource
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from logger import get_logger
+logger = get_logger(__name__)
+
+PROFILERS = ("cprofile", "tracemalloc")
+
+def parse_profile_option(value):
+    # "cprofile,tracemalloc" / "all" / "" -> set of profilers to run per stage
+    names = {name.strip().lower() for name in (value or "").split(",") if name.strip()}
+    if "all" in names:
+        return set(PROFILERS)
+    unknown = names - set(PROFILERS)
+    if unknown:
+        logger.warning(f"Ignoring unknown profiler(s): {sorted(unknown)} (known: {', '.join(PROFILERS)})")
+    return names & set(PROFILERS)
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs: fall back to the process high-water mark (KiB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class RSSSampler:
+    # Samples this process' RSS on a background thread; peak() is the maximum since the last reset()
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._peak = current_rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, current_rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def reset(self):
+        self._peak = current_rss_bytes()
+
+    def peak(self):
+        return max(self._peak, current_rss_bytes())
+
+class LogLevelCounter(logging.Handler):
+    # Counts WARNING / ERROR records reaching the root logger
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.counts = {"warnings": 0, "errors": 0}
+
+    def emit(self, record):
+        self.counts["errors" if record.levelno >= logging.ERROR else "warnings"] += 1
+
+def bytes_written_since(paths, since):
+    # Total size of the files under `paths` (files or directories) modified at or after `since`
+    total = 0
+    for path in paths:
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = (os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        for file in files:
+            try:
+                st = os.stat(file)
+            except OSError:
+                continue
+            if st.st_mtime >= since:
+                total += st.st_size
+    return total
+
+class RunReport:
+    # Per-stage metrics of one ETL run (duration, rows, bytes, peak RSS, log errors, custom counters),
+    # optionally with cProfile / tracemalloc captures, written as one JSON document at the end.
+    def __init__(self, run_id, profile=(), profile_dir=None, top_allocations=10):
+        self.run_id = run_id
+        self.profile = set(profile)
+        self.profile_dir = profile_dir or os.path.join("output", "run_reports", f"profiles-{run_id}")
+        self.top_allocations = top_allocations
+        self.started_at = datetime.now(timezone.utc)
+        self.stages = []
+        self.run = {}
+        self._start = time.perf_counter()
+        self._log_counter = LogLevelCounter()
+        logging.getLogger().addHandler(self._log_counter)
+        self._rss = RSSSampler().__enter__()
+        self._closed = False
+
+    @contextmanager
+    def stage(self, name, rows_in=None, counters=None, outputs=()):
+        # Yields the stage's metrics dict; the body may add e.g. rows_out or its own counters.
+        # `counters` is a callable returning {name: number}; the report keeps the stage's deltas.
+        metrics = {"stage": name, "rows_in": rows_in}
+        counters_before = counters() if counters is not None else {}
+        logs_before = dict(self._log_counter.counts)
+        since = time.time()
+        self._rss.reset()
+        profiler = cProfile.Profile() if "cprofile" in self.profile else None
+        if "tracemalloc" in self.profile:
+            tracemalloc.start()
+        start = time.perf_counter()
+        status = "ok"
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield metrics
+        except BaseException as e:
+            status = "failed"
+            metrics["exception"] = repr(e)
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            metrics["duration_s"] = round(time.perf_counter() - start, 4)
+            metrics["peak_rss_mb"] = round(self._rss.peak() / 2**20, 1)
+            if counters is not None:
+                for key, value in counters().items():
+                    metrics[key] = value - counters_before.get(key, 0)
+            for key, value in self._log_counter.counts.items():
+                metrics[key] = value - logs_before[key]
+            if outputs:
+                metrics["bytes_written"] = bytes_written_since(outputs, since)
+            if tracemalloc.is_tracing() and "tracemalloc" in self.profile:
+                metrics["tracemalloc"] = self._tracemalloc_summary()
+                tracemalloc.stop()
+            if profiler is not None:
+                metrics["cprofile"] = self._dump_profile(profiler, name)
+            if status == "ok" and metrics["errors"]:
+                status = "degraded"
+            metrics["status"] = status
+            self.stages.append(metrics)
+            logger.info(
+                f"Stage {name}: {status} in {metrics['duration_s']:.2f}s, rows {rows_in} -> {metrics.get('rows_out')}, "
+                f"peak RSS {metrics['peak_rss_mb']} MB"
+            )
+
+    def _tracemalloc_summary(self):
+        _, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics("lineno")[:self.top_allocations]
+        return {
+            "peak_mb": round(peak / 2**20, 2),
+            "top_allocations": [
+                {"location": str(stat.traceback[0]), "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                for stat in top
+            ],
+        }
+
+    def _dump_profile(self, profiler, name):
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{name}.prof")
+            profiler.dump_stats(path)
+            return path
+        except Exception as e:
+            logger.error(f"Error writing profile of stage {name}: {e}")
+            return None
+
+    def status(self, since=0):
+        # Worst status of the run; `since` only looks at the stages from that index on
+        statuses = {stage["status"] for stage in self.stages[since:]}
+        for status in ("failed", "degraded"):
+            if status in statuses or self.run.get("status") == status:
+                return status
+        return "ok"
+
+    def to_dict(self):
+        return {
+            "run_id": self.run_id,
+            "status": self.status(),
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "finished_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "duration_s": round(time.perf_counter() - self._start, 4),
+            "profile": sorted(self.profile),
+            **{key: value for key, value in self.run.items() if key != "status"},
+            "stages": self.stages,
+        }
+
+    def close(self):
+        if not self._closed:
+            logging.getLogger().removeHandler(self._log_counter)
+            self._rss.__exit__(None, None, None)
+            self._closed = True
+
+    def write(self, path):
+        # Writes the report as JSON (atomically) and stops collecting
+        report = self.to_dict()
+        self.close()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(report, f, indent=2, default=_json_default)
+        os.replace(tmp, path)
+        logger.info(f"Run report written to {path} (status: {report['status']})")
+        return report
+
+def _json_default(value):
+    # numpy scalars and anything else json does not know
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
@@ -0,0 +1,27 @@
+import importlib
+
+class LazyModule:
+    # Stand-in for `import name as alias` that imports the module on first attribute access,
+    # so importing a module that only *might* need pandas/pyarrow/boto3 stays cheap
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = self.__dict__["_module"] = importlib.import_module(self.__dict__["_name"])
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module {self.__dict__['_name']!r} ({state})>"
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,130 @@
+import math
+from lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Mergeable sketches computed for many groups at once.
+# Every sketch is kept in sparse "long form": parallel arrays (group, key, value) sorted by (group, key),
+# so one vectorized pass builds the sketches of all groups and merging is a concat + reduce.
+
+HLL_PRECISION      = 12      # 4096 registers, ~1.6% standard error on distinct counts
+QUANTILE_ACCURACY  = 0.01    # relative accuracy of quantile estimates
+QUANTILE_MIN_VALUE = 1e-3    # |x| below this falls in the zero bucket
+_QUANTILE_KEY_OFFSET = 4096  # keeps keys of values in (QUANTILE_MIN_VALUE, 1) positive
+
+def reduce_pairs(groups, keys, values, op):
+    # Combine the values of equal (group, key) pairs with ufunc `op` (np.maximum, np.add).
+    # Pairs are sorted on one packed int64 (group in the high 32 bits, key + 2**31 in the low ones).
+    groups, keys, values = np.asarray(groups, dtype=np.int64), np.asarray(keys), np.asarray(values)
+    if len(groups) == 0:
+        return groups, keys, values
+    packed = (groups << 32) | (keys.astype(np.int64) + (1 << 31))
+    order = np.argsort(packed)
+    packed = packed[order]
+    starts = np.flatnonzero(np.r_[True, packed[1:] != packed[:-1]])
+    return groups[order[starts]], keys[order[starts]], op.reduceat(values[order], starts)
+
+def pack(groups, keys, values, n_groups):
+    # Serialize long-form sketches to one (keys, values) pair of byte strings per group
+    bounds = np.searchsorted(groups, np.arange(n_groups + 1))
+    key_blobs = [keys[bounds[i]:bounds[i + 1]].tobytes() for i in range(n_groups)]
+    value_blobs = [values[bounds[i]:bounds[i + 1]].tobytes() for i in range(n_groups)]
+    return key_blobs, value_blobs
+
+def unpack(key_blobs, value_blobs, key_dtype, value_dtype):
+    # Inverse of pack; row i of the blobs becomes group i
+    key_dtype, value_dtype = np.dtype(key_dtype), np.dtype(value_dtype)
+    lengths = np.fromiter((len(b) // key_dtype.itemsize for b in key_blobs), dtype=np.int64, count=len(key_blobs))
+    groups = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    keys = np.frombuffer(b"".join(key_blobs), dtype=key_dtype)
+    values = np.frombuffer(b"".join(value_blobs), dtype=value_dtype)
+    return groups, keys, values
+
+# HyperLogLog distinct counting
+
+def hash64(values):
+    # Stable 64-bit hash (same value -> same hash in every process and run); only distinct values are hashed
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=False)
+    hashes = pd.util.hash_pandas_object(pd.Series(uniques), index=False).to_numpy(dtype=np.uint64)
+    return hashes[codes]
+
+def hll_observe(group_codes, values, p=HLL_PRECISION):
+    # Sparse HLL registers (group, register index, rank) of `values` split by group code; codes < 0 are skipped
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    hashes = hash64(values)
+    keep = group_codes >= 0
+    group_codes, hashes = group_codes[keep], hashes[keep]
+    idx = (hashes >> np.uint64(64 - p)).astype(np.uint16)
+    # Rank = position of the first 1-bit in the remaining bits; the top 52 of them convert to float exactly
+    width = min(64 - p, 52)
+    rest = (hashes << np.uint64(p)) >> np.uint64(64 - width)
+    bit_length = np.where(rest > 0, np.frexp(rest.astype(np.float64))[1], 0)
+    rank = (width - bit_length + 1).astype(np.uint8)
+    return reduce_pairs(group_codes, idx, rank, np.maximum)
+
+def hll_merge(groups, idx, rank):
+    return reduce_pairs(groups, idx, rank, np.maximum)
+
+def hll_estimate(groups, idx, rank, n_groups, p=HLL_PRECISION):
+    # Distinct-count estimate per group, with linear counting for small cardinalities
+    m = 1 << p
+    alpha = 0.7213 / (1 + 1.079 / m)
+    nonzero = np.bincount(groups, minlength=n_groups)
+    harmonic = (m - nonzero) + np.bincount(groups, weights=np.ldexp(1.0, -rank.astype(np.int64)), minlength=n_groups)
+    raw = alpha * m * m / harmonic
+    zeros = m - nonzero
+    with np.errstate(divide="ignore"):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+# Quantiles: log-bucketed histogram with relative accuracy (DDSketch-style)
+
+def _gamma(accuracy):
+    return (1 + accuracy) / (1 - accuracy)
+
+def quantile_keys(values, accuracy=QUANTILE_ACCURACY):
+    # Bucket key of each value; keys sort in the same order as the values they stand for
+    values = np.asarray(values, dtype=np.float64)
+    magnitude = np.abs(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k = np.ceil(np.log(magnitude) / math.log(_gamma(accuracy))) + _QUANTILE_KEY_OFFSET
+    k = np.where(magnitude > QUANTILE_MIN_VALUE, k, 0)
+    return (np.sign(values) * k).astype(np.int32)
+
+def quantile_key_values(keys, accuracy=QUANTILE_ACCURACY):
+    gamma = _gamma(accuracy)
+    keys = np.asarray(keys, dtype=np.int64)
+    magnitude = 2 * np.power(gamma, np.abs(keys) - _QUANTILE_KEY_OFFSET) / (gamma + 1)
+    return np.where(keys == 0, 0.0, np.sign(keys) * magnitude)
+
+def quantile_observe(group_codes, values, accuracy=QUANTILE_ACCURACY):
+    # Sparse quantile sketches (group, bucket key, count); NaN values and codes < 0 are skipped
+    group_codes = np.asarray(group_codes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    keep = (group_codes >= 0) & ~np.isnan(values)
+    keys = quantile_keys(values[keep], accuracy)
+    return reduce_pairs(group_codes[keep], keys, np.ones(len(keys), dtype=np.int64), np.add)
+
+def quantile_merge(groups, keys, counts):
+    return reduce_pairs(groups, keys, counts, np.add)
+
+def quantile_values(groups, keys, counts, n_groups, qs, accuracy=QUANTILE_ACCURACY):
+    # Estimated quantiles `qs` per group as an (n_groups, len(qs)) array; NaN for empty groups
+    result = np.full((n_groups, len(qs)), np.nan)
+    if len(groups) == 0:
+        return result
+    cum = np.cumsum(counts)
+    bounds = np.searchsorted(groups, np.arange(n_groups + 1))
+    before = np.r_[0, cum][bounds[:-1]]
+    total = np.r_[0, cum][bounds[1:]] - before
+    present = total > 0
+    values = quantile_key_values(keys, accuracy)
+    before, total = before[present], total[present]
+    for j, q in enumerate(qs):
+        # Linear interpolation between the two nearest ranks, like pandas' quantile/median
+        rank = q * (total - 1)
+        lo = values[np.searchsorted(cum, before + np.floor(rank), side="right")]
+        hi = values[np.searchsorted(cum, before + np.ceil(rank), side="right")]
+        frac = rank - np.floor(rank)
+        result[present, j] = lo + (hi - lo) * frac
+    return result
@@ -0,0 +1,95 @@
+import os
+import shutil
+from lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+from logger import get_logger
+logger = get_logger(__name__)
+
+def shard_of(values, shards):
+    # Shard number of each value from a stable hash of its string form, so the same key lands in the
+    # same shard in every process and run (missing values all share one shard)
+    hashes = pd.util.hash_array(np.asarray(values, dtype=object))
+    return (hashes % np.uint64(shards)).astype(np.int64)
+
+class ShardSpiller:
+    # Hash-partitions frames by `key` into `shards` directories of Parquet part files under `root`.
+    # Rows are buffered in memory until `buffer_rows` are held in total, then the largest shard buffer
+    # is written out, so memory stays bounded however much is added. `concat` combines a shard's
+    # buffered frames (e.g. keeping categoricals).
+    def __init__(self, root, shards, key="client_ip", buffer_rows=100_000, concat=None):
+        self.root = root
+        self.shards = shards
+        self.key = key
+        self.buffer_rows = buffer_rows
+        self.concat = concat or (lambda frames: pd.concat(frames, ignore_index=True))
+        self.rows = [0] * shards
+        self.files = [[] for _ in range(shards)]
+        self.bytes_written = 0
+        self._buffers = [[] for _ in range(shards)]
+        self._buffered = [0] * shards
+
+    @property
+    def total_rows(self):
+        return sum(self.rows)
+
+    def add(self, df):
+        if df.empty:
+            return
+        shard = shard_of(df[self.key], self.shards)
+        order = np.argsort(shard, kind="stable")
+        bounds = np.searchsorted(shard[order], np.arange(self.shards + 1))
+        for s in range(self.shards):
+            lo, hi = int(bounds[s]), int(bounds[s + 1])
+            if hi > lo:
+                self._buffers[s].append(df.iloc[order[lo:hi]])
+                self._buffered[s] += hi - lo
+                self.rows[s] += hi - lo
+        while sum(self._buffered) > self.buffer_rows:
+            self._flush(int(np.argmax(self._buffered)))
+
+    def _flush(self, shard):
+        frame = self.concat(self._buffers[shard])
+        self._buffers[shard] = []
+        self._buffered[shard] = 0
+        # Slices keep their parent's categories; only the ones in use are worth writing
+        for col in frame.columns:
+            if isinstance(frame[col].dtype, pd.CategoricalDtype):
+                frame[col] = frame[col].cat.remove_unused_categories()
+        path = os.path.join(self.root, f"shard-{shard:04d}", f"part-{len(self.files[shard]):05d}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        frame.to_parquet(path, index=False)
+        self.files[shard].append(path)
+        self.bytes_written += os.path.getsize(path)
+
+    def close(self):
+        # Writes out whatever is still buffered
+        for shard in range(self.shards):
+            if self._buffered[shard]:
+                self._flush(shard)
+        logger.info(
+            f"Spilled {self.total_rows} row(s) to {self.shards} shard(s) in {self.root} "
+            f"({self.bytes_written / 2**20:.1f} MB, largest shard {max(self.rows, default=0)} rows)"
+        )
+
+    def read(self, shard, columns=None):
+        # The shard's part files as one frame
+        frames = [pd.read_parquet(path, columns=columns) for path in self.files[shard]]
+        return self.concat(frames) if frames else pd.DataFrame(columns=columns)
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+def concat_parquet_files(paths, out_path):
+    # One Parquet file from separately written parts, copied part by part (only one in memory).
+    # Part schemas may differ the way pandas frames do (dictionary index width, all-null columns),
+    # so every part is cast to their unified schema.
+    schema = pa.unify_schemas([pq.read_schema(path) for path in paths], promote_options="permissive")
+    tmp_path = f"{out_path}.tmp"
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for path in paths:
+            writer.write_table(pq.read_table(path).cast(schema))
+    os.replace(tmp_path, out_path)
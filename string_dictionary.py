@@ -0,0 +1,46 @@
+from lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+class StringDictionary:
+    # Append-only value -> code table per column, shared by every batch parsed in a run.
+    # Categoricals built from it have the earlier batches' categories as a prefix of their own,
+    # so they concatenate by stacking codes instead of re-encoding strings.
+    def __init__(self):
+        self._codes = {}
+        self._values = {}
+        self._categories = {}
+
+    def __len__(self):
+        return sum(len(values) for values in self._values.values())
+
+    def categories(self, column):
+        categories = self._categories.get(column)
+        values = self._values.get(column, [])
+        if categories is None or len(categories) != len(values):
+            categories = self._categories[column] = pd.Index(values, dtype=object)
+        return categories
+
+    def encode(self, column, values):
+        # Categorical of `values` against the column's shared dictionary (missing values stay missing)
+        codes, uniques = pd.factorize(values)
+        table = self._codes.setdefault(column, {})
+        known = self._values.setdefault(column, [])
+        mapping = np.empty(len(uniques) + 1, dtype=np.int32)
+        mapping[-1] = -1
+        for i, value in enumerate(uniques):
+            code = table.get(value)
+            if code is None:
+                code = table[value] = len(known)
+                known.append(value)
+            mapping[i] = code
+        return pd.Categorical.from_codes(mapping[codes], categories=self.categories(column))
+
+def concat_categoricals(values):
+    # Concatenate categoricals; the ones sharing a StringDictionary just stack their codes,
+    # anything else (e.g. batches from different parse processes) is unified by union_categoricals
+    values = [pd.Categorical(v) for v in values]
+    longest = max((v.categories for v in values), key=len)
+    if all(longest[:len(v.categories)].equals(v.categories) for v in values):
+        return pd.Categorical.from_codes(np.concatenate([v.codes for v in values]), categories=longest)
+    return pd.api.types.union_categoricals(values)
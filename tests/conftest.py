@@ -0,0 +1,10 @@
+import pytest
+
+from benchmarks.geo_stub import StubGeoServer
+
+
+@pytest.fixture
+def geo_stub_server():
+    stub = StubGeoServer().start()
+    yield stub
+    stub.stop()
@@ -1,6 +1,12 @@
 import sys
 import os
+import gzip
+import functools
+import subprocess
 import pytest
+import pandas as pd
+import advanced_elb_logs_etl
+from io import BytesIO
 
 # Ensure the parent directory is in sys.path for module resolution
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))) 
@@ -8,10 +14,40 @@ print(f"sys.path: {sys.path}")
 
 from advanced_elb_logs_etl import (
     parse_log_entry,
+    parse_log_batch,
+    iter_log_batches,
+    ingest_log_keys,
+    parse_log_object,
+    select_new_log_objects,
+    update_manifest,
+    load_manifest,
+    write_cleaned_logs,
+    write_hourly_aggregation,
+    fetch_geolocations,
+    TokenBucket,
+    enrich_with_geolocation,
+    add_user_agent_features,
+    parse_elb_timestamps,
+    add_advanced_features,
+    StreamingSessionizer,
+    compile_bot_matcher,
+    is_bot_user_agent,
     to_int,
     to_float
 )
 
+# sample edited log line
+SAMPLE_LOG_LINE = (
+    'h2 2025-05-26T23:55:02.179979Z app/erank-app/88dfa9dc536560af 3.135.238.214:60827 '
+    '172.31.37.43:80 0.001 0.303 0.000 200 200 74 1013 '
+    '"POST https://beta.erank.com:443/api/browser-ext-user HTTP/2.0" '
+    '"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/137.0.0.0 Safari/537.36" TLS_AES_128_GCM_SHA256 TLSv1.3 '
+    'arn:aws:elasticloadbalancing:us-west-2:848357551741:targetgroup/erank-app-v3-production/902b52047b6f4e28 '
+    '"Root=1-6834ff55-4f9107ec4dcec228218b6176" "beta.erank.com" "session-reused" 1 '
+    '2025-05-26T23:55:01.875000Z "waf,forward" "-" "-" "172.31.37.43:80" "200" "-" "-" TID_b087994534c4ac4abc0185b56b077382'
+)
+
 # Parse log entry tests
 
 def test_to_int_valid():
@@ -31,19 +67,428 @@ def test_to_float_invalid():
     assert to_float(None) is None
 
 def test_parse_log_entry_minimal():
-    # sample edited log line
-    log_line = (
-        'h2 2025-05-26T23:55:02.179979Z app/erank-app/88dfa9dc536560af 3.135.238.214:60827 '
-        '172.31.37.43:80 0.001 0.303 0.000 200 200 74 1013 '
-        '"POST https://beta.erank.com:443/api/browser-ext-user HTTP/2.0" '
-        '"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
-        'Chrome/137.0.0.0 Safari/537.36" TLS_AES_128_GCM_SHA256 TLSv1.3 '
-        'arn:aws:elasticloadbalancing:us-west-2:848357551741:targetgroup/erank-app-v3-production/902b52047b6f4e28 '
-        '"Root=1-6834ff55-4f9107ec4dcec228218b6176" "beta.erank.com" "session-reused" 1 '
-        '2025-05-26T23:55:01.875000Z "waf,forward" "-" "-" "172.31.37.43:80" "200" "-" "-" TID_b087994534c4ac4abc0185b56b077382'
-    )
-    row = parse_log_entry(log_line, "dummy.log.gz")
+    row = parse_log_entry(SAMPLE_LOG_LINE, "dummy.log.gz")
     assert row is not None
     assert row["client_ip"] == "3.135.238.214"
     assert row["http_method"] == "POST"
     assert row["hostname"] == "beta.erank.com"
+
+def test_import_is_lazy(tmp_path):
+    # Importing the module (e.g. for parse_log_entry) loads no heavy dependency and creates no directories
+    code = (
+        "import sys, advanced_elb_logs_etl as etl; "
+        "print(sorted(m for m in ('pandas', 'numpy', 'pyarrow', 'boto3', 'requests', 'user_agents', 'dotenv', 'pytz') if m in sys.modules)); "
+        f"print(etl.parse_log_entry({SAMPLE_LOG_LINE!r}, 'x.log.gz')['client_ip'])"
+    )
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    out = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, capture_output=True, text=True, check=True,
+                         env=dict(os.environ, PYTHONPATH=root)).stdout.splitlines()
+    assert out == ["[]", "3.135.238.214"]
+    assert os.listdir(tmp_path) == []
+
+# Batch parser tests
+
+def test_parse_log_batch_matches_parse_log_entry():
+    lines = [
+        SAMPLE_LOG_LINE,
+        SAMPLE_LOG_LINE.replace("2025-05-26T23:55:02.179979Z", "2025-05-26T23:55:02Z").replace("0.001 0.303", "- 0.303"),
+        SAMPLE_LOG_LINE.replace("https://beta.erank.com:443/api/browser-ext-user", "https://Beta.eRank.com/api?q=1&p=2"),
+        # urlparse drops ";params" from the last path segment, and rejects ports out of range
+        SAMPLE_LOG_LINE.replace("https://beta.erank.com:443/api/browser-ext-user", "https://h/a;jsessionid=1?x=1"),
+        SAMPLE_LOG_LINE.replace("https://beta.erank.com:443/api/browser-ext-user", "https://h/a;b/c;d=1"),
+        SAMPLE_LOG_LINE.replace("https://beta.erank.com:443/api/browser-ext-user", "https://h:99999/a"),
+    ]
+    df, rejected = parse_log_batch(lines, "dummy.log.gz")
+    assert rejected == 0
+    assert len(df) == 6
+    for i, line in enumerate(lines):
+        row = parse_log_entry(line, "dummy.log.gz")
+        assert list(df.columns) == list(row.keys())
+        for col in ["client_ip", "http_method", "full_url", "http_version", "protocol", "hostname", "path", "query_params", "time"]:
+            assert df[col].iloc[i] == row[col] or (pd.isna(df[col].iloc[i]) and row[col] is None), (i, col)
+        assert pd.isna(df["port"].iloc[i]) if row["port"] is None else df["port"].iloc[i] == row["port"]
+    assert df["path"].iloc[3] == "/a" and df["query_params"].iloc[3] == "x=1"
+    assert df["path"].iloc[4] == "/a;b/c"
+    assert df["http_method"].iloc[5] == "Unknown" and df["full_url"].iloc[5] == ""
+    assert df["total_processing_time_ms"].iloc[0] == 304.0
+    assert df["total_processing_time_ms"].isna().iloc[1]
+
+def test_parse_log_batch_builds_categorical_and_typed_columns():
+    first, _ = parse_log_batch([SAMPLE_LOG_LINE], "a.log.gz")
+    second, _ = parse_log_batch([SAMPLE_LOG_LINE.replace(" 200 200 ", " - 502 ")], "b.log.gz")
+    df = advanced_elb_logs_etl.concat_log_batches([first, second])
+    for col in ["elb", "target_group_arn", "user_agent", "http_method", "log_source_file", "ua_browser_family"]:
+        assert isinstance(df[col].dtype, pd.CategoricalDtype), col
+    assert df["log_source_file"].tolist() == ["a.log.gz", "b.log.gz"]
+    assert str(df["elb_status_code"].dtype) == "Int16"
+    assert df["elb_status_code"].isna().tolist() == [False, True]
+    assert df["target_status_code"].tolist() == [200, 502]
+    assert str(df["sent_bytes"].dtype) == "Int64"
+    assert df["request_processing_time"].iloc[0] == 0.001
+    report = advanced_elb_logs_etl.memory_report(df)
+    assert report.loc["elb", "bytes_per_row"] < report.loc["request", "bytes_per_row"]
+
+def test_parse_log_batch_counts_rejects():
+    lines = [SAMPLE_LOG_LINE, "garbage line", "", SAMPLE_LOG_LINE.replace("2025-05-26T23:55:02.179979Z", "not-a-time")]
+    df, rejected = parse_log_batch(lines, "dummy.log.gz")
+    assert len(df) == 1
+    assert rejected == 2
+
+def test_iter_log_batches_streams_fixed_size_batches():
+    lines = [SAMPLE_LOG_LINE] * 5 + ["garbage line"]
+    body = BytesIO(gzip.compress(("\n".join(lines) + "\n").encode("utf-8")))
+    batches = list(iter_log_batches(body, "dummy.log.gz", batch_size=2))
+    assert [len(df) for df in batches] == [2, 2, 1]
+    assert all(df["client_ip"].iloc[0] == "3.135.238.214" for df in batches)
+
+@pytest.mark.parametrize("parse_workers", [1, 2])
+def test_ingest_log_keys_ordered_and_isolates_failures(tmp_path, monkeypatch, parse_workers):
+    from benchmarks.local_s3 import LocalS3Client
+    os.makedirs(tmp_path / "bucket")
+    for n in (1, 2, 3):
+        (tmp_path / "bucket" / f"{n}.log.gz").write_bytes(gzip.compress(("\n".join([SAMPLE_LOG_LINE] * n)).encode("utf-8")))
+    # Parse processes are spawned, so they get the client factory (picklable) rather than the patched client
+    monkeypatch.setattr(advanced_elb_logs_etl, "s3", LocalS3Client(str(tmp_path)))
+    monkeypatch.setattr(advanced_elb_logs_etl, "new_s3_client", functools.partial(LocalS3Client, str(tmp_path)))
+    keys = ["3.log.gz", "bad.log.gz", "1.log.gz", "2.log.gz"]
+    results = list(ingest_log_keys("bucket", keys, parse_workers=parse_workers))
+    assert [key for key, _, _ in results] == keys
+    assert [len(df) if df is not None else None for _, df, _ in results] == [3, None, 1, 2]
+    assert isinstance(results[1][2], FileNotFoundError)
+    assert results[0][1]["log_source_file"].iloc[0] == "3.log.gz"
+    stats = results[0][1].attrs["ingest_stats"]
+    assert stats["lines_read"] == 3
+    assert stats["bytes_read"] == os.path.getsize(tmp_path / "bucket" / "3.log.gz")
+
+def test_parse_log_object_streams_the_body_in_batches(monkeypatch):
+    class Body(BytesIO):
+        # Records the size of every read; read() of the whole body is not allowed
+        def read(self, size=-1):
+            assert size is not None and size >= 0
+            reads.append(size)
+            return super().read(size)
+    reads = []
+    # Distinct trace ids keep the compressed body larger than one read
+    lines = [SAMPLE_LOG_LINE.replace("4f9107ec4dcec228218b6176", os.urandom(12).hex()) for _ in range(2000)]
+    data = gzip.compress("\n".join(lines).encode("utf-8"))
+    client = type("Client", (), {"get_object": lambda self, Bucket, Key: {"Body": Body(data), "ContentLength": len(data)}})()
+    df = parse_log_object("bucket", "x.log.gz", batch_size=500, client=client)
+    assert len(df) == 2000 and df.attrs["ingest_stats"]["bytes_read"] == len(data)
+    assert max(reads) < len(data)
+
+# Incremental run tests
+
+def test_select_new_log_objects_uses_manifest(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(advanced_elb_logs_etl, "MANIFEST_PATH", str(tmp_path / "manifest.parquet"))
+    ts = pd.Timestamp("2025-05-26T23:55:00Z")
+    objects = [
+        {"key": "a.log.gz", "etag": "e1", "size": 10, "last_modified": ts},
+        {"key": "b.log.gz", "etag": "e2", "size": 20, "last_modified": ts},
+    ]
+    manifest = load_manifest()
+    assert select_new_log_objects(objects, manifest) == objects
+    update_manifest(manifest, objects)
+    manifest = load_manifest()
+    changed = dict(objects[1], etag="e3")
+    new = {"key": "c.log.gz", "etag": "e4", "size": 5, "last_modified": ts}
+    # A processed key that changed is not ingested again (its rows would be counted twice)
+    assert select_new_log_objects([objects[0], changed, new], manifest) == [new]
+    assert "b.log.gz changed since it was processed" in caplog.text
+
+def _feature_frame(hour, ips, status="2xx_Success"):
+    n = len(ips)
+    return pd.DataFrame({
+        "time": pd.Timestamp(f"2025-05-26 {hour:02d}:10:00", tz="America/New_York"),
+        "request_year": [2025] * n, "request_month": [5] * n, "request_day": [26] * n, "request_hour": [hour] * n,
+        "countryCode": ["US"] * n, "countryName": ["United States"] * n, "city": ["Seattle"] * n,
+        "client_ip": ips, "total_processing_time_ms": [10.0] * n, "sent_bytes": [100] * n,
+        "received_bytes": [1] * n, "status_code_type": [status] * n,
+    })
+
+def test_incremental_runs_append_parts_and_merge_touched_hours(tmp_path, monkeypatch):
+    import pyarrow.parquet as pq
+    monkeypatch.setattr(advanced_elb_logs_etl, "OUTPUT_CLEANED", str(tmp_path / "cleaned"))
+    monkeypatch.setattr(advanced_elb_logs_etl, "OUTPUT_AGG", str(tmp_path))
+    run1 = pd.concat([_feature_frame(10, ["1.1.1.1", "2.2.2.2"]), _feature_frame(9, ["3.3.3.3"])])
+    # Label keys come as categoricals in one run and plain strings in the next
+    run1 = run1.astype({"countryName": "category", "city": "category"})
+    write_cleaned_logs(run1, "run1")
+    write_hourly_aggregation(run1)
+    first_schema = pq.read_schema(tmp_path / "hourly_traffic_by_geo.parquet")
+    run2 = pd.concat([_feature_frame(10, ["1.1.1.1"], "5xx_ServerError"), _feature_frame(11, ["4.4.4.4"])])
+    write_cleaned_logs(run2, "run2")
+    write_hourly_aggregation(run2)
+
+    part_dir = tmp_path / "cleaned" / "year=2025" / "month=05" / "day=26" / "countryCode=US"
+    assert sorted(os.listdir(part_dir)) == ["part-run1-0.parquet", "part-run2-0.parquet"]
+    agg = pd.read_parquet(tmp_path / "hourly_traffic_by_geo.parquet").set_index("request_hour")
+    assert agg["request_count"].to_dict() == {9: 1, 10: 3, 11: 1}
+    assert agg.loc[10, "unique_client_ips_count"] == 2
+    assert agg.loc[10, "count_5xx"] == 1
+    schema = pq.read_schema(tmp_path / "hourly_traffic_by_geo.parquet")
+    assert schema.remove_metadata().equals(first_schema.remove_metadata())
+    assert str(schema.field("countryName").type) == str(schema.field("city").type) == "large_string"
+
+# Geolocation fetcher tests (against the local stub server in conftest.py)
+
+def test_fetch_geolocations_batches_requests(geo_stub_server):
+    ips = [f"8.8.{i // 256}.{i % 256}" for i in range(1050)] + ["10.0.0.1"]
+    flushed = []
+    records = fetch_geolocations(ips, api_url=geo_stub_server.url, on_batch=flushed.append,
+                                 rate_per_minute=60000, concurrency=4)
+    assert geo_stub_server.requests == 11
+    assert len(flushed) == 11
+    by_ip = {r["query"]: r for r in records}
+    assert set(by_ip) == set(ips)
+    assert by_ip["8.8.0.1"]["status"] == "success"
+    assert by_ip["8.8.0.1"]["city"] == "Seattle"
+    assert by_ip["10.0.0.1"]["status"] == "fail"
+    assert all("api_fetch_timestamp" in r for r in records)
+
+def test_fetch_geolocations_retries_rate_limits(geo_stub_server):
+    geo_stub_server.rate_limited = 2
+    geo_stub_server.server_errors = 1
+    records = fetch_geolocations(["1.1.1.1", "2.2.2.2"], api_url=geo_stub_server.url,
+                                 rate_per_minute=60000, max_retries=3, backoff=0.01)
+    assert geo_stub_server.requests == 4
+    assert [r["status"] for r in records] == ["success", "success"]
+
+def test_fetch_geolocations_gives_up_after_max_retries(geo_stub_server):
+    geo_stub_server.rate_limited = 10
+    records = fetch_geolocations(["1.1.1.1"], api_url=geo_stub_server.url,
+                                 rate_per_minute=60000, max_retries=2, backoff=0.01)
+    assert geo_stub_server.requests == 3
+    assert records[0]["status"] == "fail"
+    assert records[0]["query"] == "1.1.1.1"
+
+def test_token_bucket_follows_rate_limit_headers():
+    bucket = TokenBucket(rate_per_second=1000, capacity=5)
+    bucket.update_from_headers({"X-Rl": "0", "X-Ttl": "30"})
+    assert bucket.tokens == 0
+    assert bucket.blocked_until > 0
+
+def test_enrich_with_geolocation_fetches_and_caches(geo_stub_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_API_URL", geo_stub_server.url)
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_RATE_PER_MINUTE", 60000)
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_CACHE_PATH", str(tmp_path / "geo.parquet"))
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_CACHE_DB_PATH", str(tmp_path / "geo.sqlite"))
+    monkeypatch.setattr(advanced_elb_logs_etl, "_geo_cache_store", None)
+    df = pd.DataFrame({"client_ip": ["1.1.1.1", "2.2.2.2", "1.1.1.1"]})
+    enriched = enrich_with_geolocation(df)
+    assert enriched["countryName"].tolist() == ["United States"] * 3
+    assert os.path.exists(tmp_path / "geo.sqlite")
+    enrich_with_geolocation(df)
+    assert geo_stub_server.requests == 1
+    assert advanced_elb_logs_etl.get_geo_cache().stats["hits"] == 2
+
+# User-agent classification tests
+
+def test_add_user_agent_features_classifies_each_distinct_ua_once(monkeypatch, tmp_path):
+    monkeypatch.setattr(advanced_elb_logs_etl, "_ua_cache", None)
+    monkeypatch.setattr(advanced_elb_logs_etl, "UA_CACHE_PATH", str(tmp_path / "ua.parquet"))
+    calls = []
+    real_parse = advanced_elb_logs_etl.ua_parse
+    monkeypatch.setattr(advanced_elb_logs_etl, "ua_parse", lambda ua: calls.append(ua) or real_parse(ua))
+    chrome = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36"
+    bot = "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+    uas = pd.Series([chrome, bot, chrome, "-", chrome, bot])
+    features = add_user_agent_features(uas)
+    assert len(calls) == 2
+    assert features["ua_browser_family"].dtype == "category"
+    assert features["ua_browser_family"].tolist() == ["Chrome", "Googlebot", "Chrome", "Unknown", "Chrome", "Googlebot"]
+    assert features["is_bot"].tolist() == [False, True, False, False, False, True]
+    add_user_agent_features(uas)
+    assert len(calls) == 2
+
+    # The cache persists between runs
+    advanced_elb_logs_etl.save_ua_cache()
+    monkeypatch.setattr(advanced_elb_logs_etl, "_ua_cache", None)
+    add_user_agent_features(uas)
+    assert len(calls) == 2
+
+def test_bot_matcher_is_configurable():
+    matcher = compile_bot_matcher(["HeadlessChrome", "curl"])
+    assert is_bot_user_agent("Mozilla/5.0 HeadlessChrome/120", matcher)
+    assert is_bot_user_agent("CURL/8.0", matcher)
+    assert not is_bot_user_agent("Mozilla/5.0 (compatible; Googlebot/2.1)", matcher)
+    assert is_bot_user_agent("Mozilla/5.0 (compatible; Googlebot/2.1)")
+
+# Timestamp tests
+
+def test_parse_elb_timestamps_both_formats_and_counts_invalid():
+    parsed, invalid = parse_elb_timestamps(["2025-05-26T23:55:02.179979Z", "2025-05-26T23:55:02Z", "-", "garbage"])
+    assert invalid == 2
+    assert str(parsed.dt.tz) == "America/New_York"
+    assert parsed.iloc[0] == pd.Timestamp("2025-05-26 19:55:02.179979", tz="America/New_York")
+    assert parsed.iloc[1] == pd.Timestamp("2025-05-26 19:55:02", tz="America/New_York")
+    assert parsed.iloc[2:].isna().all()
+
+def test_parse_log_batch_typed_timestamps():
+    df, _ = parse_log_batch([SAMPLE_LOG_LINE], "dummy.log.gz")
+    assert pd.api.types.is_datetime64_any_dtype(df["time"])
+    assert df["request_creation_time"].iloc[0] == pd.Timestamp("2025-05-26 19:55:01.875", tz="America/New_York")
+
+# Feature engineering tests
+
+def _minute_frame(rows):
+    base = pd.Timestamp("2025-05-26 10:00:00", tz="America/New_York")
+    return pd.DataFrame({
+        "time": [base + pd.Timedelta(minutes=m) for _, m, _ in rows],
+        "client_ip": [ip for ip, _, _ in rows],
+        "elb_status_code": ["200", "404", "-", "503", "200", "200"][:len(rows)],
+        "target_status_code": ["200"] * len(rows),
+        "received_bytes": ["1"] * len(rows),
+        "sent_bytes": ["2"] * len(rows),
+        "request": ["GET https://h/ HTTP/1.1"] * len(rows),
+        "path": ["/api/x", "/", "", "/a", "/b/c/d", None][:len(rows)],
+        "total_processing_time_ms": [ms for _, _, ms in rows],
+    })
+
+def test_add_advanced_features_sessions_and_windows():
+    df = _minute_frame([("A", 0, 10.0), ("A", 1, 20.0), ("A", 3, None), ("A", 7, 30.0), ("A", 40, 40.0), ("B", 2, 5.0)])
+    out = add_advanced_features(df)
+    a = out[out["client_ip"] == "A"]
+    assert a["session_id"].tolist() == ["1-A", "1-A", "1-A", "1-A", "2-A"]
+    assert a["rolling_5min_req_count"].tolist() == [1.0, 2.0, 3.0, 2.0, 1.0]
+    assert a["rolling_1h_avg_proc_time"].tolist() == [10.0, 15.0, 15.0, 20.0, 25.0]
+    assert out["status_code_type"].tolist() == [
+        "2xx_Success", "4xx_ClientError", "Unknown", "5xx_ServerError", "2xx_Success", "2xx_Success"]
+    assert out["path_main_segment"].tolist()[:2] == ["api", ""]
+    assert pd.isna(out["path_main_segment"].iloc[2])
+    assert out["elb_status_code"].isna().iloc[2]
+
+def test_add_advanced_features_matches_legacy_implementation():
+    from benchmarks.bench_features import legacy_add_advanced_features, make_parsed_frame
+    df = make_parsed_frame(5000, n_clients=40)
+    pd.testing.assert_frame_equal(add_advanced_features(df.copy()), legacy_add_advanced_features(df.copy()))
+
+# Streaming sessionization tests
+
+def test_streaming_sessionizer_matches_full_batch(tmp_path):
+    from benchmarks.bench_features import make_parsed_frame
+    df = make_parsed_frame(3000, n_clients=15).sort_values("time", ignore_index=True)
+    expected = add_advanced_features(df.copy())
+
+    sessionizer = StreamingSessionizer()
+    parts = []
+    for i, batch in enumerate(np_split(df, 4)):
+        if i == 2:
+            # Checkpoint and resume between "runs"
+            sessionizer.save(str(tmp_path / "state"))
+            sessionizer = StreamingSessionizer.load(str(tmp_path / "state"))
+        parts.append(add_advanced_features(batch.copy(), sessionizer))
+    streamed = pd.concat(parts).sort_values(["client_ip", "time"], kind="stable")
+    streamed = streamed.loc[expected.index]
+    for col in ["session_id", "new_session", "rolling_5min_req_count"]:
+        assert streamed[col].tolist() == expected[col].tolist()
+    assert (streamed["prev_time"].isna() == expected["prev_time"].isna()).all()
+    pd.testing.assert_series_equal(streamed["rolling_1h_avg_proc_time"], expected["rolling_1h_avg_proc_time"])
+
+def np_split(df, n):
+    size = -(-len(df) // n)
+    return [df.iloc[i:i + size] for i in range(0, len(df), size)]
+
+def test_streaming_sessionizer_evicts_idle_clients():
+    sessionizer = StreamingSessionizer()
+    first = _minute_frame([("A", 0, 10.0), ("B", 1, 5.0)])
+    add_advanced_features(first, sessionizer)
+    later = _minute_frame([("B", 200, 7.0), ("B", 201, 9.0)])
+    out = add_advanced_features(later, sessionizer)
+    assert set(sessionizer.history["client_ip"]) == {"B"}
+    assert sessionizer.session_counts.to_dict() == {"A": 1, "B": 2}
+    assert out["session_id"].tolist() == ["2-B", "2-B"]
+    again = add_advanced_features(_minute_frame([("A", 202, 1.0)]), sessionizer)
+    assert again["session_id"].tolist() == ["2-A"]
+
+# Cleaned dataset writer tests
+
+def test_write_cleaned_logs_uses_stable_hive_schema(tmp_path, monkeypatch):
+    import pyarrow.parquet as pq
+    monkeypatch.setattr(advanced_elb_logs_etl, "OUTPUT_CLEANED", str(tmp_path / "cleaned"))
+    df = pd.concat([_feature_frame(10, ["1.1.1.1", "2.2.2.2"]), _feature_frame(11, ["3.3.3.3"])], ignore_index=True)
+    df.loc[2, ["countryCode", "city"]] = None
+    write_cleaned_logs(df, "run1")
+
+    day_dir = tmp_path / "cleaned" / "year=2025" / "month=05" / "day=26"
+    assert sorted(os.listdir(day_dir)) == ["countryCode=UNK", "countryCode=US"]
+    us = pq.read_schema(day_dir / "countryCode=US" / "part-run1-0.parquet")
+    unk = pq.read_schema(day_dir / "countryCode=UNK" / "part-run1-0.parquet")
+    assert us.equals(unk)
+    assert us.equals(advanced_elb_logs_etl.CLEANED_SCHEMA)
+    # Only the enriched geolocation fields are stored, not the cache's bookkeeping columns
+    assert {"countryName", "city", "lat"} <= set(us.names)
+    assert not {"status", "message", "query", "api_fetch_timestamp"} & set(us.names)
+    assert str(us.field("time").type) == "timestamp[us, tz=America/New_York]"
+    back = pd.read_parquet(tmp_path / "cleaned")
+    assert len(back) == 3
+    assert back["time"].min() == pd.Timestamp("2025-05-26 10:10:00", tz="America/New_York")
+    assert back.groupby("countryCode", observed=True)["client_ip"].count().to_dict() == {"UNK": 1, "US": 2}
+
+def test_cleaned_part_files_keep_only_their_own_categories(tmp_path, monkeypatch):
+    import pyarrow.parquet as pq
+    monkeypatch.setattr(advanced_elb_logs_etl, "OUTPUT_CLEANED", str(tmp_path / "cleaned"))
+    monkeypatch.setattr(advanced_elb_logs_etl, "CLEANED_ROW_GROUP_ROWS", 400)
+    df = _feature_frame(10, [f"10.0.{i // 250}.{i % 250}" for i in range(2000)])
+    df["user_agent"] = pd.Categorical([f"agent-{i}" for i in range(2000)])
+    df.loc[:9, "countryCode"] = "FR"
+    write_cleaned_logs(df, "run1")
+
+    day_dir = tmp_path / "cleaned" / "year=2025" / "month=05" / "day=26"
+    fr = pq.read_table(day_dir / "countryCode=FR" / "part-run1-0.parquet", read_dictionary=["user_agent"])
+    assert len(fr["user_agent"].combine_chunks().dictionary) == 10
+    us = pd.read_parquet(day_dir / "countryCode=US")
+    assert sorted(us["user_agent"].astype(str)) == sorted(f"agent-{i}" for i in range(10, 2000))
+
+def test_compact_cleaned_logs_merges_small_parts(tmp_path, monkeypatch):
+    monkeypatch.setattr(advanced_elb_logs_etl, "OUTPUT_CLEANED", str(tmp_path / "cleaned"))
+    for i in range(3):
+        write_cleaned_logs(_feature_frame(10, [f"1.1.1.{i}"]), f"run{i}")
+    part_dir = tmp_path / "cleaned" / "year=2025" / "month=05" / "day=26" / "countryCode=US"
+    assert len(os.listdir(part_dir)) == 3
+    assert advanced_elb_logs_etl.compact_cleaned_logs(min_files=4) == {}
+    compacted = advanced_elb_logs_etl.compact_cleaned_logs(min_files=3)
+    parts = os.listdir(part_dir)
+    assert len(parts) == 1 and parts[0].startswith("part-compacted-")
+    assert compacted == {str(part_dir / parts[0]): os.path.getsize(part_dir / parts[0])}
+    assert sorted(pd.read_parquet(part_dir / parts[0])["client_ip"]) == ["1.1.1.0", "1.1.1.1", "1.1.1.2"]
+
+def test_compact_cleaned_logs_only_touches_given_partitions(tmp_path, monkeypatch):
+    monkeypatch.setattr(advanced_elb_logs_etl, "OUTPUT_CLEANED", str(tmp_path / "cleaned"))
+    for i in range(3):
+        write_cleaned_logs(_feature_frame(10, [f"1.1.1.{i}"]), f"old{i}")
+    written = write_cleaned_logs(_feature_frame(10, ["2.2.2.2"]).assign(countryCode="FR"), "new")
+    [(path, size)] = written.items()
+    assert os.path.basename(path) == "part-new-0.parquet" and size == os.path.getsize(path)
+    # The US partition was not written by this run, so it is left alone
+    partitions = {os.path.dirname(path) for path in written}
+    assert advanced_elb_logs_etl.compact_cleaned_logs(partitions, min_files=3) == {}
+    part_dir = tmp_path / "cleaned" / "year=2025" / "month=05" / "day=26" / "countryCode=US"
+    assert len(os.listdir(part_dir)) == 3
+    assert len(advanced_elb_logs_etl.compact_cleaned_logs(min_files=3)) == 1
+
+# Hourly aggregation state tests
+
+def test_merged_hourly_partial_states_match_single_pass():
+    df = pd.concat([
+        _feature_frame(9, ["1.1.1.1", "2.2.2.2", "1.1.1.1"], "4xx_ClientError"),
+        _feature_frame(10, ["3.3.3.3", "4.4.4.4"]),
+        _feature_frame(10, ["3.3.3.3"], "5xx_ServerError"),
+    ], ignore_index=True)
+    df["total_processing_time_ms"] = [5.0, 10.0, 20.0, 100.0, 300.0, None]
+    whole = advanced_elb_logs_etl.aggregate_hourly(df)
+    parts = [advanced_elb_logs_etl.hourly_partial_state(df.iloc[i::2]) for i in range(2)]
+    merged = advanced_elb_logs_etl.materialize_hourly(advanced_elb_logs_etl.merge_hourly_states(parts))
+    pd.testing.assert_frame_equal(merged, whole)
+    by_hour = whole.set_index("request_hour")
+    assert by_hour["request_count"].to_dict() == {9: 3, 10: 3}
+    assert by_hour["unique_client_ips_count"].to_dict() == {9: 2, 10: 2}
+    assert by_hour.loc[9, "count_4xx"] == 3 and by_hour.loc[10, "count_5xx"] == 1
+    assert by_hour.loc[10, "average_total_processing_time"] == pytest.approx(200.0)
+    assert by_hour.loc[9, "median_total_processing_time"] == pytest.approx(10.0, rel=0.01)
+    assert by_hour.loc[10, "median_total_processing_time"] == pytest.approx(200.0, rel=0.01)
+
+def test_hourly_percentile_columns_are_optional(monkeypatch):
+    monkeypatch.setattr(advanced_elb_logs_etl, "HOURLY_PERCENTILES", [95.0, 99.0])
+    agg = advanced_elb_logs_etl.aggregate_hourly(_feature_frame(10, [f"1.1.1.{i}" for i in range(100)]))
+    assert agg.columns[-2:].tolist() == ["p95_total_processing_time", "p99_total_processing_time"]
+    assert agg["p99_total_processing_time"].iloc[0] == pytest.approx(10.0, rel=0.01)
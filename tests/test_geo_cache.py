@@ -0,0 +1,75 @@
+import sys
+import os
+import time
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from geo_cache import GeoCache
+
+def _record(ip, status="success", age_seconds=0):
+    return {
+        "status": status, "message": None if status == "success" else "API Error", "query": ip,
+        "country": "United States", "countryCode": "US", "region": "WA", "regionName": "Washington",
+        "city": "Seattle", "lat": 47.6, "lon": -122.3, "isp": "ISP",
+        "api_fetch_timestamp": pd.Timestamp.now(tz="UTC") - pd.Timedelta(seconds=age_seconds),
+    }
+
+@pytest.fixture
+def cache(tmp_path):
+    store = GeoCache(str(tmp_path / "geo.sqlite"), ttl_seconds=3600, fail_ttl_seconds=60, max_entries=100, memory_entries=2)
+    yield store
+    store.close()
+
+def test_get_many_returns_only_requested_ips(cache):
+    cache.put_many([_record("1.1.1.1"), _record("2.2.2.2"), _record("3.3.3.3")])
+    df = cache.get_many(["1.1.1.1", "3.3.3.3", "9.9.9.9"])
+    assert sorted(df.index) == ["1.1.1.1", "3.3.3.3"]
+    assert df.loc["1.1.1.1", "city"] == "Seattle"
+    assert cache.stats["hits"] == 2
+    assert cache.stats["misses"] == 1
+
+def test_ttl_is_shorter_for_failed_lookups(cache):
+    cache.put_many([
+        _record("1.1.1.1", age_seconds=120),
+        _record("2.2.2.2", status="fail", age_seconds=120),
+        _record("3.3.3.3", age_seconds=7200),
+    ])
+    cache.memory.clear()
+    df = cache.get_many(["1.1.1.1", "2.2.2.2", "3.3.3.3"])
+    assert list(df.index) == ["1.1.1.1"]
+    assert cache.stats["expired"] == 2
+    assert cache.purge_expired() == 2
+    assert len(cache) == 1
+
+def test_size_cap_evicts_least_recently_used(tmp_path):
+    store = GeoCache(str(tmp_path / "geo.sqlite"), ttl_seconds=3600, fail_ttl_seconds=60, max_entries=2)
+    store.put_many([_record("1.1.1.1"), _record("2.2.2.2")])
+    time.sleep(0.01)
+    store.get_many(["1.1.1.1"])
+    time.sleep(0.01)
+    store.put_many([_record("3.3.3.3")])
+    assert len(store) == 2
+    assert store.stats["evictions"] == 1
+    store.memory.clear()
+    assert sorted(store.get_many(["1.1.1.1", "2.2.2.2", "3.3.3.3"]).index) == ["1.1.1.1", "3.3.3.3"]
+    store.close()
+
+def test_memory_layer_and_persistence(tmp_path):
+    path = str(tmp_path / "geo.sqlite")
+    store = GeoCache(path, ttl_seconds=3600, fail_ttl_seconds=60, max_entries=100, memory_entries=10)
+    store.put_many([_record("1.1.1.1")])
+    store.get_many(["1.1.1.1"])
+    assert store.stats["memory_hits"] == 1
+    store.close()
+    reopened = GeoCache(path, ttl_seconds=3600, fail_ttl_seconds=60, max_entries=100)
+    assert list(reopened.get_many(["1.1.1.1"]).index) == ["1.1.1.1"]
+    assert reopened.stats["memory_hits"] == 0
+    reopened.close()
+
+def test_import_legacy_parquet(tmp_path, cache):
+    legacy = tmp_path / "legacy.parquet"
+    pd.DataFrame([_record("1.1.1.1"), _record("2.2.2.2")]).to_parquet(legacy, index=False)
+    assert cache.import_parquet(str(legacy)) == 2
+    assert len(cache) == 2
@@ -0,0 +1,70 @@
+import sys
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import advanced_elb_logs_etl
+from geo_local import load_ip_range_db, ip_key, GEO_COLUMNS
+from advanced_elb_logs_etl import enrich_with_geolocation
+
+RANGES_CSV = """network,country,countryCode,region,regionName,city,lat,lon,isp
+3.128.0.0/9,United States,US,OH,Ohio,Columbus,39.96,-83.0,Amazon.com
+8.8.8.0/24,United States,US,CA,California,Mountain View,37.4,-122.1,Google LLC
+2a03:2880::/32,Ireland,IE,L,Leinster,Dublin,53.3,-6.2,Facebook
+"""
+
+@pytest.fixture
+def ranges_csv(tmp_path):
+    path = tmp_path / "ranges.csv"
+    path.write_text(RANGES_CSV)
+    return str(path)
+
+def test_ip_key_handles_both_families():
+    assert ip_key("1.2.3.4") == b"\x00" * 10 + b"\xff\xff\x01\x02\x03\x04"
+    assert len(ip_key("2a03:2880::1")) == 16
+    assert ip_key("-") is None
+
+def test_lookup_resolves_ipv4_ipv6_and_misses(ranges_csv):
+    db = load_ip_range_db(ranges_csv)
+    ips = pd.Series(["3.135.238.214", "8.8.8.8", "2a03:2880:f003::1", "9.9.9.9", "8.8.8.8", "garbage"])
+    geo = db.lookup(ips)
+    assert geo.index.name == "query"
+    assert sorted(geo.reset_index().columns) == sorted(GEO_COLUMNS)
+    assert len(geo) == 5
+    assert geo.loc["3.135.238.214", "city"] == "Columbus"
+    assert geo.loc["8.8.8.8", "isp"] == "Google LLC"
+    assert geo.loc["2a03:2880:f003::1", "countryCode"] == "IE"
+    assert geo.loc["9.9.9.9", "status"] == "fail"
+    assert pd.isna(geo.loc["9.9.9.9", "city"])
+    assert geo.loc["garbage", "status"] == "fail"
+
+def test_lookup_range_boundaries(ranges_csv):
+    db = load_ip_range_db(ranges_csv)
+    idx = db.lookup_ranges(["8.8.7.255", "8.8.8.0", "8.8.8.255", "8.8.9.0"])
+    assert (idx >= 0).tolist() == [False, True, True, False]
+
+def test_enrich_with_local_backend(ranges_csv, monkeypatch):
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_BACKEND", "local")
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_DB_PATH", ranges_csv)
+    monkeypatch.setattr(advanced_elb_logs_etl, "_local_geo_db", None)
+    df = pd.DataFrame({"client_ip": ["8.8.8.8", "3.135.238.214", "8.8.8.8"]})
+    enriched = enrich_with_geolocation(df)
+    assert enriched["countryName"].tolist() == ["United States"] * 3
+    assert enriched["city"].tolist() == ["Mountain View", "Columbus", "Mountain View"]
+
+def test_enrich_attaches_only_the_selected_fields_as_categoricals(ranges_csv, monkeypatch):
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_BACKEND", "local")
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_DB_PATH", ranges_csv)
+    monkeypatch.setattr(advanced_elb_logs_etl, "_local_geo_db", None)
+    df = pd.DataFrame({"client_ip": ["8.8.8.8", None, "9.9.9.9", "2a03:2880::1"], "n": [1, 2, 3, 4]})
+    enriched = enrich_with_geolocation(df, fields=["country", "city", "lat"])
+    assert list(enriched.columns) == ["client_ip", "n", "countryName", "city", "lat"]
+    assert list(df.columns) == ["client_ip", "n"]
+    assert isinstance(enriched["city"].dtype, pd.CategoricalDtype)
+    assert enriched["city"].tolist()[::3] == ["Mountain View", "Dublin"]
+    assert enriched["city"].isna().tolist() == [False, True, True, False]
+    assert enriched["lat"].dtype == np.float64
+    assert np.isnan(enriched["lat"].iloc[1]) and enriched["lat"].iloc[3] == 53.3
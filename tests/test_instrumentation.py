@@ -0,0 +1,69 @@
+import sys
+import os
+import json
+import logging
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from instrumentation import RunReport, parse_profile_option, bytes_written_since
+
+def test_parse_profile_option():
+    assert parse_profile_option("") == set()
+    assert parse_profile_option("cProfile, tracemalloc") == {"cprofile", "tracemalloc"}
+    assert parse_profile_option("all") == {"cprofile", "tracemalloc"}
+    assert parse_profile_option("cprofile,perf") == {"cprofile"}
+
+def test_stage_records_rows_counters_logs_and_bytes(tmp_path):
+    counts = {"api_requests": 5}
+    report = RunReport("r1")
+    out = tmp_path / "out"
+    out.mkdir()
+    (out / "old.csv").write_text("x" * 10)
+    os.utime(out / "old.csv", (0, 0))
+    with report.stage("enrich", rows_in=100, counters=lambda: dict(counts), outputs=[str(out)]) as stage:
+        counts["api_requests"] += 3
+        (out / "new.csv").write_text("y" * 25)
+        logging.getLogger("some.module").warning("slow")
+        stage["rows_out"] = 90
+    with report.stage("write"):
+        logging.getLogger("other").error("boom")
+    data = report.write(str(tmp_path / "report.json"))
+
+    enrich, write = data["stages"]
+    assert enrich["rows_in"] == 100 and enrich["rows_out"] == 90
+    assert enrich["api_requests"] == 3
+    assert enrich["bytes_written"] == 25
+    assert (enrich["warnings"], enrich["errors"], enrich["status"]) == (1, 0, "ok")
+    assert enrich["duration_s"] >= 0 and enrich["peak_rss_mb"] > 0
+    assert (write["errors"], write["status"]) == (1, "degraded")
+    assert data["status"] == "degraded"
+    assert json.load(open(tmp_path / "report.json")) ["stages"][0]["stage"] == "enrich"
+    # The log counter is detached once the report is written
+    logging.getLogger("other").error("after")
+    assert report.stages[1]["errors"] == 1
+
+def test_failed_stage_is_recorded_and_reraised(tmp_path):
+    report = RunReport("r2")
+    with pytest.raises(ValueError):
+        with report.stage("parse"):
+            raise ValueError("bad input")
+    data = report.write(str(tmp_path / "report.json"))
+    assert data["status"] == "failed"
+    assert data["stages"][0]["exception"] == "ValueError('bad input')"
+
+def test_profilers_write_per_stage_captures(tmp_path):
+    report = RunReport("r3", profile={"cprofile", "tracemalloc"}, profile_dir=str(tmp_path / "profiles"))
+    with report.stage("features"):
+        blocks = [bytearray(1024) for _ in range(2000)]
+    data = report.write(str(tmp_path / "report.json"))
+    stage = data["stages"][0]
+    assert os.path.exists(stage["cprofile"]) and stage["cprofile"].endswith("features.prof")
+    assert stage["tracemalloc"]["peak_mb"] >= 1.5
+    assert stage["tracemalloc"]["top_allocations"][0]["location"].startswith(__file__)
+    assert len(blocks) == 2000
+
+def test_bytes_written_since_accepts_files_and_missing_paths(tmp_path):
+    path = tmp_path / "a.parquet"
+    path.write_bytes(b"1234")
+    assert bytes_written_since([str(path), str(tmp_path / "missing")], 0) == 4
@@ -0,0 +1,264 @@
+import sys
+import os
+import gzip
+import json
+import functools
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import advanced_elb_logs_etl
+from benchmarks.generate_logs import generate_log_files
+from benchmarks.local_s3 import LocalS3Client
+
+BUCKET = "elb-logs"
+
+def test_generate_log_files_is_deterministic(tmp_path):
+    first = generate_log_files(str(tmp_path / "a"), files=2, lines_per_file=300, clients=50, malformed=0.05, seed=7)
+    second = generate_log_files(str(tmp_path / "b"), files=2, lines_per_file=300, clients=50, malformed=0.05, seed=7)
+    assert [f["key"] for f in first] == [f["key"] for f in second]
+    for a, b in zip(first, second):
+        assert open(a["path"], "rb").read() == open(b["path"], "rb").read()
+    assert first[0]["key"].startswith("AWSLogs/123456789012/elasticloadbalancing/us-west-2/2025/05/26/")
+    lines = gzip.open(first[0]["path"]).read().decode().splitlines()
+    df, rejected = advanced_elb_logs_etl.parse_log_batch(lines, first[0]["key"])
+    assert len(lines) == 300 and 0 < rejected < 40
+    assert df["time"].is_monotonic_increasing
+
+def test_local_s3_client_paginates_and_reads(tmp_path):
+    files = generate_log_files(str(tmp_path / BUCKET), files=3, lines_per_file=10, clients=5)
+    client = LocalS3Client(str(tmp_path), page_size=2)
+    pages = list(client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET, Prefix="AWSLogs/"))
+    assert [len(p["Contents"]) for p in pages] == [2, 1]
+    assert [o["Key"] for p in pages for o in p["Contents"]] == [f["key"] for f in files]
+    body = client.get_object(Bucket=BUCKET, Key=files[0]["key"])["Body"].read()
+    assert body == open(files[0]["path"], "rb").read()
+
+class RecordingS3Client(LocalS3Client):
+    # Remembers the (Prefix, Delimiter) of every listing call
+    def __init__(self, root, calls):
+        super().__init__(root)
+        self.calls = calls
+
+    def list_objects_v2(self, **kwargs):
+        self.calls.append((kwargs.get("Prefix", ""), kwargs.get("Delimiter")))
+        return super().list_objects_v2(**kwargs)
+
+def point_etl_at_local_s3(tmp_path, monkeypatch, geo_url=None):
+    # Runs the ETL in tmp_path against the LocalS3Client root tmp_path/s3; returns the listing calls
+    monkeypatch.chdir(tmp_path)
+    for folder in ["output/cleaned_logs", "output/aggregated_stats", "output/reports"]:
+        os.makedirs(folder, exist_ok=True)
+    s3_root = str(tmp_path / "s3")
+    calls = []
+    monkeypatch.setattr(advanced_elb_logs_etl, "s3", RecordingS3Client(s3_root, calls))
+    # A partial, not a lambda: spawned parse processes are handed the factory
+    monkeypatch.setattr(advanced_elb_logs_etl, "new_s3_client", functools.partial(RecordingS3Client, s3_root, calls))
+    monkeypatch.setattr(advanced_elb_logs_etl, "AWS_BUCKET_NAME", BUCKET)
+    monkeypatch.setattr(advanced_elb_logs_etl, "AWS_LOG_PREFIX", "AWSLogs/")
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_BACKEND", "api")
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_API_URL", geo_url or "http://127.0.0.1:9")
+    monkeypatch.setattr(advanced_elb_logs_etl, "GEO_RATE_PER_MINUTE", 1e9)
+    monkeypatch.setattr(advanced_elb_logs_etl, "_geo_cache_store", None)
+    return calls
+
+def test_main_runs_end_to_end_and_skips_processed_keys(tmp_path, monkeypatch, geo_stub_server):
+    files = generate_log_files(str(tmp_path / "s3" / BUCKET), files=3, lines_per_file=400, clients=60)
+    point_etl_at_local_s3(tmp_path, monkeypatch, geo_stub_server.url)
+
+    advanced_elb_logs_etl.main(report_path="output/run_report.json")
+    cleaned = pd.read_parquet("output/cleaned_logs")
+    hourly = pd.read_parquet("output/aggregated_stats/hourly_traffic_by_geo.parquet")
+    assert 1150 < len(cleaned) <= 1200
+    assert set(cleaned["countryCode"]) == {"US"}
+    assert hourly["request_count"].sum() == len(cleaned)
+    assert os.path.exists("output/reports/error_summary_geo.csv")
+    assert os.path.exists("output/reports/bot_traffic_by_origin_summary.csv")
+    manifest = pd.read_parquet(advanced_elb_logs_etl.MANIFEST_PATH)
+    assert sorted(manifest["key"]) == [f["key"] for f in files]
+    report = json.load(open("output/run_report.json"))
+    stages = {s["stage"]: s for s in report["stages"]}
+    assert list(stages) == [
+        "extract_log_keys", "transform_elb_logs", "enrich_with_geolocation", "add_advanced_features",
+        "write_cleaned_logs", "write_hourly_aggregation", "write_error_report", "write_bot_traffic_reports",
+    ]
+    transform = stages["transform_elb_logs"]
+    assert transform["lines_read"] == sum(f["lines"] for f in files)
+    assert transform["rows_out"] == len(cleaned)
+    # Blank lines are skipped without being counted as rejected
+    assert transform["rejected_lines"] <= transform["lines_read"] - transform["rows_out"]
+    assert transform["bytes_read"] == sum(f["bytes"] for f in files)
+    geo = stages["enrich_with_geolocation"]
+    assert geo["api_requests"] == 1 and geo["geo_cache_misses"] == 60 and geo["geo_cache_hit_rate"] == 0
+    assert stages["write_cleaned_logs"]["bytes_written"] > 0
+
+    # Second run: nothing new to process
+    geo_requests = geo_stub_server.requests
+    advanced_elb_logs_etl.main()
+    assert len(pd.read_parquet("output/cleaned_logs")) == len(cleaned)
+    assert geo_stub_server.requests == geo_requests
+
+def test_failed_writer_leaves_the_files_for_the_next_run(tmp_path, monkeypatch, geo_stub_server):
+    files = generate_log_files(str(tmp_path / "s3" / BUCKET), files=3, lines_per_file=100, clients=20)
+    point_etl_at_local_s3(tmp_path, monkeypatch, geo_stub_server.url)
+    def broken(df, keys):
+        raise OSError("disk full")
+    with monkeypatch.context() as m:
+        m.setattr(advanced_elb_logs_etl, "cleaned_record_batch", broken)
+        assert advanced_elb_logs_etl.main(report_path="output/run1.json") == "degraded"
+    # The writer swallowed its error, but nothing is recorded as processed
+    assert not os.path.exists(advanced_elb_logs_etl.MANIFEST_PATH)
+    assert not os.path.exists(advanced_elb_logs_etl.SESSION_STATE_DIR)
+    assert json.load(open("output/run1.json"))["processed_objects"] == 0
+
+    assert advanced_elb_logs_etl.main(report_path="output/run2.json") == "ok"
+    assert json.load(open("output/run2.json"))["new_objects"] == 3
+    assert len(pd.read_parquet("output/cleaned_logs")) > 250
+    assert sorted(pd.read_parquet(advanced_elb_logs_etl.MANIFEST_PATH)["key"]) == [f["key"] for f in files]
+
+def test_parse_time_bound():
+    parse = advanced_elb_logs_etl.parse_time_bound
+    assert parse("") is None and parse(None) is None
+    assert parse("2025-05-27") == pd.Timestamp("2025-05-27T00:00:00Z")
+    assert parse("2025-05-27T02:00:00-04:00") == pd.Timestamp("2025-05-27T06:00:00Z")
+    assert abs(parse("-1d") - (pd.Timestamp.now(tz="UTC") - pd.Timedelta("1D"))) < pd.Timedelta("1min")
+
+def test_iter_log_objects_lists_only_the_days_in_range(tmp_path, monkeypatch):
+    # Hourly files from 2025-05-26T01:00Z to 2025-05-27T16:00Z (file names carry the interval end)
+    files = generate_log_files(str(tmp_path / "s3" / BUCKET), files=40, lines_per_file=1, clients=5, interval_minutes=60)
+    calls = point_etl_at_local_s3(tmp_path, monkeypatch)
+    monkeypatch.setattr(advanced_elb_logs_etl, "ELB_LOG_INTERVAL_MINUTES", 60)
+
+    objects = advanced_elb_logs_etl.iter_log_objects(BUCKET, "", "2025-05-27T02:00Z", "2025-05-27T05:00Z", workers=4)
+    assert not isinstance(objects, list)
+    keys = [obj["key"] for obj in objects]
+    expected = [f["key"] for f in files if any(f"_20250527T{h:02d}00Z_" in f["key"] for h in range(2, 6))]
+    assert keys == expected and len(keys) == 4
+    # Only the account/region discovery and the one day prefix were listed
+    region = "AWSLogs/123456789012/elasticloadbalancing/us-west-2/"
+    assert calls == [("AWSLogs/", "/"), ("AWSLogs/123456789012/elasticloadbalancing/", "/"), (region + "2025/05/27/", None)]
+    assert set(next(advanced_elb_logs_etl.iter_log_objects(BUCKET, "", "2025-05-27T02:00Z", "2025-05-27T03:00Z"))) == {"key", "etag", "size", "last_modified"}
+
+    # Ranges crossing midnight list both days; a region prefix skips discovery
+    calls.clear()
+    keys = [o["key"] for o in advanced_elb_logs_etl.iter_log_objects(BUCKET, region, "2025-05-26T23:00Z", "2025-05-27T01:00Z")]
+    assert [k.split("_")[-3] for k in keys] == ["20250526T2300Z", "20250527T0000Z", "20250527T0100Z"]
+    assert calls == [(region + "2025/05/26/", None), (region + "2025/05/27/", None)]
+
+def test_iter_log_objects_falls_back_to_the_plain_prefix_outside_the_elb_layout(tmp_path, monkeypatch):
+    files = generate_log_files(str(tmp_path / "generated"), files=6, lines_per_file=1, clients=5)
+    for f in files:
+        os.renames(f["path"], tmp_path / "s3" / BUCKET / "logs" / os.path.basename(f["key"]))
+    calls = point_etl_at_local_s3(tmp_path, monkeypatch)
+    assert len(advanced_elb_logs_etl.extract_log_keys(BUCKET, "logs/")) == 6
+    # Files ending 00:05 .. 00:30; [00:10, 00:20) needs the ones ending 00:10 .. 00:20
+    keys = [o["key"] for o in advanced_elb_logs_etl.iter_log_objects(BUCKET, "logs/", "2025-05-26T00:10Z", "2025-05-26T00:20Z")]
+    assert keys == ["logs/" + os.path.basename(f["key"]) for f in files[1:4]]
+    assert calls[-1] == ("logs/", None)
+
+def test_main_processes_only_the_requested_time_range(tmp_path, monkeypatch, geo_stub_server):
+    files = generate_log_files(str(tmp_path / "s3" / BUCKET), files=6, lines_per_file=50, clients=20)
+    point_etl_at_local_s3(tmp_path, monkeypatch, geo_stub_server.url)
+    # 5-minute files ending 00:05 .. 00:30; [00:10, 00:20) needs the files ending 00:10 .. 00:20
+    advanced_elb_logs_etl.main(report_path="output/run_report.json", start="2025-05-26T00:10Z", end="2025-05-26T00:20Z")
+    manifest = pd.read_parquet(advanced_elb_logs_etl.MANIFEST_PATH)
+    assert sorted(manifest["key"]) == [f["key"] for f in files[1:4]]
+    report = json.load(open("output/run_report.json"))
+    assert report["listed_objects"] == report["new_objects"] == 3
+    assert report["stages"][0]["rows_out"] == 3
+    assert len(pd.read_parquet("output/cleaned_logs")) > 0
+
+def test_cli_runs_the_stages_through_parquet_files(tmp_path, monkeypatch, geo_stub_server):
+    files = generate_log_files(str(tmp_path / "s3" / BUCKET), files=2, lines_per_file=300, clients=40)
+    point_etl_at_local_s3(tmp_path, monkeypatch, geo_stub_server.url)
+    cli = advanced_elb_logs_etl.cli
+    assert cli(["list", "-o", "work/keys.parquet"]) == 0
+    assert cli(["ingest", "-i", "work/keys.parquet", "-o", "work/parsed.parquet"]) == 0
+    assert cli(["enrich", "-i", "work/parsed.parquet", "-o", "work/enriched.parquet"]) == 0
+    assert cli(["features", "-i", "work/enriched.parquet", "-o", "work/features.parquet", "--run-report", "work/features.json"]) == 0
+    assert cli(["write", "-i", "work/features.parquet", "--keys", "work/keys.parquet"]) == 0
+    assert cli(["report", "-i", "work/features.parquet"]) == 0
+
+    parsed = pd.read_parquet("work/parsed.parquet")
+    cleaned = pd.read_parquet("output/cleaned_logs")
+    assert len(cleaned) == len(parsed) > 550
+    assert isinstance(parsed["elb"].dtype, pd.CategoricalDtype)
+    assert pd.read_parquet("output/aggregated_stats/hourly_traffic_by_geo.parquet")["request_count"].sum() == len(cleaned)
+    assert os.path.exists("output/reports/error_summary_geo.csv")
+    assert [s["stage"] for s in json.load(open("work/features.json"))["stages"]] == ["add_advanced_features"]
+    assert sorted(pd.read_parquet(advanced_elb_logs_etl.MANIFEST_PATH)["key"]) == [f["key"] for f in files]
+    # Everything is recorded, so a full run finds nothing new
+    assert cli(["run", "--run-report", "work/run.json"]) == 0
+    assert json.load(open("work/run.json"))["new_objects"] == 0
+
+def test_cli_reports_failures_in_the_exit_code(tmp_path, monkeypatch):
+    point_etl_at_local_s3(tmp_path, monkeypatch)
+    assert advanced_elb_logs_etl.cli(["enrich", "-i", "missing.parquet", "-o", "out.parquet", "--run-report", "r.json"]) == 1
+    assert json.load(open("r.json"))["status"] == "failed"
+
+def run_in(path, monkeypatch, **kwargs):
+    os.makedirs(path, exist_ok=True)
+    monkeypatch.chdir(path)
+    monkeypatch.setattr(advanced_elb_logs_etl, "_geo_cache_store", None)
+    assert advanced_elb_logs_etl.main(report_path="output/run_report.json", **kwargs) == "ok"
+    by_client = ["client_ip", "time"]
+    return {
+        "cleaned": pd.read_parquet("output/cleaned_logs").sort_values(by_client, ignore_index=True),
+        "hourly": pd.read_parquet("output/aggregated_stats/hourly_traffic_by_geo.parquet"),
+        "errors": pd.read_csv("output/reports/error_summary_geo.csv").sort_values(by_client, ignore_index=True),
+        "bots": pd.read_parquet("output/reports/bot_traffic_details.parquet"),
+        "bot_summary": pd.read_csv("output/reports/bot_traffic_by_origin_summary.csv").sort_values(
+            ["countryName", "isp"], ignore_index=True),
+        "report": json.load(open("output/run_report.json")),
+    }
+
+def test_sharded_run_matches_the_in_memory_run(tmp_path, monkeypatch, geo_stub_server):
+    generate_log_files(str(tmp_path / "s3" / BUCKET), files=4, lines_per_file=300, clients=80)
+    point_etl_at_local_s3(tmp_path, monkeypatch, geo_stub_server.url)
+    monkeypatch.setattr(advanced_elb_logs_etl, "ETL_SPILL_BUFFER_ROWS", 250)
+    monkeypatch.setattr(advanced_elb_logs_etl, "CLEANED_COMPACT_MIN_FILES", 2)
+    memory = run_in(tmp_path / "memory", monkeypatch)
+    sharded = run_in(tmp_path / "sharded", monkeypatch, shards=4, shard_workers=2)
+
+    columns = ["client_ip", "time", "countryName", "city", "session_id", "rolling_5min_req_count",
+               "rolling_1h_avg_proc_time", "status_code_type"]
+    pd.testing.assert_frame_equal(sharded["cleaned"][columns].astype(str), memory["cleaned"][columns].astype(str))
+    pd.testing.assert_frame_equal(sharded["hourly"], memory["hourly"], check_dtype=False, check_categorical=False)
+    pd.testing.assert_frame_equal(sharded["errors"], memory["errors"])
+    pd.testing.assert_frame_equal(sharded["bot_summary"], memory["bot_summary"])
+    assert len(sharded["bots"]) == len(memory["bots"]) > 0
+
+    stages = {s["stage"]: s for s in sharded["report"]["stages"]}
+    assert list(stages) == [
+        "extract_log_keys", "transform_elb_logs", "resolve_geolocations", "process_shards", "compact_cleaned_logs",
+        "write_hourly_aggregation", "write_error_report", "write_bot_traffic_reports",
+    ]
+    transform = stages["transform_elb_logs"]
+    assert transform["shards"] == 4 and transform["spilled_bytes"] > 0
+    assert transform["max_shard_rows"] < transform["rows_out"] == len(memory["cleaned"])
+    assert stages["resolve_geolocations"]["rows_in"] == 80
+    assert stages["process_shards"]["rows_out"] == len(memory["cleaned"])
+    # The shards' part files of a partition were compacted into one
+    assert stages["compact_cleaned_logs"]["compacted_partitions"] >= 1
+    assert all(len(files) <= 1 for _, _, files in os.walk("output/cleaned_logs"))
+    # Bytes come from the files each stage wrote: the compacted files are all still on disk
+    on_disk = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk("output/cleaned_logs") for f in files)
+    assert stages["process_shards"]["bytes_written"] > 0
+    assert 0 < stages["compact_cleaned_logs"]["bytes_written"] <= on_disk
+    # Spill files are removed and the merged session state carries over like the in-memory one
+    assert os.listdir(advanced_elb_logs_etl.ETL_SPILL_DIR) == []
+    for name in ("history", "sessions"):
+        state = [pd.read_parquet(tmp_path / mode / advanced_elb_logs_etl.SESSION_STATE_DIR / f"{name}.parquet")
+                 for mode in ("memory", "sharded")]
+        assert sorted(map(tuple, state[0].astype(str).values)) == sorted(map(tuple, state[1].astype(str).values))
+
+def test_user_agents_classified_in_parse_workers_are_saved(tmp_path, monkeypatch, geo_stub_server):
+    generate_log_files(str(tmp_path / "s3" / BUCKET), files=3, lines_per_file=200, clients=30)
+    point_etl_at_local_s3(tmp_path, monkeypatch, geo_stub_server.url)
+    monkeypatch.setattr(advanced_elb_logs_etl, "ETL_PARSE_WORKERS", 2)
+    monkeypatch.setattr(advanced_elb_logs_etl, "_ua_cache", None)
+    advanced_elb_logs_etl.main()
+    saved = pd.read_parquet(advanced_elb_logs_etl.UA_CACHE_PATH)
+    cleaned = pd.read_parquet("output/cleaned_logs")
+    classified = set(cleaned["user_agent"].dropna().astype(str)) - {"-"}
+    assert classified and classified <= set(saved["user_agent"])
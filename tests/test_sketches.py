@@ -0,0 +1,51 @@
+import sys
+import os
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import sketches
+
+def _ips(n, offset=0):
+    return np.array([f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(offset, offset + n)], dtype=object)
+
+def test_hll_estimates_distinct_counts_per_group():
+    ips = np.concatenate([_ips(3), _ips(3), _ips(50_000, offset=10)])
+    groups = np.array([0] * 6 + [1] * 50_000)
+    estimate = sketches.hll_estimate(*sketches.hll_observe(groups, ips), n_groups=3)
+    assert round(estimate[0]) == 3
+    assert estimate[1] == pytest.approx(50_000, rel=0.05)
+    assert estimate[2] == 0
+
+def test_hll_merge_equals_sketch_of_union():
+    a, b = _ips(20_000), _ips(20_000, offset=10_000)
+    whole = sketches.hll_observe(np.zeros(40_000, dtype=int), np.concatenate([a, b]))
+    parts = [sketches.hll_observe(np.zeros(20_000, dtype=int), x) for x in (a, b)]
+    merged = sketches.hll_merge(*(np.concatenate(cols) for cols in zip(*parts)))
+    for x, y in zip(whole, merged):
+        np.testing.assert_array_equal(x, y)
+
+def test_quantiles_within_relative_accuracy():
+    rng = np.random.default_rng(3)
+    values = rng.gamma(2.0, 80.0, 20_000)
+    values[:5] = np.nan
+    groups = np.repeat([0, 1], 10_000)
+    sketch = sketches.quantile_observe(groups, values)
+    estimate = sketches.quantile_values(*sketch, n_groups=2, qs=[0.5, 0.99])
+    for g in (0, 1):
+        exact = np.nanquantile(values[groups == g], [0.5, 0.99])
+        np.testing.assert_allclose(estimate[g], exact, rtol=sketches.QUANTILE_ACCURACY)
+
+def test_quantile_keys_order_negative_zero_and_positive_values():
+    values = np.array([-50.0, -1.0, 0.0, 0.5, 2.0, 900.0])
+    keys = sketches.quantile_keys(values)
+    assert (np.diff(keys) > 0).all()
+    np.testing.assert_allclose(sketches.quantile_key_values(keys), values, rtol=sketches.QUANTILE_ACCURACY)
+
+def test_pack_unpack_roundtrip_keeps_empty_groups():
+    groups, keys, counts = sketches.quantile_observe(np.array([0, 0, 2]), np.array([1.0, 5.0, 7.0]))
+    key_blobs, value_blobs = sketches.pack(groups, keys, counts, n_groups=3)
+    assert key_blobs[1] == b""
+    for x, y in zip((groups, keys, counts), sketches.unpack(key_blobs, value_blobs, np.int32, np.int64)):
+        np.testing.assert_array_equal(x, y)
@@ -0,0 +1,33 @@
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from string_dictionary import StringDictionary, concat_categoricals
+
+def test_encode_appends_to_shared_categories():
+    strings = StringDictionary()
+    first = strings.encode("elb", np.array(["a", "b", "a", None], dtype=object))
+    second = strings.encode("elb", np.array(["c", "a"], dtype=object))
+    assert list(first.categories) == ["a", "b"]
+    assert list(second.categories) == ["a", "b", "c"]
+    assert first.codes.tolist() == [0, 1, 0, -1]
+    assert second.codes.tolist() == [2, 0]
+    assert len(strings) == 3
+
+def test_concat_categoricals_stacks_codes_of_shared_dictionary():
+    strings = StringDictionary()
+    parts = [strings.encode("ua", pd.Series(values)) for values in (["x", "y"], ["z"], ["y", None])]
+    merged = concat_categoricals(parts)
+    assert list(merged.categories) == ["x", "y", "z"]
+    assert merged.tolist()[:4] == ["x", "y", "z", "y"]
+    assert pd.isna(merged[4])
+
+def test_concat_categoricals_unifies_independent_dictionaries():
+    a = StringDictionary().encode("elb", np.array(["p", "q"], dtype=object))
+    b = StringDictionary().encode("elb", np.array(["q", "r"], dtype=object))
+    merged = concat_categoricals([a, b])
+    assert merged.tolist() == ["p", "q", "q", "r"]
+    assert sorted(merged.categories) == ["p", "q", "r"]